@@ -0,0 +1,206 @@
+"""
+Startup benchmark for RaspFileSend
+Measures how long the Send To window and the configuration window take to appear, and fails
+when a threshold is exceeded or paramiko/cryptography are imported before the window is shown.
+
+Each run starts a fresh interpreter with an empty home folder holding a test configuration,
+so the numbers include interpreter start-up and nothing is cached between runs.
+
+Usage:
+    python benchmark_startup.py                       # 5 runs of each window
+    python benchmark_startup.py --runs 10 --json      # machine-readable results
+    python benchmark_startup.py --profile             # also list the slowest imports
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_LIMIT_MS = 200
+WINDOW_LIMIT_MS = 1000
+
+# Must not be loaded until the window is on screen
+DEFERRED_MODULES = ("paramiko", "cryptography")
+
+# module, expression constructing the window (run with a test file in `sample`)
+TARGETS = {
+    'transfer': ("raspfilesend_transfer", "module.RaspFileSendTransfer([sample])"),
+    'config': ("raspfilesend_config", "module.RaspFileSendConfig()"),
+}
+
+# Runs in the child interpreter and prints one JSON line
+CHILD_SCRIPT = r"""
+import importlib, json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo_dir!r})
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+result = {{'import_ms': (imported - started) * 1000}}
+deferred = {deferred!r}
+if {with_window!r}:
+    sample = {sample!r}
+    app = {construct}
+    app.root.update()
+    result['window_ms'] = (time.perf_counter() - started) * 1000
+    app.root.destroy()
+result['loaded_early'] = sorted(name for name in deferred if name in sys.modules)
+print(json.dumps(result))
+"""
+
+TEST_CONFIG = """[SSH]
+ip = 192.0.2.10
+username = pi
+port = 22
+auth_method = password
+save_password = {save_password}
+encrypted_password = {encrypted_password}
+streams = 4
+
+[TARGET]
+default_directory = /home/pi/uploads
+
+[AGENT]
+enabled = false
+"""
+
+
+def has_display():
+    """tkinter needs a display everywhere except Windows and macOS"""
+    return sys.platform in ("win32", "darwin") or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def make_home(directory):
+    """Write a test configuration (with a saved password when cryptography is available)"""
+    encrypted_password = ""
+    try:
+        sys.path.insert(0, REPO_DIR)
+        from cryptography.fernet import Fernet
+        import base64
+        from raspfilesend_common import get_encryption_key
+        encrypted_password = base64.b64encode(Fernet(get_encryption_key()).encrypt(b"raspberry")).decode()
+    except ImportError:
+        pass
+    with open(os.path.join(directory, ".raspfilesend_config.ini"), 'w') as f:
+        f.write(TEST_CONFIG.format(save_password=str(bool(encrypted_password)).lower(),
+                                   encrypted_password=encrypted_password))
+    sample = os.path.join(directory, "sample.txt")
+    with open(sample, 'w') as f:
+        f.write("RaspFileSend startup benchmark\n")
+    return sample
+
+
+def child_env(home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['USERPROFILE'] = home
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    return env
+
+
+def run_once(target, home, sample, with_window):
+    """Start a fresh interpreter for one target; returns its result with total wall time"""
+    module, construct = TARGETS[target]
+    script = CHILD_SCRIPT.format(repo_dir=REPO_DIR, module=module, deferred=DEFERRED_MODULES,
+                                 with_window=with_window, sample=sample, construct=construct)
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=home, env=child_env(home),
+                               capture_output=True, text=True)
+    total_ms = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"{target} failed to start:\n{completed.stderr.strip()}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = total_ms
+    return result
+
+
+def slowest_imports(target, home, count=15):
+    """Run `python -X importtime` on the target module and return the slowest (cumulative µs, name)"""
+    module, _ = TARGETS[target]
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=REPO_DIR, env=child_env(home), capture_output=True, text=True)
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        entries.append((int(cumulative), name.strip()))
+    entries.sort(reverse=True)
+    return entries[:count]
+
+
+def summarize(values):
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure RaspFileSend window start-up time")
+    parser.add_argument("--runs", type=int, default=5, help="runs per window (default 5)")
+    parser.add_argument("--target", choices=sorted(TARGETS), action="append", help="only this window (repeatable)")
+    parser.add_argument("--import-limit", type=float, default=IMPORT_LIMIT_MS,
+                        help=f"maximum median module import time in ms (default {IMPORT_LIMIT_MS})")
+    parser.add_argument("--window-limit", type=float, default=WINDOW_LIMIT_MS,
+                        help=f"maximum median time to a drawn window in ms (default {WINDOW_LIMIT_MS})")
+    parser.add_argument("--profile", action="store_true", help="list the slowest imports of each module")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with_window = has_display()
+    results = {}
+    failures = []
+
+    with tempfile.TemporaryDirectory() as home:
+        sample = make_home(home)
+        for target in args.target or sorted(TARGETS):
+            runs = [run_once(target, home, sample, with_window) for _ in range(args.runs)]
+            result = {
+                'runs': args.runs,
+                'import_ms': summarize([run['import_ms'] for run in runs]),
+                'process_ms': summarize([run['process_ms'] for run in runs]),
+                'loaded_early': sorted({name for run in runs for name in run['loaded_early']}),
+            }
+            if with_window:
+                result['window_ms'] = summarize([run['window_ms'] for run in runs])
+            if args.profile:
+                result['slowest_imports'] = [{'module': name, 'cumulative_ms': us / 1000}
+                                             for us, name in slowest_imports(target, home)]
+            results[target] = result
+
+            if result['import_ms']['median'] > args.import_limit:
+                failures.append(f"{target}: import took {result['import_ms']['median']:.0f} ms "
+                                f"(limit {args.import_limit:.0f} ms)")
+            if with_window and result['window_ms']['median'] > args.window_limit:
+                failures.append(f"{target}: window took {result['window_ms']['median']:.0f} ms "
+                                f"(limit {args.window_limit:.0f} ms)")
+            if result['loaded_early']:
+                failures.append(f"{target}: {', '.join(result['loaded_early'])} loaded before the window was shown")
+
+    if args.json:
+        print(json.dumps({'window_measured': with_window, 'results': results, 'failures': failures}, indent=2))
+    else:
+        if not with_window:
+            print("ℹ️ No display found; only import times are measured")
+        for target, result in results.items():
+            line = (f"{target:9} import {result['import_ms']['median']:6.0f} ms   "
+                    f"process {result['process_ms']['median']:6.0f} ms")
+            if with_window:
+                line += f"   window {result['window_ms']['median']:6.0f} ms"
+            print(line)
+            for entry in result.get('slowest_imports', []):
+                print(f"    {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Start-up within limits")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
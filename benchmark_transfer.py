@@ -0,0 +1,585 @@
+"""
+Transfer benchmark for RaspFileSend
+Runs standard workloads through the real transfer engine against a local SFTP server, so the
+effect of a change on transfer speed can be measured and compared between runs.
+
+The server is paramiko's SFTP server with the few remote commands the engine uses (mkdir,
+tar, gzip, cat) done in Python, so it needs no sshd and also runs on Windows. It runs in its own
+process and every workload runs in a fresh interpreter, so CPU time and peak memory belong
+to the transfer code alone. Absolute numbers depend on this machine and on the Python server;
+compare runs made on the same machine.
+
+Workloads (sizes are multiplied by --scale):
+    tiny     10,000 files of 100 bytes to 4 KB
+    medium   1,000 files of 256 KB to 2 MB
+    large    one 2 GB file
+    mixed    a folder tree of text, binary and a few large files
+
+Usage:
+    python benchmark_transfer.py                              # every workload, results saved as JSON
+    python benchmark_transfer.py --workload tiny --mode tar   # one workload with other settings
+    python benchmark_transfer.py --scale 0.01 --runs 3        # quick run
+    python benchmark_transfer.py --backend openssh            # through the system ssh client
+    python benchmark_transfer.py --backend local              # engine overhead alone, no SSH
+    python benchmark_transfer.py --compare benchmark_results/transfer-20240101-120000.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmark_results")
+
+# Test data is built from slices of one pseudo-random pool, so it is reproducible and fast to
+# write, yet does not compress (binary files) unless it is meant to (text files)
+SEED = 20240229
+POOL_SIZE = 4 * 1024 * 1024
+TEXT_LINE = b"2024-02-29 12:00:00 INFO raspfilesend benchmark line with some repeated text\n"
+
+KB = 1024
+MB = 1024 * 1024
+
+# Seconds the server keeps a finished command's channel open, see run_command
+CLOSE_DELAY = 0.5
+
+# name -> description; the layout itself is made by make_workload
+WORKLOADS = {
+    'tiny': "10,000 files of 100 bytes to 4 KB",
+    'medium': "1,000 files of 256 KB to 2 MB",
+    'large': "one 2 GB file",
+    'mixed': "folder tree of text, binary and a few large files",
+}
+
+
+# --- Test data ------------------------------------------------------------------------------
+
+def workload_files(name, scale):
+    """Yield (relative path, size, kind) for a workload; kind is "binary" or "text" """
+    rng = random.Random(f"{SEED}-{name}")
+    if name == 'tiny':
+        for i in range(max(1, int(10000 * scale))):
+            yield f"tiny/d{i // 500:02d}/f{i:05d}.txt", rng.randint(100, 4 * KB), "text"
+    elif name == 'medium':
+        for i in range(max(1, int(1000 * scale))):
+            yield f"medium/f{i:04d}.bin", rng.randint(256 * KB, 2 * MB), "binary"
+    elif name == 'large':
+        yield "large/image.img", max(MB, int(2048 * MB * scale)), "binary"
+    elif name == 'mixed':
+        for i in range(max(1, int(2000 * scale))):
+            folder = f"mixed/src/m{i % 20:02d}/p{i % 7}"
+            if i % 10 < 6:
+                yield f"{folder}/file{i:04d}.py", rng.randint(200, 20 * KB), "text"
+            elif i % 10 < 9:
+                yield f"{folder}/asset{i:04d}.png", rng.randint(20 * KB, 500 * KB), "binary"
+            else:
+                yield f"{folder}/data{i:04d}.log", rng.randint(100 * KB, 4 * MB), "text"
+        for i in range(max(1, int(4 * scale))):
+            yield f"mixed/release/build{i}.tar.gz", max(MB, int(64 * MB * scale)), "binary"
+    else:
+        raise ValueError(f"unknown workload {name}")
+
+
+def write_file(path, size, kind, pool, rng):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            if kind == "text":
+                block = TEXT_LINE * (min(remaining, MB) // len(TEXT_LINE) + 1)
+            else:
+                offset = rng.randrange(POOL_SIZE // 2)
+                block = pool[offset:offset + POOL_SIZE // 2]
+            block = block[:remaining]
+            f.write(block)
+            remaining -= len(block)
+
+
+def make_workload(data_dir, name, scale):
+    """Create (or reuse) the files of a workload; returns (top folder, file count, total bytes)"""
+    files = list(workload_files(name, scale))
+    count, total = len(files), sum(size for _, size, _ in files)
+    root = os.path.join(data_dir, f"{name}-{scale:g}")
+    marker = os.path.join(root, ".complete")
+    top = os.path.join(root, name)
+    if os.path.exists(marker):
+        return top, count, total
+
+    shutil.rmtree(root, ignore_errors=True)
+    rng = random.Random(SEED)
+    pool = rng.randbytes(POOL_SIZE)
+    for relative, size, kind in files:
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, size, kind, pool, rng)
+    with open(marker, 'w') as f:
+        f.write(f"{count} {total}\n")
+    return top, count, total
+
+
+# --- Local SFTP server (runs in its own process) --------------------------------------------
+
+def serve(port_file):
+    """Serve SFTP and the engine's remote commands on 127.0.0.1 until killed"""
+    import paramiko
+    from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+    class Handle(SFTPHandle):
+        def stat(self):
+            try:
+                return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        def chattr(self, attr):
+            try:
+                SFTPServer.set_file_attr(self.filename, attr)
+                return paramiko.SFTP_OK
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+    class LocalSFTP(SFTPServerInterface):
+        """The client's paths are used as local paths as they are"""
+
+        def list_folder(self, path):
+            try:
+                entries = []
+                for name in os.listdir(path):
+                    attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                    attr.filename = name
+                    entries.append(attr)
+                return entries
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        def stat(self, path):
+            try:
+                return SFTPAttributes.from_stat(os.stat(path))
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o666)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                mode = 'rb'
+            handle = Handle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def _call(self, function, *args):
+            try:
+                function(*args)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def remove(self, path):
+            return self._call(os.remove, path)
+
+        def rename(self, old, new):
+            return self._call(os.rename, old, new)
+
+        def posix_rename(self, old, new):
+            return self._call(os.replace, old, new)
+
+        def mkdir(self, path, attr):
+            return self._call(os.mkdir, path)
+
+        def rmdir(self, path):
+            return self._call(os.rmdir, path)
+
+        def chattr(self, path, attr):
+            return self._call(SFTPServer.set_file_attr, path, attr)
+
+        def canonicalize(self, path):
+            return os.path.abspath(path)
+
+    class Server(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            threading.Thread(target=run_command, args=(channel, command), daemon=True).start()
+            return True
+
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    with open(port_file, 'w') as f:
+        f.write(str(listener.getsockname()[1]))
+
+    while True:
+        client, _ = listener.accept()
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler('sftp', SFTPServer, LocalSFTP)
+        try:
+            transport.start_server(server=Server())
+        except Exception:
+            pass
+
+
+class ChannelReader:
+    """File-like reader over a channel's stdin, for tarfile and gzip"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = []
+            for chunk in iter(lambda: self.channel.recv(MB), b''):
+                chunks.append(chunk)
+            return b"".join(chunks)
+        return self.channel.recv(size)
+
+
+class GunzipReader:
+    """Decompress one or more concatenated gzip members, as `gzip -dc` does"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = b''
+        self.position = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) - self.position < size):
+            chunk = self.raw.read(MB)
+            if not chunk:
+                self.eof = True
+                break
+            data = []
+            while chunk:
+                if self.decompressor.eof:
+                    self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data.append(self.decompressor.decompress(chunk))
+                chunk = self.decompressor.unused_data
+            self.buffer = self.buffer[self.position:] + b"".join(data)
+            self.position = 0
+        end = len(self.buffer) if size < 0 else self.position + size
+        data = self.buffer[self.position:end]
+        self.position += len(data)
+        return data
+
+
+def run_command(channel, command):
+    """Do what the Pi would do for the commands the engine sends"""
+    status = 0
+    try:
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+        args = shlex.split(command)
+        if args[:2] == ["mkdir", "-p"]:
+            for path in args[2:]:
+                if path != "--":
+                    os.makedirs(path, exist_ok=True)
+        elif args == ["cat", ">", "/dev/null"]:
+            for _ in iter(lambda: channel.recv(MB), b''):
+                pass
+        elif args[:3] == ["gzip", "-dc", ">"]:
+            reader = GunzipReader(ChannelReader(channel))
+            with open(args[3], 'wb') as f:
+                for chunk in iter(lambda: reader.read(MB), b''):
+                    f.write(chunk)
+        elif args[:2] == ["tar", "-x"]:
+            target = args[args.index("-C") + 1]
+            reader = ChannelReader(channel)
+            if "-z" in args:
+                reader = GunzipReader(reader)
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                if hasattr(tarfile, 'tar_filter'):
+                    tar.extractall(target, filter='tar')
+                else:
+                    tar.extractall(target)
+        elif os.name == 'posix':
+            completed = subprocess.run(command, shell=True, capture_output=True)
+            channel.sendall(completed.stdout)
+            channel.sendall_stderr(completed.stderr)
+            status = completed.returncode
+        else:
+            channel.sendall_stderr(f"benchmark server cannot run: {command}\n".encode())
+            status = 127
+    except Exception as e:
+        channel.sendall_stderr(f"{e}\n".encode())
+        status = 1
+    channel.send_exit_status(status)
+    # paramiko answers the exec request only after check_channel_exec_request returns; closing at
+    # once could overtake that answer for quick commands. The client does not wait for the close.
+    threading.Timer(CLOSE_DELAY, channel.close).start()
+
+
+def start_server(work_dir):
+    """Start the server process; returns (process, port)"""
+    port_file = os.path.join(work_dir, "port")
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", port_file],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if os.path.exists(port_file) and open(port_file).read().strip():
+            return process, int(open(port_file).read())
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("benchmark server did not start")
+
+
+# --- One measured run (in a fresh interpreter) ----------------------------------------------
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak / (MB if sys.platform == "darwin" else KB)
+    except ImportError:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / MB
+
+
+def run_child(spec):
+    """Send one workload with the real engine and print the measurements as one JSON line"""
+    import configparser
+    sys.path.insert(0, REPO_DIR)
+    from raspfilesend_backend import open_backend
+    from raspfilesend_engine import run_transfer
+
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'SSH': {'ip': '127.0.0.1', 'port': str(spec['port']), 'username': 'bench', 'auth_method': 'password',
+                'streams': str(spec['settings']['streams']),
+                'chunk_threshold_mb': str(spec['settings']['chunk_threshold_mb']),
+                'backend': spec['settings']['backend']},
+        'TRANSFER': {'mode': spec['settings']['mode'], 'compression': spec['settings']['compression']},
+    })
+    backend = open_backend(config, "bench")
+    failures = []
+    cpu_started = os.times()
+    started = time.perf_counter()
+    try:
+        completed, uploader = run_transfer(backend, config, [spec['source']], spec['target'], lambda message: None,
+                                               ask_overwrite=lambda filename: "yes_all",
+                                               report=lambda outcome, name, **details: failures.append(name)
+                                               if outcome == 'failed' else None)
+    finally:
+        backend.close()
+    seconds = time.perf_counter() - started
+    cpu_finished = os.times()
+    cpu_seconds = (cpu_finished.user - cpu_started.user) + (cpu_finished.system - cpu_started.system)
+    print(json.dumps({
+        'completed': completed,
+        'transferred': uploader.transferred,
+        'failed': len(failures),
+        'seconds': seconds,
+        'cpu_seconds': cpu_seconds,
+        'peak_memory_mb': peak_memory_mb(),
+    }))
+
+
+def check_copy(source, target):
+    """Compare file count and sizes of the copy with the source; returns a problem or None"""
+    expected = {}
+    for folder, _, files in os.walk(source):
+        for name in files:
+            path = os.path.join(folder, name)
+            expected[os.path.relpath(path, source)] = os.path.getsize(path)
+    copy = os.path.join(target, os.path.basename(source))
+    for relative, size in expected.items():
+        path = os.path.join(copy, relative)
+        if not os.path.exists(path):
+            return f"missing {relative}"
+        if os.path.getsize(path) != size:
+            return f"size differs for {relative}"
+    return None
+
+
+def run_workload(name, source, count, total, port, remote_dir, settings, home):
+    """Run one workload in a fresh interpreter and add the derived rates"""
+    target = os.path.join(remote_dir, name)
+    shutil.rmtree(target, ignore_errors=True)
+    spec = {'source': source, 'target': target, 'port': port, 'settings': settings}
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                               capture_output=True, text=True, env=env)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{completed.stderr.strip()}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    problem = check_copy(source, target)
+    shutil.rmtree(target, ignore_errors=True)
+    seconds = max(result['seconds'], 1e-6)
+    result.update({
+        'files': count,
+        'bytes': total,
+        'files_per_s': count / seconds,
+        'mb_per_s': total / MB / seconds,
+        'cpu_percent': 100 * result['cpu_seconds'] / seconds,
+        'verified': problem is None and result['completed'] and not result['failed'],
+    })
+    if problem:
+        result['problem'] = problem
+    return result
+
+
+# --- Reporting ------------------------------------------------------------------------------
+
+METRICS = ('files_per_s', 'mb_per_s', 'cpu_seconds', 'peak_memory_mb', 'seconds')
+
+
+def summarize(runs):
+    """Median of every metric over the runs"""
+    summary = {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+    summary.update({'runs': len(runs), 'files': runs[0]['files'], 'bytes': runs[0]['bytes'],
+                    'verified': all(run['verified'] for run in runs)})
+    problems = [run['problem'] for run in runs if 'problem' in run]
+    if problems:
+        summary['problem'] = problems[0]
+    return summary
+
+
+def git_commit():
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                   capture_output=True, text=True)
+        return completed.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, previous=None):
+    print(f"{'workload':9} {'files/s':>10} {'MB/s':>8} {'CPU s':>7} {'peak MB':>8} {'time s':>7}")
+    for name, result in results.items():
+        line = (f"{name:9} {result['files_per_s']:10.0f} {result['mb_per_s']:8.1f} {result['cpu_seconds']:7.1f} "
+                f"{result['peak_memory_mb']:8.0f} {result['seconds']:7.1f}")
+        if not result['verified']:
+            line += f"   ❌ {result.get('problem', 'transfer failed')}"
+        print(line)
+        old = (previous or {}).get(name)
+        if old and old.get('files') == result['files'] and old.get('bytes') == result['bytes']:
+            changes = []
+            for metric, label in (('mb_per_s', "MB/s"), ('cpu_seconds', "CPU"), ('peak_memory_mb', "memory")):
+                if old.get(metric):
+                    changes.append(f"{label} {100 * (result[metric] / old[metric] - 1):+.0f}%")
+            print(f"{'':9} vs. previous: {', '.join(changes)}")
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve":
+        serve(sys.argv[2])
+        return
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        run_child(json.loads(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description="Measure RaspFileSend transfer speed against a local SFTP server")
+    parser.add_argument("--workload", choices=list(WORKLOADS), action="append", help="only this workload (repeatable)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per workload; the median is reported (default 1)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply file counts and sizes (default 1)")
+    parser.add_argument("--mode", choices=["auto", "sftp", "tar"], default="auto", help="transfer mode")
+    parser.add_argument("--streams", type=int, default=4, help="parallel SFTP streams (default 4)")
+    parser.add_argument("--compression", choices=["auto", "on", "off"], default="off",
+                        help="compression mode (default off, so runs do not depend on the measured link)")
+    parser.add_argument("--backend", choices=["paramiko", "openssh", "local"], default="paramiko",
+                        help="transport backend; local copies on this disk without SSH (default paramiko)")
+    parser.add_argument("--chunk-threshold-mb", type=float, default=256, help="large-file threshold (default 256)")
+    parser.add_argument("--data-dir", help="keep the generated test files here and reuse them in later runs")
+    parser.add_argument("--output", help="results file (default benchmark_results/transfer-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    settings = {'mode': args.mode, 'streams': args.streams, 'compression': args.compression,
+                'chunk_threshold_mb': args.chunk_threshold_mb, 'backend': args.backend}
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_dir = args.data_dir or os.path.join(work_dir, "data")
+        remote_dir = os.path.join(work_dir, "remote")
+        home = os.path.join(work_dir, "home")
+        for folder in (data_dir, remote_dir, home):
+            os.makedirs(folder, exist_ok=True)
+
+        server, port = start_server(work_dir)
+        try:
+            for name in args.workload or list(WORKLOADS):
+                if not args.json:
+                    print(f"⏱️ {name}: {WORKLOADS[name]} (scale {args.scale:g})", flush=True)
+                source, count, total = make_workload(data_dir, name, args.scale)
+                runs = [run_workload(name, source, count, total, port, remote_dir, settings, home)
+                        for _ in range(args.runs)]
+                results[name] = summarize(runs)
+        finally:
+            server.kill()
+            server.wait()
+
+    report = {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'settings': settings,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("transfer-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_results(results, previous)
+        print(f"💾 Results saved to {output}")
+    sys.exit(0 if all(result['verified'] for result in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
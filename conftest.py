@@ -0,0 +1,220 @@
+"""
+Shared pytest fixtures for RaspFileSend
+A small SSH server on localhost stands in for the Pi: its SFTP subsystem works on local files
+and its commands run in the local shell (sh), so no Pi is needed to test the transfer engine
+"""
+
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+import pytest
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+
+def _sftp_errors(call):
+    """Turn an OSError from a file operation into the matching SFTP status code"""
+    def wrapper(*args):
+        try:
+            result = call(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK if result is None else result
+    return wrapper
+
+
+class LocalHandle(SFTPHandle):
+    @_sftp_errors
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    @_sftp_errors
+    def chattr(self, attr):
+        SFTPServer.set_file_attr(self.filename, attr)
+
+
+class LocalSFTPServer(SFTPServerInterface):
+    """SFTP on the local file system; every session is counted on the LocalPi"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.pi = server.pi
+
+    def session_started(self):
+        self.pi.session_opened()
+
+    def session_ended(self):
+        self.pi.session_closed()
+
+    @_sftp_errors
+    def list_folder(self, path):
+        listing = []
+        for name in os.listdir(path):
+            attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+            attr.filename = name
+            listing.append(attr)
+        return listing
+
+    @_sftp_errors
+    def stat(self, path):
+        return SFTPAttributes.from_stat(os.stat(path))
+
+    @_sftp_errors
+    def lstat(self, path):
+        return SFTPAttributes.from_stat(os.lstat(path))
+
+    @_sftp_errors
+    def open(self, path, flags, attr):
+        fd = os.open(path, flags, 0o666)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = LocalHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    @_sftp_errors
+    def remove(self, path):
+        os.remove(path)
+
+    @_sftp_errors
+    def rename(self, old_path, new_path):
+        os.rename(old_path, new_path)
+
+    @_sftp_errors
+    def posix_rename(self, old_path, new_path):
+        os.replace(old_path, new_path)
+
+    @_sftp_errors
+    def mkdir(self, path, attr):
+        os.mkdir(path)
+
+    @_sftp_errors
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    @_sftp_errors
+    def chattr(self, path, attr):
+        SFTPServer.set_file_attr(path, attr)
+
+    def canonicalize(self, path):
+        return os.path.realpath(path)
+
+
+class LocalServer(paramiko.ServerInterface):
+    """Accepts any password and runs exec requests in the local shell"""
+
+    def __init__(self, pi):
+        self.pi = pi
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_global_request(self, kind, msg):
+        return False
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._run, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _run(channel, command):
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+
+        def pump_stdin():
+            for data in iter(lambda: channel.recv(65536), b''):
+                process.stdin.write(data)
+            process.stdin.close()
+
+        def pump_stderr():
+            for data in iter(lambda: process.stderr.read1(65536), b''):
+                channel.sendall_stderr(data)
+
+        pumps = [threading.Thread(target=pump, daemon=True) for pump in (pump_stdin, pump_stderr)]
+        for pump in pumps:
+            pump.start()
+        for data in iter(lambda: process.stdout.read1(65536), b''):
+            channel.sendall(data)
+        pumps[1].join()
+        channel.send_exit_status(process.wait())
+        channel.close()
+
+
+class LocalPi:
+    """An SSH server on 127.0.0.1 standing in for the Pi"""
+
+    def __init__(self):
+        self._key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+        self._lock = threading.Lock()
+        # SFTP sessions opened in all, open right now, and the most that were ever open at once
+        self.opened = 0
+        self.sessions = 0
+        self.most_sessions = 0
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            connection, _ = self._socket.accept()
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(self._key)
+            transport.set_subsystem_handler('sftp', SFTPServer, LocalSFTPServer)
+            try:
+                transport.start_server(server=LocalServer(self))
+            except (paramiko.SSHException, EOFError):
+                pass
+
+    def session_opened(self):
+        with self._lock:
+            self.opened += 1
+            self.sessions += 1
+            self.most_sessions = max(self.most_sessions, self.sessions)
+
+    def session_closed(self):
+        with self._lock:
+            self.sessions -= 1
+
+    def connect(self):
+        """A logged-in paramiko SSHClient"""
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect('127.0.0.1', port=self.port, username='pi', password='raspberry',
+                    allow_agent=False, look_for_keys=False)
+        return ssh
+
+
+@pytest.fixture(scope='session')
+def pi_server():
+    return LocalPi()
+
+
+@pytest.fixture
+def pi(pi_server):
+    """The local test Pi, with its session counters reset"""
+    pi_server.opened = 0
+    pi_server.most_sessions = pi_server.sessions
+    return pi_server
+
+
+@pytest.fixture
+def ssh(pi):
+    """A paramiko connection to the local test Pi, closed after the test"""
+    client = pi.connect()
+    yield client
+    client.close()
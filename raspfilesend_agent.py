@@ -0,0 +1,283 @@
+"""
+Resident transfer agent for RaspFileSend
+Keeps an authenticated SSH connection warm in the background so Send To transfers start
+immediately. raspfilesend_transfer.py hands its file list to the agent over a local pipe.
+
+Usage:
+    python raspfilesend_agent.py          # run the agent (normally started automatically)
+    python raspfilesend_agent.py --stop   # ask a running agent to exit
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from raspfilesend_common import connection_id, read_config
+from raspfilesend_engine import run_transfer, summarize_sync
+from raspfilesend_history import expected_rate
+from raspfilesend_ipc import connect, listen
+from raspfilesend_pool import ConnectionPool
+from raspfilesend_progress import ProgressTracker
+from raspfilesend_throttle import TokenBucket, get_rate_limits
+
+AGENT_ENDPOINT = "agent"
+DEFAULT_IDLE_MINUTES = 30
+KEEPALIVE_SECONDS = 15
+START_TIMEOUT = 10.0
+
+
+class TransferAgent:
+    """Background process that keeps SSH connections warm and runs transfer jobs on them"""
+
+    def __init__(self, idle_minutes=DEFAULT_IDLE_MINUTES):
+        self.idle_seconds = idle_minutes * 60
+        # Connections stay open as long as the agent itself, unless they die
+        self.pool = ConnectionPool(keepalive=KEEPALIVE_SECONDS, idle_seconds=self.idle_seconds)
+        self.active_jobs = 0
+        self.last_activity = time.monotonic()
+        # Shared by every job, so the window can change the limit of a running transfer
+        self.rate_limit = TokenBucket(get_rate_limits(read_config())[0])
+        self._state_lock = threading.Lock()
+
+    def serve_forever(self):
+        listener = listen(AGENT_ENDPOINT)
+        threading.Thread(target=self._idle_watch, daemon=True).start()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                continue  # Failed handshake (wrong key or client gave up)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self.pool.close_all()
+        # The agent is a dedicated process; exiting also releases the pipe
+        os._exit(0)
+
+    def _idle_watch(self):
+        while True:
+            time.sleep(30)
+            with self._state_lock:
+                idle = self.active_jobs == 0 and time.monotonic() - self.last_activity > self.idle_seconds
+            if idle:
+                self.stop()
+
+    def _handle(self, conn):
+        try:
+            request = conn.recv()
+            command = request.get('cmd')
+            if command == 'status':
+                conn.send(self._status())
+            elif command == 'warm':
+                # Connect ahead of time with saved credentials so the first transfer starts at once
+                try:
+                    self._connection(read_config(), None)
+                    conn.send(self._status())
+                except Exception as e:
+                    conn.send({'event': 'error', 'message': str(e)})
+            elif command == 'test':
+                self._test_connection(conn, request)
+            elif command == 'transfer':
+                self._run_job(conn, request)
+            elif command == 'set_rate':
+                self.rate_limit.set_rate(request.get('rate', 0))
+                conn.send(self._status())
+            elif command == 'shutdown':
+                conn.send({'event': 'bye'})
+                self.stop()
+        except (EOFError, OSError):
+            pass  # Client went away
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _status(self):
+        connections = self.pool.live_connections()
+        # connected_to is the most recently used connection, for clients that only know one Pi
+        return {'event': 'status', 'connected_to': connections[0] if connections else None,
+                'connections': connections}
+
+    def _connection(self, config, password):
+        """Return (backend, reused) from the pool and hand it straight back, so it stays warm"""
+        backend, reused = self.pool.acquire(config, password)
+        self.pool.release(backend)
+        return backend, reused
+
+    def _test_connection(self, conn, request):
+        """Log in afresh with the configuration tool's settings and keep that connection warm
+
+        A transfer that follows the test then reuses it instead of paying for a second handshake.
+        """
+        config = read_config()
+        try:
+            with self.pool.connection(config, request.get('password'), fresh=True) as (backend, reused):
+                backend.mkdir_many([request.get('target_dir') or '.'])
+            conn.send(self._status())
+        except Exception as e:
+            conn.send({'event': 'error', 'message': str(e)})
+
+    def _run_job(self, conn, request):
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                conn.send(message)
+
+        def log(message):
+            send({'event': 'log', 'message': message})
+
+        def report(outcome, name, **details):
+            send(dict(details, event='file', outcome=outcome, name=name))
+
+        def ask_overwrite(filename):
+            # The uploader only lets one worker ask at a time, so replies cannot interleave
+            send({'event': 'ask_overwrite', 'filename': filename})
+            return conn.recv().get('answer', 'cancel')
+
+        def resolve_conflicts(conflicts):
+            # Sent before any upload starts, so nothing else is on the pipe while the user decides
+            send({'event': 'resolve_conflicts', 'conflicts': conflicts})
+            return conn.recv().get('resolutions')
+
+        with self._state_lock:
+            self.active_jobs += 1
+        acquired = None
+        try:
+            config = read_config()
+            if 'max_rate' in request:
+                self.rate_limit.set_rate(request['max_rate'])
+            backend, reused = self.pool.acquire(config, request.get('password'))
+            acquired = backend
+            log("♻️ Using warm connection from the transfer agent" if reused else "✅ Connected successfully!")
+
+            # Throttled by the tracker, so a fast link does not flood the client
+            progress = ProgressTracker(on_update=lambda snapshot: send({'event': 'progress', 'progress': snapshot}),
+                                       initial_rate=expected_rate(config, connection_id(config)[0]))
+            completed, uploader = run_transfer(backend, config, request['files'], request['target_dir'], log,
+                                               ask_overwrite=ask_overwrite,
+                                               sync=request.get('sync', False), mirror=request.get('mirror', False),
+                                               report=report, progress=progress,
+                                               resolve_conflicts=resolve_conflicts if request.get('prescan') else None,
+                                               rate_limit=self.rate_limit, low_priority=request.get('low_priority'))
+            send({'event': 'progress', 'progress': progress.snapshot(force=True)})
+            send({
+                'event': 'done',
+                'completed': completed,
+                'transferred': uploader.transferred,
+                'skipped': uploader.skipped,
+                'unchanged': uploader.unchanged,
+                'removed': uploader.removed,
+                'failed': uploader.failed,
+                'summary': summarize_sync(uploader) if uploader.sync else None,
+            })
+        except Exception as e:
+            send({'event': 'error', 'message': str(e)})
+        finally:
+            if acquired is not None:
+                self.pool.release(acquired)
+            with self._state_lock:
+                self.active_jobs -= 1
+                self.last_activity = time.monotonic()
+
+
+def start_agent_process():
+    """Launch the agent as a detached background process"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raspfilesend_agent.py")
+    python = sys.executable
+    kwargs = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL,
+              'close_fds': True}
+    if sys.platform == "win32":
+        # pythonw avoids a console window for the background process
+        pythonw = os.path.join(os.path.dirname(python), "pythonw.exe")
+        if os.path.exists(pythonw):
+            python = pythonw
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen([python, script], **kwargs)
+
+
+def ensure_agent(timeout=START_TIMEOUT):
+    """Connect to the agent, starting it first if it is not running"""
+    conn = connect(AGENT_ENDPOINT)
+    if conn is not None:
+        return conn
+    start_agent_process()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        conn = connect(AGENT_ENDPOINT)
+        if conn is not None:
+            return conn
+    raise RuntimeError("transfer agent did not start")
+
+
+def agent_request(message, start=True):
+    """Send one request and return the single reply (None if no agent is running and start is False)"""
+    conn = ensure_agent() if start else connect(AGENT_ENDPOINT)
+    if conn is None:
+        return None
+    try:
+        conn.send(message)
+        return conn.recv()
+    finally:
+        conn.close()
+
+
+def run_agent_transfer(job, log, ask_overwrite, report=None, on_progress=None, resolve_conflicts=None):
+    """Hand a transfer job to the agent and relay its events; returns the final 'done' or 'error' event
+
+    on_progress(snapshot) receives the agent's ProgressTracker snapshots a few times a second.
+    resolve_conflicts(conflicts) turns on the conflict pre-scan, see run_transfer.
+    """
+    conn = ensure_agent()
+    try:
+        conn.send(dict(job, cmd='transfer', prescan=resolve_conflicts is not None))
+        while True:
+            event = conn.recv()
+            kind = event.get('event')
+            if kind == 'log':
+                log(event['message'])
+            elif kind == 'ask_overwrite':
+                conn.send({'answer': ask_overwrite(event['filename'])})
+            elif kind == 'resolve_conflicts':
+                conn.send({'resolutions': resolve_conflicts(event['conflicts'])})
+            elif kind == 'file':
+                if report:
+                    details = {key: value for key, value in event.items() if key not in ('event', 'outcome', 'name')}
+                    report(event['outcome'], event['name'], **details)
+            elif kind == 'progress':
+                if on_progress:
+                    on_progress(event['progress'])
+            elif kind in ('done', 'error'):
+                return event
+    except EOFError:
+        return {'event': 'error', 'message': "transfer agent closed the connection"}
+    finally:
+        conn.close()
+
+
+def main():
+    if "--stop" in sys.argv[1:]:
+        reply = agent_request({'cmd': 'shutdown'}, start=False)
+        print("Transfer agent stopped." if reply else "Transfer agent is not running.")
+        return
+
+    config = read_config()
+    try:
+        idle_minutes = float(config.get('AGENT', 'idle_minutes', fallback=str(DEFAULT_IDLE_MINUTES)))
+    except ValueError:
+        idle_minutes = DEFAULT_IDLE_MINUTES
+    try:
+        TransferAgent(idle_minutes).serve_forever()
+    except OSError:
+        # Another agent already owns the pipe
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
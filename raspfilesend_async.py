@@ -0,0 +1,601 @@
+"""
+Asyncio transfer engine for RaspFileSend
+Sends to many Pis, and many files per Pi, from one event loop instead of a thread per host and
+per upload stream, for groups with hundreds of uploads in flight. Used for group transfers
+(window and command line) when [TRANSFER] engine = async.
+
+With asyncssh installed (pip install asyncssh) every Pi gets one connection with one SFTP session,
+and each upload keeps several writes in flight on it. Without asyncssh, or with [SSH] backend =
+openssh or local, the loop drives the usual backends (raspfilesend_backend) on a few worker
+threads per Pi; scheduling, limits and cancellation work the same.
+
+Backpressure: found files wait in a short queue per Pi, [FLEET] max_streams uploads run at a time
+across all Pis, and an upload holds at most WRITES_IN_FLIGHT blocks. Cancelling stops new uploads
+and aborts the running ones, removing their partial files.
+
+Files are sent as they are: tar streams, compression and resumable chunks stay with the threaded
+engine, which is also used for mirror, relay and low priority transfers.
+"""
+
+import asyncio
+import functools
+import itertools
+import os
+import posixpath
+import shlex
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from raspfilesend_backend import open_backend
+from raspfilesend_common import connection_id, get_backend
+from raspfilesend_engine import get_stream_count, is_unchanged
+from raspfilesend_fleet import FleetTransfer, SharedReadPool, get_fleet_limits, host_config
+from raspfilesend_progress import count_in_background, format_size
+from raspfilesend_throttle import TokenBucket, get_rate_limits
+from raspfilesend_trace import NULL_TRACER, start_trace
+from raspfilesend_walk import mkdir_commands, walk_files
+
+# Local reads happen in READ_SIZE blocks, sent as WRITE_SIZE SFTP writes (the size every server takes)
+READ_SIZE = 1024 * 1024
+WRITE_SIZE = 32 * 1024
+WRITES_IN_FLIGHT = 64
+
+# Files taken from the folder walk at a time; their remote copies are looked up together
+WALK_BATCH = 256
+
+# Threads for local disk reads and folder walks, shared by every Pi
+DISK_THREADS = 8
+
+# How long a cancelled upload may take to remove its partial file
+DISCARD_TIMEOUT = 5
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_engine(config):
+    """Read the engine from the [TRANSFER] section: threads (default) or async"""
+    engine = config.get('TRANSFER', 'engine', fallback='threads').strip().lower()
+    return engine if engine in ('threads', 'async') else 'threads'
+
+
+def use_async_engine(config, mirror=False, relay=False, low_priority=False):
+    """True if a group transfer with these options should run on this engine"""
+    return get_engine(config) == "async" and not (mirror or relay or low_priority)
+
+
+def asyncssh_available():
+    try:
+        import asyncssh
+        return True
+    except ImportError:
+        return False
+
+
+def background_loop():
+    """The process-wide event loop, running on its own daemon thread from the first call on"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="raspfilesend-async", daemon=True).start()
+        return _loop
+
+
+def submit(coroutine):
+    """Run a coroutine on the background loop from any thread; returns a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coroutine, background_loop())
+
+
+async def take_tokens(buckets, nbytes):
+    """TokenBucket.consume for the event loop: wait for every bucket without holding a thread"""
+    for bucket in buckets:
+        while True:
+            wait = bucket.reserve(nbytes)
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+
+
+class AsyncSSHBackend:
+    """The Backend calls as coroutines, on one asyncssh connection and SFTP session"""
+
+    name = "asyncssh"
+
+    def __init__(self, disk):
+        self.disk = disk  # Executor for the blocking local reads
+        self.connection = None
+        self.sftp = None
+
+    async def connect(self, config, password=None, timeout=15, tracer=None):
+        import asyncssh
+
+        ip, port, username = connection_id(config)
+        options = {'port': port, 'username': username, 'known_hosts': None}  # Like paramiko's AutoAddPolicy
+        if config.get('SSH', 'auth_method', fallback='password') == "password":
+            options['password'] = password
+        else:
+            options['client_keys'] = [config.get('SSH', 'key_path', fallback='')]
+        with (tracer or NULL_TRACER).span("connect", backend="asyncssh"):
+            self.connection = await asyncio.wait_for(asyncssh.connect(ip, **options), timeout)
+            self.sftp = await self.connection.start_sftp_client()
+        return self
+
+    async def stat_many(self, paths):
+        # Folders with two or more of the paths are listed once, like ParamikoBackend does
+        folders = {}
+        for path in paths:
+            folders.setdefault(posixpath.dirname(path), []).append(path)
+        found = {}
+        listings = [self._lookup(folder, group, found) for folder, group in folders.items()]
+        await asyncio.gather(*listings)
+        return found
+
+    async def _lookup(self, folder, group, found):
+        import asyncssh
+
+        if len(group) > 1:
+            try:
+                listing = {entry.filename: entry.attrs for entry in await self.sftp.readdir(folder or ".")}
+            except asyncssh.SFTPError:
+                listing = {}  # Folder not there (yet)
+            for path in group:
+                attrs = listing.get(posixpath.basename(path))
+                found[path] = _attributes(attrs, posixpath.basename(path)) if attrs is not None else None
+        else:
+            try:
+                found[group[0]] = _attributes(await self.sftp.stat(group[0]), posixpath.basename(group[0]))
+            except asyncssh.SFTPNoSuchFile:
+                found[group[0]] = None
+
+    async def mkdir_many(self, paths):
+        for command in mkdir_commands(paths):
+            status, stdout, stderr = await self.exec(command)
+            if status != 0:
+                raise IOError(f"could not create remote folders: {stderr.decode(errors='replace').strip()}")
+
+    async def put_stream(self, source, remote_path, size=0, callback=None, buckets=()):
+        """Write source to remote_path with up to WRITES_IN_FLIGHT writes waiting for the Pi"""
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(WRITES_IN_FLIGHT)
+        writes = set()
+        confirmed = 0
+
+        async def write(remote, data, offset):
+            nonlocal confirmed
+            try:
+                await remote.write(data, offset)
+            finally:
+                slots.release()
+            confirmed += len(data)
+            if callback:
+                callback(confirmed, size)
+
+        offset = 0
+        async with self.sftp.open(remote_path, 'wb') as remote:
+            try:
+                while True:
+                    block = await loop.run_in_executor(self.disk, source.read, READ_SIZE)
+                    if not block:
+                        break
+                    for start in range(0, len(block), WRITE_SIZE):
+                        data = block[start:start + WRITE_SIZE]
+                        await take_tokens(buckets, len(data))
+                        await slots.acquire()
+                        for finished in [task for task in writes if task.done()]:
+                            writes.discard(finished)
+                            finished.result()  # Stop at the first write the Pi refused
+                        writes.add(asyncio.ensure_future(write(remote, data, offset)))
+                        offset += len(data)
+                await asyncio.gather(*writes)
+            finally:
+                for task in writes:
+                    task.cancel()
+        return offset
+
+    async def exec(self, command, input=None):
+        result = await self.connection.run(command, input=input, encoding=None, check=False)
+        status = result.exit_status if result.exit_status is not None else -1
+        return status, result.stdout or b'', result.stderr or b''
+
+    async def utime(self, remote_path, times):
+        await self.sftp.utime(remote_path, times)
+
+    async def close(self):
+        if self.sftp is not None:
+            self.sftp.exit()
+        if self.connection is not None:
+            self.connection.close()
+            await self.connection.wait_closed()
+
+
+def _attributes(attrs, filename):
+    """asyncssh SFTPAttrs in the shape of paramiko's SFTPAttributes"""
+    return types.SimpleNamespace(filename=filename, st_size=attrs.size, st_mtime=attrs.mtime,
+                                 st_mode=attrs.permissions)
+
+
+class ThreadedBackend:
+    """A raspfilesend_backend Backend driven from the loop; its calls run on worker threads
+
+    streams threads per Pi, so a Pi never sees more SFTP channels than with the threaded engine.
+    """
+
+    def __init__(self, streams):
+        self.executor = ThreadPoolExecutor(max_workers=streams, thread_name_prefix="raspfilesend-upload")
+        self.backend = None
+
+    @property
+    def name(self):
+        return self.backend.name if self.backend is not None else None
+
+    async def _call(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def connect(self, config, password=None, timeout=15, tracer=None):
+        self.backend = await self._call(open_backend, config, password, timeout=timeout, tracer=tracer)
+        return self
+
+    async def stat_many(self, paths):
+        return await self._call(self.backend.stat_many, paths)
+
+    async def mkdir_many(self, paths):
+        await self._call(self.backend.mkdir_many, paths)
+
+    async def put_stream(self, source, remote_path, size=0, callback=None, buckets=()):
+        # A cancelled upload cannot interrupt its thread; the reader makes it stop at the next block
+        stop = threading.Event()
+        try:
+            return await self._call(self.backend.put_stream, StoppableReader(source, stop, buckets),
+                                    remote_path, size, callback)
+        finally:
+            stop.set()
+
+    async def exec(self, command, input=None):
+        return await self._call(self.backend.exec, command, input)
+
+    async def utime(self, remote_path, times):
+        await self._call(self.backend.utime, remote_path, times)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._close)
+
+    def _close(self):
+        self.executor.shutdown(wait=True)  # Uploads still running stop at their next read
+        if self.backend is not None:
+            self.backend.close()
+
+
+class StoppableReader:
+    """File wrapper for uploads on worker threads: applies the speed limits, raises once stopped"""
+
+    def __init__(self, source, stop, buckets=()):
+        self.source = source
+        self.stop = stop
+        self.buckets = buckets
+
+    def read(self, size=-1):
+        if self.stop.is_set():
+            raise IOError("upload cancelled")
+        data = self.source.read(size)
+        for bucket in self.buckets:
+            bucket.consume(len(data))
+        return data
+
+
+def create_async_backend(config, streams, disk):
+    """asyncssh for the default backend when it is installed, otherwise the configured backend on threads"""
+    if get_backend(config) == "paramiko" and asyncssh_available():
+        return AsyncSSHBackend(disk)
+    return ThreadedBackend(streams)
+
+
+class AsyncUploader:
+    """Upload the selection to one Pi on the event loop; counts outcomes like ParallelUploader"""
+
+    def __init__(self, backend, files, target_dir, disk, streams, stream_slots, log=None, overwrite=False,
+                 sync=False, report=None, progress=None, reader_pool=None, buckets=(), tracer=None):
+        self.backend = backend
+        self.files = files
+        self.target_dir = target_dir
+        self.disk = disk
+        self.streams = streams
+        # Shared by every Pi; limits the uploads running at the same time across the whole group
+        self.stream_slots = stream_slots
+        self.log = log or (lambda message: None)
+        self.overwrite = overwrite
+        self.sync = sync
+        self.report = report or (lambda outcome, name, **details: None)
+        self.progress = progress
+        self.reader_pool = reader_pool
+        self.buckets = buckets
+        self.tracer = tracer or NULL_TRACER
+
+        self.transferred = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = 0
+        self.total = 0
+        self._walking = False
+
+    def _record(self, outcome, name, **details):
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        self.report(outcome, name, **details)
+
+    async def run(self):
+        """Upload everything; cancelling the task aborts the running uploads"""
+        with self.tracer.span("remote_mkdir", folders=1):
+            await self.backend.mkdir_many([self.target_dir])
+
+        # A short queue keeps the walk only a little ahead of the uploads
+        queue = asyncio.Queue(maxsize=self.streams * 4)
+        workers = [asyncio.ensure_future(self._worker(queue)) for _ in range(self.streams)]
+        try:
+            await self._feed(queue)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # Let aborted uploads remove their partial files before the connection closes
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _walk(self):
+        """Walk the selection on a disk thread: yields ('dirs', [relative]) and ('file', local, relative, stat)"""
+        found = []
+        for local_path, relative in walk_files(self.files, found.append, self.log):
+            if found:
+                yield 'dirs', [folder for batch in found for folder in batch]
+                found.clear()
+            try:
+                local_stat = os.stat(local_path)
+            except OSError:
+                local_stat = None  # Reported by the upload
+            yield 'file', local_path, relative, local_stat
+        if found:
+            yield 'dirs', [folder for batch in found for folder in batch]  # Empty folders at the end
+
+    async def _feed(self, queue):
+        loop = asyncio.get_running_loop()
+        walk = self._walk()
+        self._walking = True
+        try:
+            while True:
+                batch = await loop.run_in_executor(self.disk, list, itertools.islice(walk, WALK_BATCH))
+                if not batch:
+                    break
+                pending = []
+                for event in batch:
+                    if event[0] == 'dirs':
+                        # Files found before these folders are looked up while they exist for sure
+                        await self._queue_files(queue, pending)
+                        pending = []
+                        with self.tracer.span("remote_mkdir", folders=len(event[1])):
+                            await self.backend.mkdir_many([f"{self.target_dir}/{relative}" for relative in event[1]])
+                    else:
+                        pending.append(event[1:])
+                await self._queue_files(queue, pending)
+        finally:
+            self._walking = False
+            try:
+                walk.close()
+            except ValueError:
+                pass  # Cancelled while a disk thread was inside the walk; it ends with that batch
+
+    async def _queue_files(self, queue, files):
+        if not files:
+            return
+        remote_paths = [f"{self.target_dir}/{relative}" for _, relative, _ in files]
+        with self.tracer.span("remote_stat", files=len(remote_paths)):
+            remote_attrs = await self.backend.stat_many(remote_paths)
+        for (local_path, relative, local_stat), remote_path in zip(files, remote_paths):
+            self.total += 1
+            await queue.put((self.total, local_path, relative, local_stat, remote_path, remote_attrs.get(remote_path)))
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            async with self.stream_slots:
+                await self._upload_one(*item)
+
+    async def _upload_one(self, index, local_path, relative, local_stat, remote_path, remote_attr):
+        if local_stat is None:
+            self.log(f"⚠️ WARNING: File not found: {local_path}")
+            self._record('failed', relative, error="file not found")
+            return
+        if self.sync and is_unchanged(local_stat, remote_attr):
+            self.log(f"⏸️ Unchanged: {relative}")
+            self._record('unchanged', relative)
+            self._skip_progress(local_stat.st_size)
+            return
+        # In sync mode a changed file is simply replaced
+        if remote_attr is not None and not self.sync and not self.overwrite:
+            self.log(f"⏭️ Skipped: {relative}")
+            self._record('skipped', relative)
+            self._skip_progress(local_stat.st_size)
+            return
+
+        total = f"{self.total}+" if self._walking else str(self.total)
+        self.log(f"📤 Transferring [{index}/{total}]: {relative}")
+        file_size = local_stat.st_size
+        if self.progress:
+            self.progress.start_file(relative, file_size)
+        source = self.reader_pool.open(local_path) if self.reader_pool is not None else None
+        try:
+            if source is None:
+                source = open(local_path, 'rb')
+            with self.tracer.span("put", file=relative, bytes=file_size, method=self.backend.name):
+                await self.backend.put_stream(source, remote_path, file_size, callback=self._put_callback(relative),
+                                              buckets=self.buckets)
+                if self.sync:
+                    # Keep the local mtime so the next sync comparison is valid
+                    await self.backend.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
+            self.log(f"✅ Transferred: {relative} ({file_size:,} bytes)")
+            self._record('transferred', relative, size=file_size)
+        except asyncio.CancelledError:
+            await self._discard(remote_path)
+            raise
+        except Exception as e:
+            self.log(f"❌ Failed to transfer {relative}: {e}")
+            self._record('failed', relative, error=str(e))
+        finally:
+            if source is not None:
+                source.close()
+            if self.progress:
+                self.progress.finish_file(relative)
+
+    async def _discard(self, remote_path):
+        """Remove the partial copy of an aborted upload, so it cannot pass for a complete one"""
+        try:
+            await asyncio.wait_for(self.backend.exec(f"rm -f -- {shlex.quote(remote_path)}"), DISCARD_TIMEOUT)
+        except Exception:
+            pass
+
+    def _skip_progress(self, size):
+        if self.progress:
+            self.progress.skip(size)
+
+    def _put_callback(self, name):
+        if not self.progress:
+            return None
+        reported = [0]
+
+        def callback(transferred, total):
+            self.progress.advance(name, transferred - reported[0])
+            reported[0] = transferred
+        return callback
+
+
+class AsyncFleetTransfer(FleetTransfer):
+    """FleetTransfer on one event loop: every Pi is a task, every upload a task on its connection
+
+    Same results, states and progress as FleetTransfer, so the window shows it the same way.
+    run() blocks (command line); start(on_done) runs it on the background loop and returns at
+    once (window). cancel() may be called from any thread.
+    """
+
+    def __init__(self, config, hosts, files, target_dir, log=None, password=None, overwrite=False,
+                 sync=False, rate_limit=None, report=None):
+        super().__init__(config, hosts, files, target_dir, log, password, overwrite, sync, rate_limit=rate_limit)
+        # report(outcome, name, host=host, **details) for every file on every Pi
+        self.report = report
+        self._loop = None
+        self._tasks = []
+
+    def cancel(self):
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._cancel_tasks)
+
+    def _cancel_tasks(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def run(self):
+        """Send to every host on a new event loop in this thread and return the results"""
+        return asyncio.run(self.run_async())
+
+    def start(self, on_done=None):
+        """Run on the shared background loop; on_done(error or None) is called from the loop's thread"""
+        future = submit(self.run_async())
+        if on_done is not None:
+            future.add_done_callback(lambda finished: on_done(finished.exception()))
+        return future
+
+    async def run_async(self):
+        max_hosts, max_streams, buffer_bytes = get_fleet_limits(self.config)
+        pool = SharedReadPool(buffer_bytes)
+        readers = {host: pool.reader() for host in self.hosts}
+        host_slots = asyncio.Semaphore(max_hosts)
+        stream_slots = asyncio.Semaphore(max_streams)
+        disk = ThreadPoolExecutor(max_workers=DISK_THREADS, thread_name_prefix="raspfilesend-disk")
+
+        backend = get_backend(self.config)
+        if backend != "paramiko":
+            engine = f"the {backend} backend on worker threads"
+        elif asyncssh_available():
+            engine = "asyncssh"
+        else:
+            engine = "paramiko on worker threads (pip install asyncssh to do without them)"
+        self.log(f"🚚 Sending to {len(self.hosts)} hosts, {min(max_hosts, len(self.hosts))} at a time, "
+                 f"with up to {max_streams} uploads on one event loop using {engine}")
+        # Created before the first await, so cancel() from another thread always finds them
+        self._tasks = [asyncio.ensure_future(self._run_host_async(host, readers[host], host_slots, stream_slots, disk))
+                       for host in self.hosts]
+        self._loop = asyncio.get_running_loop()
+        # One walk sizes the selection for every Pi's progress, instead of one per Pi
+        count_in_background(list(self.progress.values()), self.files)
+        try:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            disk.shutdown(wait=False)
+        # A task cancelled before its first step never recorded anything
+        for host in self.hosts:
+            if host not in self.results:
+                self.states[host] = "cancelled"
+                self.results[host] = {'error': "cancelled"}
+
+        if pool.served_bytes:
+            self.log(f"📖 Read {format_size(pool.disk_bytes)} from disk for "
+                     f"{format_size(pool.served_bytes)} sent to {len(self.hosts)} hosts")
+        return self.results
+
+    async def _run_host_async(self, host, reader, host_slots, stream_slots, disk):
+        log = lambda message: self.log(f"[{host}] {message}")
+        report = None
+        if self.report is not None:
+            report = lambda outcome, name, **details: self.report(outcome, name, host=host, **details)
+        backend = None
+        tracer = None
+        uploader = None
+        try:
+            async with host_slots:
+                if self.cancelled.is_set():
+                    raise asyncio.CancelledError()
+                config = host_config(self.config, host)
+                self.states[host] = "connecting"
+                tracer = start_trace(config, 'transfer', host=connection_id(config)[0], name=host,
+                                     target_dir=self.target_dir)
+                streams = get_stream_count(config)
+                backend = create_async_backend(config, streams, disk)
+                await backend.connect(config, self._host_password(host), tracer=tracer)
+                self.states[host] = "sending"
+                host_rate = get_rate_limits(config)[1]
+                buckets = [self.rate_limit] + ([TokenBucket(host_rate)] if host_rate else [])
+                uploader = AsyncUploader(backend, self.files, self.target_dir, disk, streams, stream_slots, log,
+                                         overwrite=self.overwrite, sync=self.sync, report=report,
+                                         progress=self.progress[host], reader_pool=reader, buckets=buckets,
+                                         tracer=tracer)
+                await uploader.run()
+            self.results[host] = {name: getattr(uploader, name)
+                                  for name in ('transferred', 'skipped', 'unchanged', 'removed', 'failed')}
+            if uploader.failed:
+                self.states[host] = "failed"
+                self.results[host]['error'] = f"{uploader.failed} file(s) failed"
+            else:
+                self.states[host] = "done"
+        except asyncio.CancelledError:
+            self.states[host] = "cancelled"
+            self.results[host] = {'error': "cancelled"}
+        except Exception as e:
+            log(f"❌ ERROR: {e}")
+            self.states[host] = "failed"
+            self.results[host] = {'error': str(e)}
+        finally:
+            reader.close()
+            if backend is not None:
+                try:
+                    await backend.close()
+                except Exception:
+                    pass
+            if tracer is not None and tracer.close():
+                log(f"📊 Timing trace saved to {tracer.path}")
@@ -0,0 +1,347 @@
+"""
+Transport backends for RaspFileSend
+One interface for what the tools do on a Pi - connect, stat many paths, create many folders,
+stream a file up and run a command - so the windows, the command line and the benchmarks do not
+care how the bytes get there. [SSH] backend picks the implementation: paramiko (default), openssh
+(the system ssh client, see raspfilesend_openssh) or local, a stand-in that writes to this
+machine's disk for tests and benchmarks without a Pi.
+"""
+
+import collections
+import os
+import posixpath
+import subprocess
+import threading
+
+from raspfilesend_common import connect_ssh, get_backend
+from raspfilesend_walk import mkdir_many
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class Backend:
+    """A connection to one Pi
+
+    Subclasses implement connect, stat_many, mkdir_many, put_stream, exec and utime, all safe to
+    call from several threads. client is a paramiko SSHClient-compatible object; the transfer
+    engine uses it for what these calls do not cover (parallel SFTP channels, tar and gzip streams).
+    """
+
+    name = None
+    client = None
+
+    def connect(self, config, password=None, timeout=15, tracer=None):
+        """Log in with the [SSH] settings; returns the backend itself"""
+        raise NotImplementedError
+
+    def stat_many(self, paths):
+        """{path: attributes (st_size, st_mtime, st_mode) or None where nothing exists}"""
+        raise NotImplementedError
+
+    def mkdir_many(self, paths):
+        """Create folders and their parents, in as few round trips as possible"""
+        raise NotImplementedError
+
+    def put_stream(self, source, remote_path, size=0, callback=None):
+        """Write everything read from the file object source to remote_path
+
+        callback(bytes written so far, size) is called as the data goes out. Returns the byte count.
+        """
+        raise NotImplementedError
+
+    def exec(self, command, input=None):
+        """Run a shell command on the Pi, with input (bytes) on its stdin; returns (status, stdout, stderr)"""
+        raise NotImplementedError
+
+    def utime(self, remote_path, times):
+        """Set (atime, mtime) of a remote file, so the next sync comparison sees the local mtime"""
+        raise NotImplementedError
+
+    def is_active(self):
+        transport = self.client.get_transport() if self.client is not None else None
+        return transport is not None and transport.is_active()
+
+    def probe(self, timeout):
+        """Raise unless the Pi answers within timeout (the pool checks idle connections with this)"""
+        self.client.get_transport().open_session(timeout=timeout).close()
+
+    def set_keepalive(self, seconds):
+        pass
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParamikoBackend(Backend):
+    """SSH through paramiko's SSHClient, or the OpenSSH client that imitates it (backend = openssh)
+
+    stat_many and put_stream use one SFTP channel per calling thread, opened on first use.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self._local = threading.local()
+        self._channels = []
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return getattr(self.client, 'backend', "paramiko")
+
+    def connect(self, config, password=None, timeout=15, tracer=None):
+        self.client = connect_ssh(config, password, timeout=timeout, tracer=tracer)
+        return self
+
+    def _sftp(self):
+        sftp = getattr(self._local, 'sftp', None)
+        if sftp is None:
+            sftp = self._local.sftp = self.client.open_sftp()
+            with self._lock:
+                self._channels.append(sftp)
+        return sftp
+
+    def stat_many(self, paths):
+        # Two or more paths in one folder are answered by a single listing instead of a stat each
+        sftp = self._sftp()
+        folders = collections.defaultdict(list)
+        for path in paths:
+            folders[posixpath.dirname(path)].append(path)
+        found = {}
+        for folder, group in folders.items():
+            if len(group) > 1:
+                try:
+                    listing = {attr.filename: attr for attr in sftp.listdir_attr(folder or ".")}
+                except IOError:
+                    listing = {}  # Folder not there (yet)
+                for path in group:
+                    found[path] = listing.get(posixpath.basename(path))
+            else:
+                try:
+                    found[group[0]] = sftp.stat(group[0])
+                except FileNotFoundError:
+                    found[group[0]] = None
+        return found
+
+    def mkdir_many(self, paths):
+        mkdir_many(self.client, paths)
+
+    def put_stream(self, source, remote_path, size=0, callback=None):
+        # putfo confirms the size on the Pi with a stat
+        return self._sftp().putfo(source, remote_path, size or 0, callback=callback).st_size
+
+    def utime(self, remote_path, times):
+        self._sftp().utime(remote_path, times)
+
+    def exec(self, command, input=None):
+        channel = self.client.get_transport().open_session()
+        try:
+            channel.exec_command(command)
+            if input:
+                channel.sendall(input)
+            channel.shutdown_write()
+            stdout = channel.makefile('rb').read()
+            stderr = channel.makefile_stderr('rb').read()
+            return channel.recv_exit_status(), stdout, stderr
+        finally:
+            channel.close()
+
+    def set_keepalive(self, seconds):
+        self.client.get_transport().set_keepalive(seconds)
+
+    def close(self):
+        with self._lock:
+            channels, self._channels = self._channels, []
+        for sftp in channels:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+        super().close()
+
+
+class LocalAttributes:
+    """os.stat result in the shape of paramiko's SFTPAttributes (whole-second times)"""
+
+    def __init__(self, stat_result, filename=""):
+        self.filename = filename
+        self.st_size = stat_result.st_size
+        self.st_mode = stat_result.st_mode
+        self.st_mtime = int(stat_result.st_mtime)
+        self.st_atime = int(stat_result.st_atime)
+
+
+def copy_stream(source, target, size=0, callback=None):
+    sent = 0
+    for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+        target.write(block)
+        sent += len(block)
+        if callback:
+            callback(sent, size)
+    return sent
+
+
+class LocalBackend(Backend):
+    """Stand-in for a Pi on this machine: remote paths are local paths, commands run in the local shell
+
+    Everything but the network is exercised, so the engine's own overhead can be measured and
+    tested without a Pi. Commands are the same ones sent to the Pi (mkdir -p, tar, gzip), so a
+    POSIX shell is needed for them.
+    """
+
+    name = "local"
+
+    def connect(self, config, password=None, timeout=15, tracer=None):
+        self.client = LocalClient()
+        return self
+
+    def stat_many(self, paths):
+        found = {}
+        for path in paths:
+            try:
+                found[path] = LocalAttributes(os.stat(path), os.path.basename(path))
+            except FileNotFoundError:
+                found[path] = None
+        return found
+
+    def mkdir_many(self, paths):
+        for path in paths:
+            os.makedirs(path, exist_ok=True)
+
+    def put_stream(self, source, remote_path, size=0, callback=None):
+        with open(remote_path, 'wb') as target:
+            return copy_stream(source, target, size, callback)
+
+    def utime(self, remote_path, times):
+        os.utime(remote_path, times)
+
+    def exec(self, command, input=None):
+        completed = subprocess.run(command, shell=True, input=input or b'', capture_output=True)
+        return completed.returncode, completed.stdout, completed.stderr
+
+    def probe(self, timeout):
+        pass
+
+
+class LocalClient:
+    """paramiko SSHClient look-alike for LocalBackend: SFTP calls are file operations, channels local commands"""
+
+    backend = "local"
+
+    def __init__(self):
+        self.closed = False
+        self._transport = LocalTransport(self)
+
+    def _spawn(self, remote_args, subsystem=False):
+        if subsystem:
+            raise IOError("no subsystems on the local backend")
+        return subprocess.Popen(remote_args[0], shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, bufsize=0)
+
+    def get_transport(self):
+        return self._transport
+
+    def exec_command(self, command):
+        channel = self._transport.open_session()
+        channel.exec_command(command)
+        stdout = channel.makefile('rb')
+        stdout.channel = channel
+        return channel.makefile_stdin('wb'), stdout, channel.makefile_stderr('rb')
+
+    def open_sftp(self):
+        return LocalSFTP()
+
+    def close(self):
+        self.closed = True
+
+
+class LocalTransport:
+    def __init__(self, client):
+        self.client = client
+
+    def open_session(self, timeout=None):
+        from raspfilesend_openssh import ProcessChannel
+        return ProcessChannel(self.client)
+
+    def is_active(self):
+        return not self.client.closed
+
+    def getpeername(self):
+        return "localhost", 0
+
+    def set_keepalive(self, interval):
+        pass
+
+    def global_request(self, kind, data=None, wait=True):
+        pass  # Nothing between us and the "Pi"
+
+
+class LocalSFTP:
+    """The paramiko SFTPClient calls RaspFileSend makes, on local files"""
+
+    def listdir_attr(self, path="."):
+        with os.scandir(path) as entries:
+            return [LocalAttributes(entry.stat(follow_symlinks=False), entry.name) for entry in entries]
+
+    def stat(self, path):
+        return LocalAttributes(os.stat(path), os.path.basename(path))
+
+    def open(self, path, mode='r'):
+        local_file = open(path, mode if 'b' in mode else mode + 'b')
+        local_file.set_pipelined = lambda pipelined=True: None
+        return local_file
+
+    file = open
+
+    def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True):
+        with open(remotepath, 'wb') as target:
+            copy_stream(fl, target, file_size, callback)
+        return self.stat(remotepath)
+
+    def put(self, localpath, remotepath, callback=None, confirm=True):
+        with open(localpath, 'rb') as source:
+            return self.putfo(source, remotepath, os.path.getsize(localpath), callback)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def rename(self, oldpath, newpath):
+        os.rename(oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        os.replace(oldpath, newpath)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def mkdir(self, path, mode=0o777):
+        os.mkdir(path, mode)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def close(self):
+        pass
+
+
+BACKENDS = {'paramiko': ParamikoBackend, 'openssh': ParamikoBackend, 'local': LocalBackend}
+
+
+def open_backend(config, password=None, timeout=15, tracer=None):
+    """Connect with the [SSH] settings through the configured backend; close() it when done"""
+    backend_class = BACKENDS.get(get_backend(config), ParamikoBackend)
+    return backend_class().connect(config, password, timeout=timeout, tracer=tracer)
+
+
+def as_backend(connection):
+    """Wrap a plain SSH client (paramiko or OpenSSH) so it can be used wherever a Backend is expected"""
+    return connection if isinstance(connection, Backend) else ParamikoBackend(connection)
@@ -0,0 +1,215 @@
+"""
+Cipher benchmark for RaspFileSend
+Measures upload throughput for every cipher/MAC pair that both paramiko and the Pi support,
+times each key exchange, and saves the fastest order for that Pi in the configuration file.
+
+Usage:
+    python raspfilesend_cipherbench.py                    # benchmark the configured Pi
+    python raspfilesend_cipherbench.py --save             # ... and store the result
+    python raspfilesend_cipherbench.py --host localhost --user me --key ~/.ssh/id_ed25519
+"""
+
+import argparse
+import getpass
+import socket
+import struct
+import sys
+import time
+
+from raspfilesend_common import (CONFIG_FILE, apply_connection_overrides, cipher_section, connect_ssh,
+                                 connection_id, find_config_file, get_saved_password, read_config)
+from raspfilesend_compression import format_rate, measure_link_speed
+
+BENCH_SIZE = 4 * 1024 * 1024
+KEX_ROUNDS = 3
+
+# Never chosen, however fast they are
+WEAK_ALGORITHMS = {
+    '3des-cbc', 'hmac-md5', 'hmac-md5-96', 'hmac-sha1-96',
+    'diffie-hellman-group1-sha1', 'diffie-hellman-group14-sha1', 'diffie-hellman-group-exchange-sha1',
+}
+
+MSG_KEXINIT = 20
+
+
+def is_aead(cipher):
+    """AEAD ciphers authenticate the data themselves, so the MAC choice does not matter"""
+    return cipher.endswith('-gcm@openssh.com') or cipher.startswith('chacha20-poly1305')
+
+
+def read_server_algorithms(host, port, timeout=10):
+    """Read the algorithm lists the SSH server offers, without logging in
+
+    The server sends its KEXINIT packet in the clear right after the version banners.
+    """
+    import paramiko
+
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(b"SSH-2.0-RaspFileSend_probe\r\n")
+        reader = sock.makefile('rb')
+        # Servers may print other lines before their version banner
+        while True:
+            line = reader.readline()
+            if not line:
+                raise paramiko.SSHException("server closed the connection")
+            if line.startswith(b"SSH-"):
+                break
+        packet_length, padding_length = struct.unpack(">IB", reader.read(5))
+        payload = reader.read(packet_length - 1)[:packet_length - 1 - padding_length]
+
+    message = paramiko.Message(payload)
+    if message.get_byte()[0] != MSG_KEXINIT:
+        raise paramiko.SSHException("unexpected first packet from server")
+    message.get_bytes(16)  # cookie
+    kex = message.get_list()
+    message.get_list()  # host key types
+    ciphers = message.get_list()  # client to server, the upload direction
+    message.get_list()
+    macs = message.get_list()
+    return {'kex': kex, 'ciphers': ciphers, 'macs': macs}
+
+
+def benchmark(ssh, server, size=BENCH_SIZE, log=None):
+    """Time every usable cipher/MAC pair and key exchange on one connection
+
+    Each candidate is switched in with a key re-exchange instead of a new login. Returns
+    (transfers, key_exchanges): [(bytes/s, cipher, mac or None)] fastest first and
+    [(seconds, kex)] quickest first.
+    """
+    log = log or (lambda message: None)
+    transport = ssh.get_transport()
+    options = transport.get_security_options()
+    original = (options.ciphers, options.digests, options.kex)
+
+    ciphers = [c for c in original[0] if c in server['ciphers'] and c not in WEAK_ALGORITHMS]
+    macs = [m for m in original[1] if m in server['macs'] and m not in WEAK_ALGORITHMS]
+    kex_algorithms = [k for k in original[2] if k in server['kex'] and k not in WEAK_ALGORITHMS]
+    candidates = [(cipher, None) if is_aead(cipher) else (cipher, mac)
+                  for cipher in ciphers for mac in ([None] if is_aead(cipher) else macs)]
+
+    transfers = []
+    key_exchanges = []
+    try:
+        for cipher, mac in candidates:
+            if not transport.is_active():
+                break
+            options.ciphers = (cipher,)
+            options.digests = (mac,) if mac else original[1]
+            try:
+                transport.renegotiate_keys()
+                speed = measure_link_speed(ssh, size)
+            except Exception as e:
+                log(f"⚠️ {cipher} / {mac or 'built-in MAC'}: {e}")
+                continue
+            transfers.append((speed, cipher, mac))
+            log(f"🔐 {cipher} / {mac or 'built-in MAC'}: {format_rate(speed)}")
+
+        options.ciphers, options.digests = original[0], original[1]
+        for kex in kex_algorithms:
+            if not transport.is_active():
+                break
+            options.kex = (kex,)
+            try:
+                timings = []
+                for _ in range(KEX_ROUNDS):
+                    started = time.perf_counter()
+                    transport.renegotiate_keys()
+                    timings.append(time.perf_counter() - started)
+            except Exception as e:
+                log(f"⚠️ {kex}: {e}")
+                continue
+            key_exchanges.append((min(timings), kex))
+            log(f"🤝 {kex}: {min(timings) * 1000:.0f} ms")
+    finally:
+        if transport.is_active():
+            options.ciphers, options.digests, options.kex = original
+
+    transfers.sort(key=lambda result: -result[0])
+    key_exchanges.sort()
+    return transfers, key_exchanges
+
+
+def _unique(names):
+    seen = []
+    for name in names:
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+
+def store_preference(config, ip, port, transfers, key_exchanges):
+    """Write the measured order into the Pi's [CIPHERS ip:port] section"""
+    section = cipher_section(ip, port)
+    if not config.has_section(section):
+        config.add_section(section)
+    config[section]['ciphers'] = ",".join(_unique(cipher for _, cipher, _ in transfers))
+    config[section]['macs'] = ",".join(_unique(mac for _, _, mac in transfers))
+    config[section]['kex'] = ",".join(kex for _, kex in key_exchanges)
+    if transfers:
+        config[section]['throughput'] = format_rate(transfers[0][0])
+    config[section]['measured'] = time.strftime("%Y-%m-%d %H:%M")
+
+
+def run_benchmark(config, password=None, size=BENCH_SIZE, log=None):
+    """Connect with the [SSH] settings, benchmark, and store the result in config (not saved to disk)"""
+    ip, port, _ = connection_id(config)
+    server = read_server_algorithms(ip, port)
+    # Algorithms are switched inside paramiko's transport, whatever backend transfers use
+    ssh = connect_ssh(config, password, backend='paramiko')
+    try:
+        transfers, key_exchanges = benchmark(ssh, server, size, log)
+    finally:
+        ssh.close()
+    if transfers:
+        store_preference(config, ip, port, transfers, key_exchanges)
+    return transfers, key_exchanges
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSH ciphers against a Raspberry Pi (or any sshd)")
+    parser.add_argument("--host", help="host to test (default: the configured Pi)")
+    parser.add_argument("--port", type=int, help="SSH port")
+    parser.add_argument("--user", help="user name")
+    parser.add_argument("--key", help="private key file (otherwise password authentication)")
+    parser.add_argument("--size", type=float, default=BENCH_SIZE / (1024 * 1024), help="MB sent per cipher (default 4)")
+    parser.add_argument("--save", action="store_true", help="store the fastest order in the configuration file")
+    args = parser.parse_args()
+
+    config_file = find_config_file() or CONFIG_FILE
+    config = read_config(config_file)
+    apply_connection_overrides(config, args.host, args.port, args.user, args.key)
+
+    ip, port, username = connection_id(config)
+    if not ip or not username:
+        parser.error("no Pi configured; pass --host and --user")
+
+    password = None
+    if config.get('SSH', 'auth_method', fallback='password') == 'password':
+        password = get_saved_password(config) or getpass.getpass(f"Password for {username}@{ip}: ")
+
+    print(f"Benchmarking {username}@{ip}:{port} with {args.size:g} MB per cipher...")
+    try:
+        transfers, key_exchanges = run_benchmark(config, password, int(args.size * 1024 * 1024), log=print)
+    except Exception as e:
+        print(f"❌ Benchmark failed: {e}")
+        sys.exit(1)
+    if not transfers:
+        print("❌ No cipher could be measured")
+        sys.exit(1)
+
+    speed, cipher, mac = transfers[0]
+    print(f"\n🏆 Fastest: {cipher} / {mac or 'built-in MAC'} at {format_rate(speed)}")
+    if key_exchanges:
+        print(f"🏆 Quickest key exchange: {key_exchanges[0][1]}")
+    if args.save:
+        # Only the benchmarked host's section is written back; --host/--user overrides are not
+        saved = read_config(config_file)
+        section = cipher_section(ip, port)
+        saved[section] = dict(config[section])
+        with open(config_file, 'w') as f:
+            saved.write(f)
+        print(f"💾 Saved to [{section}] in {config_file}")
+
+
+if __name__ == "__main__":
+    main()
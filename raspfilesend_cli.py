@@ -0,0 +1,259 @@
+"""
+Headless command-line transfer for RaspFileSend
+Uses the same configuration file and transfer engine as the Send To window, without tkinter,
+for build scripts, CI jobs and scheduled tasks.
+
+Progress is printed as one JSON object per line on stdout:
+    {"event": "log", "message": "..."}
+    {"event": "file", "outcome": "transferred", "name": "app.tar", "size": 1234}
+    {"event": "host", "host": "pi-kitchen", "state": "done", "transferred": 3, ...}   (--group only)
+    {"event": "done", "completed": true, "transferred": 3, "skipped": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    {"event": "error", "code": 3, "message": "..."}
+
+Exit codes:
+    0  every file was transferred, skipped or unchanged
+    1  one or more files failed (with --group: a Pi did not receive everything)
+    2  bad arguments or configuration
+    3  could not connect or authenticate
+    4  a file already existed and --overwrite fail was given
+    5  paramiko is not installed
+
+Examples:
+    python raspfilesend_cli.py build/app.tar --target /home/pi/app --overwrite yes
+    python raspfilesend_cli.py dist --host 10.0.0.21 --user pi --key ~/.ssh/id_ed25519 --sync
+    python raspfilesend_cli.py backup.img --limit 2 --low-priority
+    python raspfilesend_cli.py dist --group shop --engine async --overwrite yes
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+
+from raspfilesend_common import (apply_connection_overrides, connection_id, find_config_file, get_backend,
+                                 get_groups, get_saved_password, read_config)
+
+EXIT_OK = 0
+EXIT_FAILED_FILES = 1
+EXIT_USAGE = 2
+EXIT_CONNECTION = 3
+EXIT_CONFLICT = 4
+EXIT_MISSING_DEPENDENCY = 5
+
+# Overwrite policy -> answer given to the engine's overwrite question
+OVERWRITE_ANSWERS = {'yes': "yes_all", 'no': "no_all", 'fail': "cancel"}
+
+PASSWORD_ENV = "RASPFILESEND_PASSWORD"
+
+
+class JsonLinesOutput:
+    """Thread-safe writer of one JSON event per line"""
+
+    def __init__(self, stream=sys.stdout, quiet=False):
+        self.stream = stream
+        self.quiet = quiet
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        if self.quiet and event == 'log':
+            return
+        line = json.dumps(dict(event=event, **fields), ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self.emit('log', message=message)
+
+    def report(self, outcome, name, **details):
+        self.emit('file', outcome=outcome, name=name, **details)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send files or folders to a Raspberry Pi without a window")
+    parser.add_argument("files", nargs="+", help="files and folders to send")
+    parser.add_argument("--target", help="remote directory (default: the configured default directory)")
+    parser.add_argument("--overwrite", choices=sorted(OVERWRITE_ANSWERS), default="no",
+                        help="what to do with files that already exist on the Pi (default: no)")
+    parser.add_argument("--sync", action="store_true", help="only send files whose size or mtime changed")
+    parser.add_argument("--mirror", action="store_true",
+                        help="sync and delete remote files not in the selection, also inside the selected folders")
+    parser.add_argument("--host", help="Pi address (default: the configured Pi)")
+    parser.add_argument("--port", type=int, help="SSH port")
+    parser.add_argument("--user", help="user name")
+    parser.add_argument("--key", help="private key file")
+    parser.add_argument("--password-env", default=PASSWORD_ENV, metavar="VAR",
+                        help=f"environment variable holding the password (default: {PASSWORD_ENV})")
+    parser.add_argument("--streams", type=int, help="parallel SFTP streams")
+    parser.add_argument("--mode", choices=["auto", "sftp", "tar"], help="transfer mode")
+    parser.add_argument("--compression", choices=["auto", "on", "off"], help="compression mode")
+    parser.add_argument("--limit", type=float, metavar="MB/S", help="upload speed limit in MB/s (0 for none)")
+    parser.add_argument("--low-priority", action="store_true", help="slow down while the network to the Pi is busy")
+    parser.add_argument("--agent", action="store_true",
+                        help="run through the background transfer agent's warm connection (configured Pi only)")
+    parser.add_argument("--group", help="send to every Pi of this [GROUP] from the configuration")
+    parser.add_argument("--engine", choices=["threads", "async"],
+                        help="engine for --group: a thread per Pi and upload, or one event loop (see raspfilesend_async.py)")
+    parser.add_argument("--quiet", action="store_true", help="only print file results and the final summary")
+    args = parser.parse_args(argv)
+    if args.agent and (args.host or args.port or args.user or args.key):
+        parser.error("--agent uses the configured Pi; it cannot be combined with --host, --port, --user or --key")
+    if args.group and args.agent:
+        parser.error("--group connects to every Pi directly; it cannot be combined with --agent")
+    if args.group and args.overwrite == 'fail':
+        parser.error("--overwrite fail needs a question per file, which group transfers do not ask")
+    return args
+
+
+def load_cli_config(args):
+    """Read the usual configuration file and apply the command-line overrides in memory"""
+    config = read_config(find_config_file())
+    apply_connection_overrides(config, args.host, args.port, args.user, args.key)
+    for section, option, value in (('SSH', 'streams', args.streams),
+                                   ('TRANSFER', 'mode', args.mode),
+                                   ('TRANSFER', 'compression', args.compression),
+                                   ('TRANSFER', 'max_rate_mb', args.limit),
+                                   ('TRANSFER', 'low_priority', 'true' if args.low_priority else None),
+                                   ('TRANSFER', 'engine', args.engine)):
+        if value is not None:
+            if not config.has_section(section):
+                config.add_section(section)
+            config[section][option] = str(value)
+    return config
+
+
+def get_password(config, args):
+    """Password from the environment, then the saved one; None for key authentication"""
+    if config.get('SSH', 'auth_method', fallback='password') != "password":
+        return None
+    return os.environ.get(args.password_env) or get_saved_password(config) or None
+
+
+def run_group(args, config, output, files, target_dir, sync):
+    """Send to every Pi of --group; one 'host' event per Pi, then the summed 'done' event"""
+    from raspfilesend_async import AsyncFleetTransfer, use_async_engine
+    from raspfilesend_fleet import FleetTransfer
+    from raspfilesend_throttle import get_rate_limits
+
+    hosts = get_groups(config).get(args.group)
+    if not hosts:
+        output.emit('error', code=EXIT_USAGE, message=f"No group {args.group} with hosts in the configuration")
+        return EXIT_USAGE
+    password = os.environ.get(args.password_env) or None
+    overwrite = args.overwrite == 'yes'
+    try:
+        # A host of the group without a [HOST] section fails here
+        if use_async_engine(config, mirror=args.mirror, low_priority=get_rate_limits(config)[2]):
+            fleet = AsyncFleetTransfer(config, hosts, files, target_dir, output.log, password, overwrite, sync,
+                                       report=output.report)
+        else:
+            fleet = FleetTransfer(config, hosts, files, target_dir, output.log, password, overwrite, sync, args.mirror)
+        if fleet.needs_password() and not password:
+            output.emit('error', code=EXIT_USAGE,
+                        message=f"Some Pis in {args.group} need a password; set {args.password_env}")
+            return EXIT_USAGE
+    except ValueError as e:
+        output.emit('error', code=EXIT_USAGE, message=f"Group {args.group}: {e}")
+        return EXIT_USAGE
+
+    output.emit('start', group=args.group, hosts=hosts, target=target_dir, files=len(files))
+    try:
+        fleet.run()
+    except KeyboardInterrupt:
+        fleet.cancel()
+        output.log("⏹️ Cancelled")
+
+    counts = dict.fromkeys(('transferred', 'skipped', 'unchanged', 'removed', 'failed'), 0)
+    for host in hosts:
+        result = fleet.results.get(host, {'error': "cancelled"})
+        output.emit('host', host=host, state=fleet.states[host], **result)
+        for name in counts:
+            counts[name] += result.get(name, 0)
+    completed = all(state == "done" for state in fleet.states.values())
+    output.emit('done', completed=completed, **counts)
+    return EXIT_OK if completed else EXIT_FAILED_FILES
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = JsonLinesOutput(quiet=args.quiet)
+
+    config = load_cli_config(args)
+    if args.group:
+        target_dir = args.target or config.get('TARGET', 'default_directory', fallback='/home/pi/uploads')
+        return run_group(args, config, output, [os.path.abspath(f) for f in args.files], target_dir,
+                         args.sync or args.mirror)
+    ip, port, username = connection_id(config)
+    if not ip or not username:
+        output.emit('error', code=EXIT_USAGE, message="No Pi configured; run raspfilesend_config.py or pass --host and --user")
+        return EXIT_USAGE
+    target_dir = args.target or config.get('TARGET', 'default_directory', fallback='/home/pi/uploads')
+    files = [os.path.abspath(f) for f in args.files]
+    sync = args.sync or args.mirror
+
+    conflicts = []
+
+    def ask_overwrite(filename):
+        if args.overwrite == 'fail':
+            conflicts.append(filename)
+        return OVERWRITE_ANSWERS[args.overwrite]
+
+    password = get_password(config, args)
+    output.emit('start', host=ip, port=port, user=username, target=target_dir, files=len(files))
+
+    if args.agent:
+        from raspfilesend_agent import run_agent_transfer
+        job = {'files': files, 'target_dir': target_dir, 'password': password, 'sync': sync, 'mirror': args.mirror}
+        # The agent keeps its own limits from the config file unless told otherwise
+        if args.limit is not None:
+            job['max_rate'] = max(0, int(args.limit * 1024 * 1024))
+        if args.low_priority:
+            job['low_priority'] = True
+        result = run_agent_transfer(job, output.log, ask_overwrite, report=output.report)
+        if result['event'] == 'error':
+            output.emit('error', code=EXIT_CONNECTION, message=result['message'])
+            return EXIT_CONNECTION
+        completed = result['completed']
+        counts = {name: result.get(name, 0) for name in ('transferred', 'skipped', 'unchanged', 'removed', 'failed')}
+    else:
+        try:
+            if get_backend(config) != "local":
+                import paramiko
+        except ImportError:
+            output.emit('error', code=EXIT_MISSING_DEPENDENCY, message="paramiko is not installed (pip install paramiko)")
+            return EXIT_MISSING_DEPENDENCY
+
+        from raspfilesend_backend import open_backend
+        from raspfilesend_engine import run_transfer
+        from raspfilesend_trace import start_trace
+        tracer = start_trace(config, 'transfer', host=ip, target_dir=target_dir)
+        try:
+            backend = open_backend(config, password, tracer=tracer)
+        except Exception as e:
+            tracer.close()
+            output.emit('error', code=EXIT_CONNECTION, message=f"Connection to {username}@{ip}:{port} failed: {e}")
+            return EXIT_CONNECTION
+        try:
+            completed, uploader = run_transfer(backend, config, files, target_dir, output.log,
+                                               ask_overwrite=ask_overwrite, sync=sync, mirror=args.mirror,
+                                               report=output.report, tracer=tracer)
+        except Exception as e:
+            output.emit('error', code=EXIT_FAILED_FILES, message=f"Transfer failed: {e}")
+            return EXIT_FAILED_FILES
+        finally:
+            backend.close()
+            if tracer.close():
+                output.log(f"📊 Timing trace saved to {tracer.path}")
+        counts = {name: getattr(uploader, name) for name in ('transferred', 'skipped', 'unchanged', 'removed', 'failed')}
+
+    output.emit('done', completed=completed, **counts)
+    if conflicts:
+        return EXIT_CONFLICT
+    if counts['failed'] or not completed:
+        return EXIT_FAILED_FILES
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
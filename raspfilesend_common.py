@@ -0,0 +1,289 @@
+"""
+Shared helpers for RaspFileSend
+Configuration, password decryption and SSH connection code that does not need tkinter
+"""
+
+import base64
+import configparser
+import contextlib
+import functools
+import hashlib
+import importlib
+import threading
+import time
+from pathlib import Path
+
+CONFIG_FILE = Path.home() / ".raspfilesend_config.ini"
+
+# Loaded in the background once a window is on screen, so the first click does not wait for them
+PRELOAD_MODULES = ("paramiko", "cryptography.fernet")
+
+
+def find_config_file():
+    """Return the configuration file path, falling back to one in the current directory"""
+    if CONFIG_FILE.exists():
+        return CONFIG_FILE
+    local_config = Path("raspfilesend_config.ini")
+    if local_config.exists():
+        return local_config
+    return None
+
+
+def read_config(config_file=None):
+    """Read the configuration file into a ConfigParser (empty if it does not exist)"""
+    config = configparser.ConfigParser()
+    config_file = config_file or find_config_file()
+    if config_file:
+        config.read(config_file)
+    return config
+
+
+@functools.lru_cache(maxsize=None)
+def get_encryption_key():
+    """Generate a machine-specific encryption key (same as the configuration tool)
+
+    Computed once per process: platform.processor() can take a noticeable time on Windows.
+    """
+    try:
+        # Use machine-specific information to generate key
+        import platform
+        machine_info = f"{platform.node()}-{platform.machine()}-{platform.processor()}"
+        key = hashlib.sha256(machine_info.encode()).digest()
+        return base64.urlsafe_b64encode(key)
+    except Exception:
+        # Fallback key if platform info fails
+        fallback = "RaspFileSend-Default-Key-2024"
+        key = hashlib.sha256(fallback.encode()).digest()
+        return base64.urlsafe_b64encode(key)
+
+
+def decrypt_password(encrypted_password):
+    """Decrypt a saved password; returns an empty string if it cannot be decrypted"""
+    if not encrypted_password:
+        return ""
+
+    try:
+        from cryptography.fernet import Fernet
+        fernet = Fernet(get_encryption_key())
+        encrypted_bytes = base64.b64decode(encrypted_password.encode())
+        return fernet.decrypt(encrypted_bytes).decode()
+    except ImportError:
+        # Fallback from base64
+        try:
+            return base64.b64decode(encrypted_password.encode()).decode()
+        except Exception:
+            return ""
+    except Exception:
+        # If decryption fails, return empty (password changed or corrupted)
+        return ""
+
+
+def preload_in_background():
+    """Import paramiko and cryptography and derive the password key on a background thread"""
+    def preload():
+        for module in PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass  # Reported when the feature that needs it is used
+        get_encryption_key()
+    threading.Thread(target=preload, daemon=True).start()
+
+
+def get_saved_password(config):
+    """Return the saved password for password authentication, or an empty string"""
+    save_password = config.get('SSH', 'save_password', fallback='false').lower() == 'true'
+    encrypted_password = config.get('SSH', 'encrypted_password', fallback='')
+    if save_password and encrypted_password:
+        return decrypt_password(encrypted_password)
+    return ""
+
+
+def get_sync_options(config):
+    """Read the sync and mirror switches from the [TRANSFER] section"""
+    sync = config.get('TRANSFER', 'sync', fallback='false').lower() == 'true'
+    mirror = config.get('TRANSFER', 'mirror', fallback='false').lower() == 'true'
+    # Mirroring only makes sense on top of sync comparisons
+    return sync or mirror, mirror
+
+
+def get_groups(config):
+    """Return {group name: [host names]} from the [GROUP name] sections (see raspfilesend_fleet.py)"""
+    groups = {}
+    for section in config.sections():
+        if section.startswith("GROUP "):
+            hosts = config.get(section, 'hosts', fallback='')
+            groups[section[len("GROUP "):]] = [host.strip() for host in hosts.split(',') if host.strip()]
+    return groups
+
+
+def agent_enabled(config):
+    """Check the [AGENT] enabled switch"""
+    return config.get('AGENT', 'enabled', fallback='false').lower() == 'true'
+
+
+def connection_id(config):
+    """(ip, port, username) identifying the configured Raspberry Pi"""
+    return (config.get('SSH', 'ip', fallback='').strip(),
+            int(config.get('SSH', 'port', fallback='22')),
+            config.get('SSH', 'username', fallback='').strip())
+
+
+def apply_connection_overrides(config, host=None, port=None, user=None, key=None):
+    """Replace [SSH] connection settings in config (in memory) with command-line values"""
+    if not config.has_section('SSH'):
+        config.add_section('SSH')
+    if host:
+        config['SSH']['ip'] = host
+    if port:
+        config['SSH']['port'] = str(port)
+    if user:
+        config['SSH']['username'] = user
+    if key:
+        config['SSH']['auth_method'] = 'key'
+        config['SSH']['key_path'] = key
+    elif host:
+        # A different host never uses the configured Pi's key or saved password
+        config['SSH']['auth_method'] = 'password'
+        config.remove_option('SSH', 'encrypted_password')
+
+
+def cipher_section(ip, port):
+    """Name of the INI section holding the benchmarked algorithm order for one Pi"""
+    return f"CIPHERS {ip}:{port}"
+
+
+def get_cipher_preference(config, ip, port):
+    """Return {'ciphers': [...], 'macs': [...], 'kex': [...]} saved for this Pi, or None"""
+    section = cipher_section(ip, port)
+    if not config.has_section(section):
+        return None
+    return {name: [item.strip() for item in config.get(section, name, fallback='').split(',') if item.strip()]
+            for name in ('ciphers', 'macs', 'kex')}
+
+
+def _preferred_first(available, preferred):
+    # Saved algorithms first, then everything else in paramiko's order as a fallback
+    return tuple([name for name in preferred if name in available] +
+                 [name for name in available if name not in preferred])
+
+
+def preferred_transport_factory(preference):
+    """transport_factory for SSHClient.connect that offers the saved algorithm order first"""
+    import paramiko
+
+    def factory(sock, **kwargs):
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        options.ciphers = _preferred_first(options.ciphers, preference['ciphers'])
+        options.digests = _preferred_first(options.digests, preference['macs'])
+        options.kex = _preferred_first(options.kex, preference['kex'])
+        return transport
+    return factory
+
+
+def get_backend(config):
+    """Read the backend from the [SSH] section: paramiko (default), openssh or local (see raspfilesend_backend)"""
+    backend = config.get('SSH', 'backend', fallback='paramiko').strip().lower()
+    return backend if backend in ('paramiko', 'openssh', 'local') else 'paramiko'
+
+
+def connect_ssh(config, password=None, timeout=15, tracer=None, backend=None):
+    """Open an authenticated SSH connection using the [SSH] settings
+
+    Normally a paramiko SSHClient; with backend = openssh an OpenSSHClient driving the system ssh
+    binary (see raspfilesend_openssh), or paramiko again if no ssh binary is installed. backend
+    overrides the setting (the cipher benchmark needs paramiko's transport).
+    tracer (see raspfilesend_trace) times the name lookup, TCP connect, handshake and authentication
+    when it writes a trace file, otherwise the connect as a whole.
+    """
+    if (backend or get_backend(config)) == "openssh":
+        from raspfilesend_openssh import connect_openssh, find_ssh
+        ssh_path = find_ssh(config)
+        if ssh_path:
+            return connect_openssh(config, ssh_path, password, timeout, tracer)
+
+    import paramiko
+
+    ip, port, username = connection_id(config)
+    auth_method = config.get('SSH', 'auth_method', fallback='password')
+    key_path = config.get('SSH', 'key_path', fallback='')
+
+    connect_args = dict(hostname=ip, username=username, port=port, timeout=timeout)
+    if auth_method == "password":
+        connect_args['password'] = password
+    else:
+        connect_args['key_filename'] = key_path
+
+    # Ask for the ciphers the benchmark found fastest for this Pi
+    preference = get_cipher_preference(config, ip, port)
+    if preference:
+        connect_args['transport_factory'] = preferred_transport_factory(preference)
+
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    if tracer is not None and tracer.enabled:
+        open_traced(ssh, connect_args, tracer)
+        return ssh
+    # Without a trace file the history still gets the connect time, as one step
+    with tracer.span("connect") if tracer is not None else contextlib.nullcontext():
+        try:
+            ssh.connect(**connect_args)
+        except TypeError:
+            if 'transport_factory' not in connect_args:
+                raise
+            # paramiko before 3.2 has no transport_factory; connect with its default order
+            del connect_args['transport_factory']
+            ssh.connect(**connect_args)
+    return ssh
+
+
+def open_traced(ssh, connect_args, tracer):
+    """ssh.connect(**connect_args) in separately timed steps: dns, tcp, handshake and auth
+
+    The socket is opened here and handed to paramiko, and the handshake is timed by wrapping the
+    transport's start_client, so the rest of connect() is host key checking and authentication.
+    """
+    import socket
+
+    import paramiko
+
+    host, port = connect_args['hostname'], connect_args.get('port', 22)
+    with tracer.span("connect.dns", host=host):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    with tracer.span("connect.tcp", host=host, port=port):
+        sock = socket.create_connection(addresses[0][4][:2], timeout=connect_args.get('timeout'))
+
+    handshake_done = []
+    factory = connect_args.get('transport_factory', paramiko.Transport)
+
+    def traced_factory(sock, **kwargs):
+        transport = factory(sock, **kwargs)
+        start_client = transport.start_client
+
+        def timed_start_client(*args, **kw):
+            with tracer.span("connect.handshake"):
+                result = start_client(*args, **kw)
+            handshake_done.append(time.perf_counter())
+            return result
+        transport.start_client = timed_start_client
+        return transport
+
+    args = {key: value for key, value in connect_args.items() if key != 'transport_factory'}
+    started = time.perf_counter()
+    try:
+        try:
+            ssh.connect(sock=sock, transport_factory=traced_factory, **args)
+        except TypeError:
+            # paramiko before 3.2: handshake and authentication are timed together
+            ssh.connect(sock=sock, **args)
+    except BaseException as e:
+        sock.close()
+        name = "connect.auth" if handshake_done else "connect.ssh"
+        since = handshake_done[0] if handshake_done else started
+        tracer.record(name, since, time.perf_counter() - since, error=str(e) or type(e).__name__)
+        raise
+    if handshake_done:
+        tracer.record("connect.auth", handshake_done[0], time.perf_counter() - handshake_done[0])
+    else:
+        tracer.record("connect.ssh", started, time.perf_counter() - started)
@@ -0,0 +1,168 @@
+"""
+Streaming compression for RaspFileSend
+Compresses upload streams on the Windows side; the Pi decompresses them with gzip/tar
+"""
+
+import os
+import threading
+import time
+import zlib
+
+# Extensions whose contents are already compressed; recompressing them only burns CPU
+COMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.txz', '.7z', '.rar', '.zst', '.lz4', '.lzma', '.z',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.mp4', '.m4a', '.m4v', '.mkv', '.avi', '.mov', '.webm', '.ogg', '.opus', '.flac', '.aac',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.jar', '.apk', '.whl', '.deb', '.pdf',
+}
+
+# Small files are cheaper to send as-is than to open an extra exec channel for
+MIN_COMPRESS_SIZE = 64 * 1024
+
+# Link speed (bytes/s) -> compression level; above the last step compression is not worth it
+LEVEL_STEPS = [
+    (2 * 1024 * 1024, 9),    # slow Wi-Fi: spend CPU to save bytes
+    (8 * 1024 * 1024, 6),
+    (40 * 1024 * 1024, 1),   # fast LAN: cheapest level only
+]
+
+PROBE_SIZE = 512 * 1024
+
+
+def get_compression_mode(config):
+    """Read the compression mode (auto, on or off) from the [TRANSFER] section"""
+    mode = config.get('TRANSFER', 'compression', fallback='auto').strip().lower()
+    return mode if mode in ('auto', 'on', 'off') else 'auto'
+
+
+def is_compressible(file_path):
+    """Decide by extension whether a file is worth compressing"""
+    return os.path.splitext(file_path)[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+def measure_link_speed(ssh, probe_size=PROBE_SIZE):
+    """Estimate upload bandwidth in bytes/s by pushing random data into `cat > /dev/null`"""
+    channel = ssh.get_transport().open_session()
+    try:
+        channel.exec_command("cat > /dev/null")
+        data = os.urandom(probe_size)
+        started = time.perf_counter()
+        channel.sendall(data)
+        channel.shutdown_write()
+        channel.recv_exit_status()
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        return probe_size / elapsed
+    finally:
+        channel.close()
+
+
+def format_rate(bytes_per_second):
+    """Format a throughput value for log lines"""
+    if bytes_per_second >= 1024 * 1024:
+        return f"{bytes_per_second / (1024 * 1024):.1f} MB/s"
+    return f"{bytes_per_second / 1024:.0f} KB/s"
+
+
+class CompressionPolicy:
+    """Choose per file whether and how hard to compress, based on file type and measured link speed"""
+
+    def __init__(self, mode='auto', link_speed=None):
+        self.mode = mode
+        self.link_speed = link_speed  # bytes/s on the wire, smoothed
+        self._lock = threading.Lock()
+
+    def observe(self, wire_bytes, seconds):
+        """Feed the bytes actually sent over the link and how long that took"""
+        if seconds <= 0 or wire_bytes <= 0:
+            return
+        sample = wire_bytes / seconds
+        with self._lock:
+            if self.link_speed is None:
+                self.link_speed = sample
+            else:
+                self.link_speed = 0.7 * self.link_speed + 0.3 * sample
+
+    def level_for(self, file_path, file_size):
+        """Return a zlib level (1-9) for this file, or None to send it uncompressed"""
+        if self.mode == 'off' or file_size < MIN_COMPRESS_SIZE or not is_compressible(file_path):
+            return None
+        return self.level_for_link()
+
+    def level_for_link(self):
+        """Return the level for the current link speed, or None when the link outruns compression"""
+        if self.mode == 'off':
+            return None
+        speed = self.link_speed
+        if speed is None:
+            return 6
+        for limit, level in LEVEL_STEPS:
+            if speed < limit:
+                return level
+        # In "on" mode always compress, just as cheaply as possible
+        return 1 if self.mode == 'on' else None
+
+
+class CompressingWriter:
+    """Gzip-compress everything written to it and pass the result to another writer"""
+
+    def __init__(self, target, level=6):
+        self.target = target
+        self.level = level
+        # wbits=31 produces a gzip stream that `gzip -d` and `tar -z` understand
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def set_level(self, level):
+        """Switch level mid-stream by starting a new gzip member (level 0 stores data as-is)"""
+        if level == self.level:
+            return
+        self.finish()
+        self.level = level
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        self.raw_bytes += len(data)
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self.target.write(compressed)
+            self.wire_bytes += len(compressed)
+        return len(data)
+
+    def sync(self):
+        """Push out everything written so far, so per-entry byte counts are exact"""
+        pending = self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if pending:
+            self.target.write(pending)
+            self.wire_bytes += len(pending)
+
+    def finish(self):
+        """Flush the end of the gzip stream"""
+        tail = self._compressor.flush()
+        if tail:
+            self.target.write(tail)
+            self.wire_bytes += len(tail)
+
+    @property
+    def ratio(self):
+        return self.raw_bytes / self.wire_bytes if self.wire_bytes else 1.0
+
+
+def create_compression_policy(config, ssh, files, log=None):
+    """Build a CompressionPolicy for this batch, or return None when nothing would be compressed"""
+    mode = get_compression_mode(config)
+    if mode == 'off':
+        return None
+    # Skip the link probe when there is too little compressible data to matter
+    compressible_bytes = sum(os.path.getsize(f) for f in files if os.path.isfile(f) and is_compressible(f))
+    if compressible_bytes < MIN_COMPRESS_SIZE:
+        return None
+
+    policy = CompressionPolicy(mode)
+    try:
+        policy.link_speed = measure_link_speed(ssh)
+        if log:
+            log(f"📶 Measured link speed: {format_rate(policy.link_speed)}")
+    except Exception:
+        pass  # Keep the default level if the probe fails
+    return policy
@@ -3,11 +3,11 @@ from tkinter import ttk, messagebox, filedialog, simpledialog
 import configparser
 import os
 import sys
-import subprocess
 from pathlib import Path
 import threading
 import base64
-import hashlib
+
+from raspfilesend_common import decrypt_password, get_encryption_key, preload_in_background
 
 class RaspFileSendConfig:
     def __init__(self):
@@ -21,8 +21,16 @@ class RaspFileSendConfig:
         self.config = configparser.ConfigParser()
         self.load_config()
         
+        # Field traces must not save while the saved values are being filled in
+        self._loading = True
+        # The saved password is decrypted off the UI thread; keep it until that finishes
+        self._password_pending = False
         self.setup_ui()
         self.load_saved_settings()
+        self._loading = False
+        
+        # Warm up paramiko and the password key once the window is drawn
+        self.root.after_idle(preload_in_background)
         
     def setup_ui(self):
         # Main frame with scrollbar capability
@@ -101,6 +109,17 @@ class RaspFileSendConfig:
         self.password_entry.config(state='disabled')
         self.show_password_check.config(state='disabled')
         
+        # Number of SFTP channels used in parallel for multi-file transfers
+        ttk.Label(ssh_frame, text="Parallel Streams:").grid(row=7, column=0, sticky=tk.W, pady=8)
+        self.streams_var = tk.StringVar(value="4")
+        ttk.Spinbox(ssh_frame, from_=1, to=16, textvariable=self.streams_var, width=6).grid(row=7, column=1, sticky=tk.W, pady=8, padx=(15, 0))
+        
+        # Background agent that keeps the SSH connection warm between Send To clicks
+        ttk.Label(ssh_frame, text="Transfer Agent:").grid(row=8, column=0, sticky=tk.W, pady=8)
+        self.agent_var = tk.BooleanVar()
+        ttk.Checkbutton(ssh_frame, text="Keep connection open in the background", 
+                        variable=self.agent_var).grid(row=8, column=1, sticky=tk.W, pady=8, padx=(15, 0))
+        
         ssh_frame.columnconfigure(1, weight=1)
         
         # Target Directory Settings
@@ -120,6 +139,8 @@ class RaspFileSendConfig:
         test_button_frame.pack(fill=tk.X)
         
         ttk.Button(test_button_frame, text="Test Connection", command=self.test_connection).pack(side=tk.LEFT)
+        ttk.Button(test_button_frame, text="Benchmark Ciphers", command=self.benchmark_ciphers).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(test_button_frame, text="History", command=self.show_history).pack(side=tk.LEFT, padx=(10, 0))
         self.test_status_var = tk.StringVar()
         status_label = ttk.Label(test_button_frame, textvariable=self.test_status_var, foreground="blue")
         status_label.pack(side=tk.LEFT, padx=(15, 0))
@@ -162,21 +183,9 @@ class RaspFileSendConfig:
         self.target_dir_var.trace('w', self.auto_save)
         self.save_password_var.trace('w', self.auto_save)
         self.password_var.trace('w', self.auto_save)
+        self.streams_var.trace('w', self.auto_save)
+        self.agent_var.trace('w', self.auto_save)
         
-    def _get_encryption_key(self):
-        """Generate a machine-specific encryption key"""
-        try:
-            # Use machine-specific information to generate key
-            import platform
-            machine_info = f"{platform.node()}-{platform.machine()}-{platform.processor()}"
-            key = hashlib.sha256(machine_info.encode()).digest()
-            return base64.urlsafe_b64encode(key)
-        except:
-            # Fallback key if platform info fails
-            fallback = "RaspFileSend-Default-Key-2024"
-            key = hashlib.sha256(fallback.encode()).digest()
-            return base64.urlsafe_b64encode(key)
-    
     def _encrypt_password(self, password):
         """Encrypt password using machine-specific key"""
         if not password:
@@ -184,8 +193,7 @@ class RaspFileSendConfig:
         
         try:
             from cryptography.fernet import Fernet
-            key = self._get_encryption_key()
-            fernet = Fernet(key)
+            fernet = Fernet(get_encryption_key())
             encrypted = fernet.encrypt(password.encode())
             return base64.b64encode(encrypted).decode()
         except ImportError:
@@ -200,25 +208,7 @@ class RaspFileSendConfig:
     
     def _decrypt_password(self, encrypted_password):
         """Decrypt password using machine-specific key"""
-        if not encrypted_password:
-            return ""
-        
-        try:
-            from cryptography.fernet import Fernet
-            key = self._get_encryption_key()
-            fernet = Fernet(key)
-            encrypted_bytes = base64.b64decode(encrypted_password.encode())
-            decrypted = fernet.decrypt(encrypted_bytes)
-            return decrypted.decode()
-        except ImportError:
-            # Fallback from base64
-            try:
-                return base64.b64decode(encrypted_password.encode()).decode()
-            except:
-                return ""
-        except Exception:
-            # If decryption fails, return empty (password changed or corrupted)
-            return ""
+        return decrypt_password(encrypted_password)
     
     def on_save_password_changed(self):
         """Handle save password checkbox change"""
@@ -272,11 +262,23 @@ class RaspFileSendConfig:
                 'auth_method': 'password',
                 'key_path': '',
                 'save_password': 'false',
-                'encrypted_password': ''
+                'encrypted_password': '',
+                'streams': '4',
+                'chunk_threshold_mb': '256'
             }
             self.config['TARGET'] = {
                 'default_directory': '/home/pi/uploads'
             }
+            self.config['TRANSFER'] = {
+                'mode': 'auto',
+                'compression': 'auto',
+                'sync': 'false',
+                'mirror': 'false'
+            }
+            self.config['AGENT'] = {
+                'enabled': 'false',
+                'idle_minutes': '30'
+            }
     
     def load_saved_settings(self):
         try:
@@ -285,6 +287,8 @@ class RaspFileSendConfig:
             self.port_var.set(self.config.get('SSH', 'port', fallback='22'))
             self.auth_var.set(self.config.get('SSH', 'auth_method', fallback='password'))
             self.key_path_var.set(self.config.get('SSH', 'key_path', fallback=''))
+            self.streams_var.set(self.config.get('SSH', 'streams', fallback='4'))
+            self.agent_var.set(self.config.get('AGENT', 'enabled', fallback='false').lower() == 'true')
             self.target_dir_var.set(self.config.get('TARGET', 'default_directory', fallback='/home/pi/uploads'))
             
             # Load password settings
@@ -298,15 +302,29 @@ class RaspFileSendConfig:
                 # Load and decrypt password
                 encrypted_password = self.config.get('SSH', 'encrypted_password', fallback='')
                 if encrypted_password:
-                    decrypted_password = self._decrypt_password(encrypted_password)
-                    self.password_var.set(decrypted_password)
+                    self._load_password_in_background(encrypted_password)
         except Exception as e:
             print(f"Error loading settings: {e}")
     
+    def _load_password_in_background(self, encrypted_password):
+        """Decrypt the saved password without holding up the first paint"""
+        self._password_pending = True
+        
+        def decrypt():
+            password = self._decrypt_password(encrypted_password)
+            self.root.after(0, lambda: self._password_loaded(password))
+        threading.Thread(target=decrypt, daemon=True).start()
+    
+    def _password_loaded(self, password):
+        self._password_pending = False
+        # Keep anything the user typed in the meantime
+        if self.save_password_var.get() and not self.password_var.get():
+            self.password_var.set(password)
+    
     def auto_save(self, *args):
         """Auto-save configuration when any field changes"""
         try:
-            if hasattr(self, 'config'):  # Only save if config is initialized
+            if not self._loading:
                 self.save_config_silent()
         except Exception as e:
             pass  # Ignore errors during auto-save
@@ -318,6 +336,8 @@ class RaspFileSendConfig:
                 self.config.add_section('SSH')
             if not self.config.has_section('TARGET'):
                 self.config.add_section('TARGET')
+            if not self.config.has_section('AGENT'):
+                self.config.add_section('AGENT')
                 
             self.config['SSH']['ip'] = self.ip_var.get()
             self.config['SSH']['username'] = self.username_var.get()
@@ -325,13 +345,15 @@ class RaspFileSendConfig:
             self.config['SSH']['auth_method'] = self.auth_var.get()
             self.config['SSH']['key_path'] = self.key_path_var.get()
             self.config['SSH']['save_password'] = str(self.save_password_var.get()).lower()
+            self.config['SSH']['streams'] = self.streams_var.get()
+            self.config['AGENT']['enabled'] = str(self.agent_var.get()).lower()
             self.config['TARGET']['default_directory'] = self.target_dir_var.get()
             
             # Handle password saving
             if self.save_password_var.get() and self.password_var.get():
                 encrypted_password = self._encrypt_password(self.password_var.get())
                 self.config['SSH']['encrypted_password'] = encrypted_password
-            else:
+            elif not (self._password_pending and self.save_password_var.get()):
                 # Remove password if not saving or empty
                 if self.config.has_option('SSH', 'encrypted_password'):
                     self.config.remove_option('SSH', 'encrypted_password')
@@ -361,6 +383,8 @@ class RaspFileSendConfig:
                 self.config.add_section('SSH')
             if not self.config.has_section('TARGET'):
                 self.config.add_section('TARGET')
+            if not self.config.has_section('AGENT'):
+                self.config.add_section('AGENT')
                 
             self.config['SSH']['ip'] = self.ip_var.get()
             self.config['SSH']['username'] = self.username_var.get()
@@ -368,13 +392,15 @@ class RaspFileSendConfig:
             self.config['SSH']['auth_method'] = self.auth_var.get()
             self.config['SSH']['key_path'] = self.key_path_var.get()
             self.config['SSH']['save_password'] = str(self.save_password_var.get()).lower()
+            self.config['SSH']['streams'] = self.streams_var.get()
+            self.config['AGENT']['enabled'] = str(self.agent_var.get()).lower()
             self.config['TARGET']['default_directory'] = self.target_dir_var.get()
             
             # Handle password saving
             if self.save_password_var.get() and self.password_var.get():
                 encrypted_password = self._encrypt_password(self.password_var.get())
                 self.config['SSH']['encrypted_password'] = encrypted_password
-            else:
+            elif not (self._password_pending and self.save_password_var.get()):
                 # Remove password if not saving or empty
                 if self.config.has_option('SSH', 'encrypted_password'):
                     self.config.remove_option('SSH', 'encrypted_password')
@@ -435,35 +461,35 @@ class RaspFileSendConfig:
                         self.test_status_var.set("Test cancelled")
                         return
             
+            if self.auth_var.get() != "password" and not self.key_path_var.get().strip():
+                self.test_status_var.set("✗ Please specify SSH key path")
+                return
+            int(self.port_var.get())
+            
+            # The test connects with the settings as they are on screen
+            self.save_config_silent()
+            target_dir = self.target_dir_var.get()
+            
             # Run connection test in background thread
             def test():
+                from raspfilesend_pool import get_pool
+                from raspfilesend_trace import start_trace
+                # Phase timings (lookup, connect, handshake, login, mkdir) when tracing is on
+                tracer = start_trace(self.config, 'test_connection', host=self.ip_var.get().strip())
                 try:
-                    ssh = paramiko.SSHClient()
-                    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    
-                    if self.auth_var.get() == "password":
-                        ssh.connect(
-                            hostname=self.ip_var.get().strip(),
-                            username=self.username_var.get().strip(),
-                            password=password,
-                            port=int(self.port_var.get()),
-                            timeout=10
-                        )
+                    if self.agent_var.get():
+                        # The agent keeps the tested connection warm, so the next send skips the handshake
+                        from raspfilesend_agent import agent_request
+                        reply = agent_request({'cmd': 'test', 'password': password, 'target_dir': target_dir})
+                        if reply.get('event') == 'error':
+                            raise Exception(reply['message'])
                     else:
-                        if not self.key_path_var.get().strip():
-                            self.root.after(0, lambda: self.test_status_var.set("✗ Please specify SSH key path"))
-                            return
-                        ssh.connect(
-                            hostname=self.ip_var.get().strip(),
-                            username=self.username_var.get().strip(),
-                            key_filename=self.key_path_var.get().strip(),
-                            port=int(self.port_var.get()),
-                            timeout=10
-                        )
-                    
-                    # Test if target directory exists, create if not
-                    stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {self.target_dir_var.get()}")
-                    ssh.close()
+                        # Always a fresh login, so the test really checks the settings; the pool keeps it
+                        with get_pool(self.config).connection(self.config, password, fresh=True,
+                                                              tracer=tracer) as (backend, reused):
+                            # Test if target directory exists, create if not
+                            with tracer.span("mkdir", directory=target_dir):
+                                backend.mkdir_many([target_dir])
                     
                     # Update UI on main thread
                     self.root.after(0, lambda: self.test_status_var.set("✓ Connection successful!"))
@@ -481,6 +507,8 @@ class RaspFileSendConfig:
                     
                     # Update UI on main thread
                     self.root.after(0, lambda: self.test_status_var.set(f"✗ {error_msg}"))
+                finally:
+                    tracer.close()
             
             threading.Thread(target=test, daemon=True).start()
             
@@ -489,6 +517,145 @@ class RaspFileSendConfig:
         except Exception as e:
             self.test_status_var.set(f"✗ Error: {str(e)[:50]}...")
     
+    def benchmark_ciphers(self):
+        """Measure every cipher the Pi supports and save the fastest order for it"""
+        if not self.ip_var.get().strip() or not self.username_var.get().strip():
+            self.test_status_var.set("✗ Please enter IP and username first")
+            return
+        try:
+            import paramiko
+        except ImportError:
+            self.test_status_var.set("✗ paramiko not installed. Run: pip install paramiko")
+            return
+        
+        password = None
+        if self.auth_var.get() == "password":
+            if self.save_password_var.get() and self.password_var.get():
+                password = self.password_var.get()
+            else:
+                password = simpledialog.askstring("Password", "Enter SSH password:", show='*', parent=self.root)
+                if not password:
+                    self.test_status_var.set("Benchmark cancelled")
+                    return
+        
+        # The benchmark connects with the settings as they are on screen
+        self.save_config_silent()
+        self.test_status_var.set("Benchmarking ciphers...")
+        
+        def bench():
+            from raspfilesend_cipherbench import run_benchmark
+            from raspfilesend_compression import format_rate
+            try:
+                progress = lambda message: self.root.after(0, lambda m=message: self.test_status_var.set(m))
+                transfers, key_exchanges = run_benchmark(self.config, password, log=progress)
+                if not transfers:
+                    raise Exception("no cipher could be measured")
+                with open(self.config_file, 'w') as f:
+                    self.config.write(f)
+                
+                lines = [f"{cipher} / {mac or 'built-in MAC'}: {format_rate(speed)}"
+                         for speed, cipher, mac in transfers[:5]]
+                if key_exchanges:
+                    lines.append(f"\nQuickest key exchange: {key_exchanges[0][1]}")
+                speed, cipher, _ = transfers[0]
+                self.root.after(0, lambda: self.test_status_var.set(f"✓ Fastest: {cipher} ({format_rate(speed)})"))
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Cipher Benchmark",
+                    "Fastest upload ciphers for this Pi:\n\n" + "\n".join(lines) +
+                    "\n\nTransfers will now ask for this order.",
+                    parent=self.root))
+            except Exception as e:
+                error_msg = str(e)
+                self.root.after(0, lambda: self.test_status_var.set(f"✗ Benchmark failed: {error_msg[:50]}"))
+        
+        threading.Thread(target=bench, daemon=True).start()
+    
+    def show_history(self):
+        """Show throughput per Pi and its trend, from the transfer history (raspfilesend_history.py)"""
+        from raspfilesend_compression import format_rate
+        from raspfilesend_history import MIN_ESTIMATE_BYTES, format_time, host_sessions, host_summaries
+        from raspfilesend_progress import format_duration, format_size
+        
+        summaries = host_summaries(self.config)
+        window = tk.Toplevel(self.root)
+        window.title("Transfer History")
+        window.geometry("680x560")
+        frame = ttk.Frame(window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        if not summaries:
+            ttk.Label(frame, text="No transfers recorded yet.").pack(pady=20)
+            return
+        
+        hosts = ttk.Treeview(frame, columns=("transfers", "last", "speed", "trend"), height=5)
+        for column, title, width in (("#0", "Raspberry Pi", 200), ("transfers", "Transfers", 80),
+                                     ("last", "Last transfer", 130), ("speed", "Recent speed", 110),
+                                     ("trend", "Trend", 90)):
+            hosts.heading(column, text=title)
+            hosts.column(column, width=width, stretch=column == "#0")
+        for index, summary in enumerate(summaries):
+            recent, earlier = summary['recent_rate'], summary['earlier_rate']
+            trend = ""
+            if recent and earlier:
+                change = recent / earlier - 1
+                trend = f"{'▲' if change >= 0 else '▼'} {change:+.0%}"
+            label = f"{summary['name']} ({summary['host']})" if summary['name'] else summary['host']
+            hosts.insert("", tk.END, iid=str(index), text=label,
+                         values=(summary['sessions'], format_time(summary['last']),
+                                 format_rate(recent) if recent else "-", trend))
+        hosts.pack(fill=tk.X)
+        
+        chart = tk.Canvas(frame, height=150, background="white", highlightthickness=0)
+        chart.pack(fill=tk.X, pady=10)
+        
+        sessions = ttk.Treeview(frame, columns=("when", "target", "files", "size", "time", "speed", "errors"),
+                                show="headings", height=10)
+        for column, title, width in (("when", "When", 110), ("target", "Target", 120), ("files", "Files", 50),
+                                     ("size", "Size", 70), ("time", "Time", 55), ("speed", "Speed", 80),
+                                     ("errors", "Errors", 150)):
+            sessions.heading(column, text=title)
+            sessions.column(column, width=width, stretch=column in ("target", "errors"))
+        sessions.pack(fill=tk.BOTH, expand=True)
+        
+        def draw_chart(rows):
+            chart.delete("all")
+            # Oldest first; small transfers are mostly round trips and would hide the trend
+            rates = [row['throughput'] for row in reversed(rows)
+                     if row['throughput'] and row['bytes'] >= MIN_ESTIMATE_BYTES]
+            chart.update_idletasks()
+            width, height, margin = max(chart.winfo_width(), 200), 150, 20
+            if len(rates) < 2:
+                chart.create_text(width // 2, height // 2, text="Not enough transfers over 1 MB for a trend yet")
+                return
+            top = max(rates)
+            points = []
+            for index, rate in enumerate(rates):
+                points.append(margin + index * (width - 2 * margin) / (len(rates) - 1))
+                points.append(height - margin - rate / top * (height - 2 * margin))
+            chart.create_line(margin, height - margin, width - margin, height - margin, fill="gray")
+            chart.create_line(*points, fill="blue", width=2)
+            chart.create_text(margin, 4, anchor=tk.NW, text=f"max {format_rate(top)}", fill="gray")
+            chart.create_text(margin, height - 4, anchor=tk.SW, fill="gray",
+                              text=f"Speed of the last {len(rates)} transfers over 1 MB, oldest on the left")
+        
+        def show_host(event=None):
+            selection = hosts.selection()
+            if not selection:
+                return
+            rows = host_sessions(self.config, summaries[int(selection[0])]['host'])
+            sessions.delete(*sessions.get_children())
+            for row in rows:
+                errors = row['error'] or ""
+                if row['failed']:
+                    errors = f"{row['failed']} failed" + (f": {errors}" if errors else "")
+                sessions.insert("", tk.END, values=(
+                    format_time(row['started']), row['target_dir'], row['files'], format_size(row['bytes']),
+                    format_duration(row['seconds']), format_rate(row['throughput']) if row['throughput'] else "-",
+                    errors))
+            draw_chart(rows)
+        
+        hosts.bind("<<TreeviewSelect>>", show_host)
+        hosts.selection_set("0")
+    
     def install_sendto_menu(self):
         try:
             # Get the path to the current script directory
@@ -7,6 +7,9 @@ import subprocess
 from pathlib import Path
 import threading
 
+from raspfilesend_backend import open_backend
+from raspfilesend_common import get_backend
+
 class RaspFileSendConfig:
     def __init__(self):
         self.root = tk.Tk()
@@ -245,12 +248,24 @@ class RaspFileSendConfig:
                 self.test_status_var.set("✗ Please enter username")
                 return
             
-            # Import here to avoid issues if paramiko is not installed
-            try:
-                import paramiko
-            except ImportError:
-                self.test_status_var.set("✗ paramiko not installed. Run: pip install paramiko")
-                return
+            # Test with the settings on screen, saved or not
+            config = configparser.ConfigParser()
+            config.read_dict(self.config)
+            if not config.has_section('SSH'):
+                config.add_section('SSH')
+            config['SSH']['ip'] = self.ip_var.get().strip()
+            config['SSH']['username'] = self.username_var.get().strip()
+            config['SSH']['port'] = str(int(self.port_var.get()))
+            config['SSH']['auth_method'] = self.auth_var.get()
+            config['SSH']['key_path'] = self.key_path_var.get().strip()
+            
+            # Check here to avoid issues if paramiko is not installed
+            if get_backend(config) != "local":
+                try:
+                    import paramiko
+                except ImportError:
+                    self.test_status_var.set("✗ paramiko not installed. Run: pip install paramiko")
+                    return
             
             # Get password if needed (on main thread)
             password = None
@@ -263,32 +278,14 @@ class RaspFileSendConfig:
             # Run connection test in background thread
             def test():
                 try:
-                    ssh = paramiko.SSHClient()
-                    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    
-                    if self.auth_var.get() == "password":
-                        ssh.connect(
-                            hostname=self.ip_var.get().strip(),
-                            username=self.username_var.get().strip(),
-                            password=password,
-                            port=int(self.port_var.get()),
-                            timeout=10
-                        )
-                    else:
-                        if not self.key_path_var.get().strip():
-                            self.root.after(0, lambda: self.test_status_var.set("✗ Please specify SSH key path"))
-                            return
-                        ssh.connect(
-                            hostname=self.ip_var.get().strip(),
-                            username=self.username_var.get().strip(),
-                            key_filename=self.key_path_var.get().strip(),
-                            port=int(self.port_var.get()),
-                            timeout=10
-                        )
+                    if self.auth_var.get() != "password" and not self.key_path_var.get().strip():
+                        self.root.after(0, lambda: self.test_status_var.set("✗ Please specify SSH key path"))
+                        return
                     
-                    # Test if target directory exists, create if not
-                    stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {self.target_dir_var.get()}")
-                    ssh.close()
+                    # Connect through the configured backend (see raspfilesend_backend.py)
+                    with open_backend(config, password, timeout=10) as backend:
+                        # Test if target directory exists, create if not
+                        backend.mkdir_many([self.target_dir_var.get()])
                     
                     # Update UI on main thread
                     self.root.after(0, lambda: self.test_status_var.set("✓ Connection successful!"))
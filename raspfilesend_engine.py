@@ -0,0 +1,1059 @@
+"""
+Transfer engine for RaspFileSend
+Uploads files to the Raspberry Pi over several SFTP channels that share one SSH connection
+"""
+
+import contextlib
+import hashlib
+import itertools
+import os
+import posixpath
+import queue
+import shlex
+import stat
+import tarfile
+import threading
+import time
+
+from raspfilesend_backend import as_backend
+from raspfilesend_common import connection_id, get_backend
+from raspfilesend_compression import CompressingWriter, create_compression_policy, format_rate, is_compressible
+from raspfilesend_resume import PART_SUFFIX, get_checkpoint_store, verify_remote_chunks
+from raspfilesend_throttle import create_throttle
+from raspfilesend_trace import NULL_TRACER, start_trace
+from raspfilesend_walk import renamed, sample_files, walk_files
+
+DEFAULT_STREAMS = 4
+MAX_STREAMS = 16
+
+# Batches of at least this many files averaging under TAR_MAX_AVERAGE_SIZE go through one tar stream
+TAR_MIN_FILES = 32
+TAR_MAX_AVERAGE_SIZE = 1024 * 1024
+
+# Mode and compression are chosen from the first files of the walk, so large folders start at once
+SAMPLE_FILES = 256
+
+# Files at or above this size are split into byte ranges, written concurrently and resumable
+DEFAULT_CHUNK_THRESHOLD_MB = 256
+CHUNK_SIZE = 8 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+def get_stream_count(config):
+    """Read the number of parallel SFTP streams from the [SSH] section"""
+    try:
+        streams = int(config.get('SSH', 'streams', fallback=str(DEFAULT_STREAMS)))
+    except ValueError:
+        streams = DEFAULT_STREAMS
+    return max(1, min(streams, MAX_STREAMS))
+
+
+def get_chunk_threshold(config):
+    """Read the large-file threshold (in bytes) from the [SSH] section; 0 disables chunking"""
+    try:
+        threshold_mb = float(config.get('SSH', 'chunk_threshold_mb', fallback=str(DEFAULT_CHUNK_THRESHOLD_MB)))
+    except ValueError:
+        threshold_mb = DEFAULT_CHUNK_THRESHOLD_MB
+    return max(0, int(threshold_mb * 1024 * 1024))
+
+
+def choose_transfer_mode(config, files):
+    """Pick "sftp" or "tar" from the [TRANSFER] mode setting (sftp, tar or auto)"""
+    mode = config.get('TRANSFER', 'mode', fallback='auto').strip().lower()
+    if mode in ('sftp', 'tar'):
+        return mode
+
+    # Auto: many small files are dominated by per-file round trips, so stream them as one tar
+    sizes = [os.path.getsize(f) for f in files if os.path.isfile(f)]
+    if len(sizes) >= TAR_MIN_FILES and sum(sizes) / len(sizes) < TAR_MAX_AVERAGE_SIZE:
+        return 'tar'
+    return 'sftp'
+
+
+def is_unchanged(local_stat, remote_attr):
+    """Compare a local os.stat result with a remote SFTP attribute by size and whole-second mtime"""
+    return (remote_attr is not None
+            and remote_attr.st_size == local_stat.st_size
+            and remote_attr.st_mtime == int(local_stat.st_mtime))
+
+
+def run_transfer(backend, config, files, target_dir, log, ask_overwrite=None, sync=False, mirror=False,
+                 on_start=None, report=None, progress=None, resolve_conflicts=None, reader_pool=None,
+                 stream_slots=None, rate_limit=None, low_priority=None, tracer=None):
+    """Create the target directory and send files with the configured mode
+
+    backend is a connected Backend (see raspfilesend_backend.open_backend) or a plain SSH client.
+
+    on_start(uploader) is called just before the upload begins, so callers can add files or cancel.
+    report(outcome, name, **details) is called once per file, see ParallelUploader.
+    progress is an optional ProgressTracker that receives the bytes as they are sent.
+    resolve_conflicts(conflicts), if given, is asked once about every file that already exists
+    (see find_conflicts) and returns {name: "overwrite" | "skip" | "rename"}, or None to cancel;
+    ask_overwrite is then only used for files that appear on the Pi after the scan.
+    reader_pool and stream_slots let several hosts share file reads and a stream limit, see
+    raspfilesend_fleet.
+    rate_limit is a TokenBucket shared by everything the caller sends (it may be changed while
+    the upload runs); the per-host limit and low priority mode come from config unless
+    low_priority is given, see raspfilesend_throttle.
+    tracer is the caller's session from raspfilesend_trace.start_trace (so the connect phases are
+    in it too); without one, the transfer records a session of its own when tracing is on.
+    Returns (completed, uploader) so callers can report the per-file counters.
+    """
+    backend = as_backend(backend)
+    ssh = backend.client
+    own_trace = tracer is None
+    if own_trace:
+        tracer = start_trace(config, 'transfer', host=connection_id(config)[0], target_dir=target_dir)
+    try:
+        if backend.name == "openssh":
+            log("🔐 Using the system OpenSSH client")
+        elif get_backend(config) == "openssh":
+            log("⚠️ No OpenSSH client (ssh) found, using paramiko instead")
+
+        # Create target directory if it doesn't exist
+        with tracer.span("mkdir", directory=target_dir):
+            backend.mkdir_many([target_dir])
+
+        # Settle every conflict up front, so the upload itself never stops to ask
+        resolutions = None
+        if resolve_conflicts and not (sync or mirror):
+            with tracer.span("conflict_scan") as span:
+                conflicts = find_conflicts(ssh, target_dir, files)
+                span['conflicts'] = len(conflicts)
+            if conflicts:
+                log(f"⚠️ {len(conflicts)} file(s) already exist in {target_dir}")
+                resolutions = resolve_conflicts(conflicts)
+                if resolutions is None:
+                    uploader = ParallelUploader(backend, target_dir, log=log, report=report)
+                    uploader.cancel()
+                    return False, uploader
+
+        # Many small files go through one tar stream, everything else over parallel SFTP channels
+        streams = get_stream_count(config)
+        sample = sample_files(files, SAMPLE_FILES)
+        mode = choose_transfer_mode(config, sample)
+        if mode == 'tar':
+            uploader_class = TarStreamUploader
+        else:
+            uploader_class = ParallelUploader
+            if streams > 1 and len(sample) > 1:
+                log(f"⚡ Using {min(streams, len(sample))} parallel streams")
+
+        # Optional on-the-fly compression, tuned to the measured link speed
+        with tracer.span("compression_setup"):
+            compression = create_compression_policy(config, ssh, sample, log=log)
+
+        throttle, backoff = create_throttle(config, ssh, rate_limit, low_priority, log)
+        uploader = uploader_class(
+            backend, target_dir, streams=streams, log=log, ask_overwrite=ask_overwrite,
+            chunk_threshold=get_chunk_threshold(config),
+            sync=sync, mirror=mirror, compression=compression, report=report, progress=progress,
+            resolutions=resolutions, reader_pool=reader_pool, stream_slots=stream_slots, throttle=throttle,
+            tracer=tracer
+        )
+        if on_start:
+            on_start(uploader)
+        try:
+            with tracer.span("upload", mode=mode) as span:
+                completed = uploader.run(files)
+                span.update(files=uploader.transferred, bytes=uploader.transferred_bytes, failed=uploader.failed)
+        finally:
+            if backoff:
+                backoff.stop()
+        return completed, uploader
+    finally:
+        if own_trace and tracer.close():
+            log(f"📊 Timing trace saved to {tracer.path}")
+
+
+def find_conflicts(ssh, target_dir, files):
+    """List the selected files that already exist on the Pi, in walk order
+
+    Each remote folder is listed once, and folders that do not exist on the Pi are not listed
+    at all. Returns [{'name', 'local_size', 'local_mtime', 'remote_size', 'remote_mtime'}],
+    where name is the path below target_dir.
+    """
+    sftp = ssh.open_sftp()
+    listings = {}
+
+    def listing(folder):
+        if folder not in listings:
+            parent, base = posixpath.split(folder)
+            if folder and base not in listing(parent):
+                listings[folder] = {}
+            else:
+                try:
+                    path = f"{target_dir}/{folder}" if folder else target_dir
+                    listings[folder] = {attr.filename: attr for attr in sftp.listdir_attr(path)}
+                except IOError:
+                    listings[folder] = {}
+        return listings[folder]
+
+    conflicts = []
+    try:
+        for local_path, relative in walk_files(files):
+            folder, name = posixpath.split(relative)
+            remote_attr = listing(folder).get(name)
+            if remote_attr is None:
+                continue
+            try:
+                local_stat = os.stat(local_path)
+            except OSError:
+                continue  # Reported as not found by the uploader
+            conflicts.append({
+                'name': relative,
+                'local_size': local_stat.st_size,
+                'local_mtime': int(local_stat.st_mtime),
+                'remote_size': remote_attr.st_size,
+                'remote_mtime': remote_attr.st_mtime,
+            })
+    finally:
+        sftp.close()
+    return conflicts
+
+
+def summarize_sync(uploader):
+    """One log line describing what a sync or mirror run did"""
+    summary = f"🔁 Sync: {uploader.transferred} sent, {uploader.unchanged} unchanged"
+    if uploader.mirror:
+        summary += f", {uploader.removed} removed"
+    return summary
+
+
+class CountingReader:
+    """Read-only file wrapper that reports how many bytes have been read"""
+
+    def __init__(self, file, callback):
+        self.file = file
+        self.callback = callback
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.callback(len(data))
+        return data
+
+
+class ChannelWriter:
+    """Minimal write-only file object over a paramiko channel, used as a stream target"""
+
+    def __init__(self, channel, throttle=None):
+        self.channel = channel
+        self.throttle = throttle
+
+    def write(self, data):
+        if self.throttle:
+            self.throttle.consume(len(data))
+        self.channel.sendall(data)
+        return len(data)
+
+
+def read_stderr(channel):
+    """Collect whatever the remote command wrote to stderr once it has exited"""
+    chunks = []
+    while channel.recv_stderr_ready():
+        chunks.append(channel.recv_stderr(65536))
+    return b"".join(chunks).decode(errors='replace').strip()
+
+
+class ParallelUploader:
+    """Upload a batch of files over several SFTP channels opened on the same SSH transport
+
+    backend is a Backend (or a plain SSH client); the channels are opened on its client.
+    """
+
+    def __init__(self, backend, target_dir, streams=DEFAULT_STREAMS, log=None, ask_overwrite=None,
+                 chunk_threshold=DEFAULT_CHUNK_THRESHOLD_MB * 1024 * 1024, sync=False, mirror=False,
+                 compression=None, report=None, progress=None, resolutions=None, reader_pool=None,
+                 stream_slots=None, throttle=None, tracer=None):
+        self.backend = as_backend(backend)
+        self.ssh = self.backend.client
+        self.target_dir = target_dir
+        self.streams = max(1, int(streams))
+        self.chunk_threshold = chunk_threshold
+        # Sync uploads only files whose size or mtime differ; mirror also deletes remote extras
+        self.sync = sync or mirror
+        self.mirror = mirror
+        # CompressionPolicy, or None to always send raw bytes
+        self.compression = compression
+        self.log = log or (lambda message: None)
+        # ask_overwrite(filename) returns "yes", "no", "yes_all", "no_all" or "cancel"
+        self.ask_overwrite = ask_overwrite
+        # report(outcome, name, **details) with outcome "transferred", "skipped", "unchanged",
+        # "removed" or "failed", for callers that want results per file rather than log lines
+        self.report = report or (lambda outcome, name, **details: None)
+        # ProgressTracker fed with bytes as they are sent, or None
+        self.progress = progress
+        # Answers from the conflict pre-scan: {relative name: "overwrite", "skip" or "rename"}
+        self.resolutions = resolutions
+        self._renamed_to = set()
+        # Fleet transfers: local reads shared with the other hosts (SharedReadPool), and a
+        # semaphore limiting uploads across all hosts
+        self.reader_pool = reader_pool
+        self.stream_slots = stream_slots or contextlib.nullcontext()
+        # Throttle whose consume(nbytes) is called before bytes go on the wire, or None
+        self.throttle = throttle
+        # Tracer timing the remote calls and uploads (see raspfilesend_trace)
+        self.tracer = tracer or NULL_TRACER
+
+        self.overwrite_all = None  # None, True (yes to all), False (no to all)
+        self.cancelled = threading.Event()
+        self.transferred = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = 0
+        self.total = 0
+        self.transferred_bytes = 0
+
+        # filename -> SFTPAttributes for the target directory, fetched once per run
+        self.remote_listing = None
+        # Same for subfolders of an uploaded folder, fetched when the first file in them is checked
+        self._folder_listings = {}
+        self._listing_lock = threading.Lock()
+        # Relative paths of every file and folder in the selection, for mirror mode
+        self._selected = set()
+        self._walking = False
+
+        self._queue = queue.Queue(maxsize=self.streams * 4)
+        # Upload channels in use, workers' and chunk writers' together, so a run never holds more
+        # than `streams` of them (sshd refuses sessions past its MaxSessions, 10 by default)
+        self._channel_slots = threading.BoundedSemaphore(self.streams)
+        self._decision_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        # Files handed in by add_files() while the run is feeding the queue
+        self._added = []
+        self._accepting = False
+        self._added_lock = threading.Lock()
+
+    def cancel(self):
+        """Stop handing out new files; uploads already running finish normally"""
+        self.cancelled.set()
+
+    def add_files(self, files):
+        """Append files to a running upload; returns False once the run no longer takes new files"""
+        with self._added_lock:
+            if not self._accepting or self.cancelled.is_set():
+                return False
+            self._added.extend(files)
+            return True
+
+    def _feed(self, files):
+        """Yield (local, relative) for the initial files, then for any added while the run goes on"""
+        yield from walk_files(files, self._make_dirs, self.log)
+        while True:
+            with self._added_lock:
+                if not self._added:
+                    self._accepting = False
+                    return
+                added, self._added = self._added, []
+            self._count_total(added)
+            yield from walk_files(added, self._make_dirs, self.log)
+
+    def _record(self, outcome, name, **details):
+        """Count one per-file outcome and pass it to the report callback"""
+        with self._stats_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if outcome == 'transferred':
+                self.transferred_bytes += details.get('size', 0)
+        self.report(outcome, name, **details)
+
+    def _count_total(self, files):
+        if self.progress:
+            self.progress.count_in_background(files)
+
+    def _progress_done(self, file_path):
+        """Count a file that will not be sent as done, so the batch still reaches 100%"""
+        if self.progress:
+            try:
+                self.progress.skip(os.path.getsize(file_path))
+            except OSError:
+                pass
+
+    def _advance(self, name):
+        """Return an `advance(nbytes, sent=True)` callback for one file (does nothing without a tracker)"""
+        if not self.progress:
+            return lambda nbytes, sent=True: None
+        return lambda nbytes, sent=True: self.progress.advance(name, nbytes, sent)
+
+    def _put_callback(self, name):
+        """sftp.put callback reporting the bytes confirmed so far"""
+        if not self.progress:
+            return None
+        reported = [0]
+
+        def callback(transferred, total):
+            self.progress.advance(name, transferred - reported[0])
+            reported[0] = transferred
+        return callback
+
+    def _open_local(self, file_path):
+        """Open a local file for reading, through the shared fleet buffers if there are any"""
+        if self.reader_pool is not None:
+            return self.reader_pool.open(file_path)
+        return open(file_path, 'rb')
+
+    def _make_dirs(self, relative_dirs):
+        self._selected.update(relative_dirs)
+        with self.tracer.span("remote_mkdir", folders=len(relative_dirs)):
+            self.backend.mkdir_many([f"{self.target_dir}/{relative}" for relative in relative_dirs])
+
+    def _total_label(self):
+        """File count for progress lines; "+" while folders are still being walked"""
+        return f"{self.total}+" if self._walking else str(self.total)
+
+    def run(self, files):
+        """Upload all files and folders and return True unless the transfer was cancelled"""
+        self.total = 0
+        self._walking = True
+
+        # One directory listing replaces a stat round trip per file
+        control_sftp = self.ssh.open_sftp()
+        try:
+            self.remote_listing = self._list_remote(control_sftp)
+
+            # Folders are walked while the upload runs; only the first few files are looked at up front
+            self._count_total(files)
+            with self._added_lock:
+                self._accepting = True
+            items = self._feed(files)
+            head = list(itertools.islice(items, self.streams))
+
+            workers = []
+            for _ in range(max(1, len(head))):
+                self._channel_slots.acquire()
+                worker = threading.Thread(target=self._worker, daemon=True)
+                worker.start()
+                workers.append(worker)
+
+            # Feed the shared queue; workers drain it concurrently
+            try:
+                for i, (file_path, relative) in enumerate(itertools.chain(head, items), 1):
+                    if self.cancelled.is_set():
+                        break
+                    self.total = i
+                    self._queue.put((i, file_path, relative))
+                    self._selected.add(relative)
+            except Exception as e:
+                self.log(f"❌ ERROR: {e}")
+                self._record('failed', None, error=str(e))
+            finally:
+                with self._added_lock:
+                    self._accepting = False
+                self._walking = False
+
+            # One sentinel per worker tells it there is nothing left to do
+            for _ in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+
+            if self.mirror and not self.cancelled.is_set():
+                self._remove_extra_files(control_sftp)
+        finally:
+            control_sftp.close()
+
+        return not self.cancelled.is_set()
+
+    def _list_remote(self, sftp, directory=None):
+        """Fetch the target directory (or one below it) in a single listdir_attr call"""
+        with self.tracer.span("list_remote", directory=directory or self.target_dir) as span:
+            try:
+                listing = {attr.filename: attr for attr in sftp.listdir_attr(directory or self.target_dir)}
+            except FileNotFoundError:
+                # Not created yet (tar streams make folders as they go), so nothing in it exists either
+                span['missing'] = True
+                return {}
+            except IOError:
+                # Directory listing not available; fall back to per-file stat
+                span['unavailable'] = True
+                return None
+            span['entries'] = len(listing)
+            return listing
+
+    def _remote_attr(self, sftp, relative, remote_path):
+        """Return the remote SFTPAttributes for a file, or None if it does not exist yet"""
+        folder, name = posixpath.split(relative)
+        if not folder:
+            listing = self.remote_listing
+        else:
+            with self._listing_lock:
+                listing = self._folder_listings.get(folder, False)
+            if listing is False:
+                listing = self._list_remote(sftp, f"{self.target_dir}/{folder}")
+                with self._listing_lock:
+                    self._folder_listings[folder] = listing
+        if listing is not None:
+            return listing.get(name)
+        with self.tracer.span("stat", file=relative) as span:
+            try:
+                return sftp.stat(remote_path)
+            except FileNotFoundError:
+                span['missing'] = True
+                return None  # File doesn't exist, continue with transfer
+
+    def _remove_extra_files(self, sftp, folder="", listing=None):
+        """Delete remote files that are not part of this selection (mirror mode)
+
+        Regular files directly in the target directory are compared with the selection, and
+        every folder that was sent is mirrored all the way down, including subfolders that
+        only exist on the Pi. Other folders in the target directory are left alone.
+        """
+        if not folder:
+            listing = self.remote_listing
+        for name, attr in sorted((listing or {}).items()):
+            relative = f"{folder}/{name}" if folder else name
+            if attr.st_mode is None or name.endswith(PART_SUFFIX):
+                continue  # Partial upload kept for resuming
+            if stat.S_ISDIR(attr.st_mode):
+                if folder or relative in self._selected:
+                    self._remove_extra_files(sftp, relative,
+                                             self._list_remote(sftp, f"{self.target_dir}/{relative}"))
+                    if relative not in self._selected:
+                        self._remove_extra(sftp.rmdir, relative, "folder")
+            elif stat.S_ISREG(attr.st_mode) and relative not in self._selected:
+                self._remove_extra(sftp.remove, relative)
+
+    def _remove_extra(self, remove, relative, kind="file"):
+        try:
+            with self.tracer.span("remove", file=relative):
+                remove(f"{self.target_dir}/{relative}")
+            self.log(f"🗑️ Removed: {relative}" + ("/" if kind == "folder" else ""))
+            if kind == "file":
+                self._record('removed', relative)
+        except Exception as e:
+            self.log(f"❌ Failed to remove {relative}: {e}")
+            self._record('failed', relative, error=str(e))
+
+    def _worker(self):
+        sftp = None
+        try:
+            # Every worker gets its own SFTP channel on the shared transport
+            with self.tracer.span("open_sftp"):
+                sftp = self.ssh.open_sftp()
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self.cancelled.is_set():
+                    continue
+                index, file_path, relative = item
+                with self.stream_slots:
+                    self._upload_one(sftp, index, file_path, relative)
+        except Exception as e:
+            self.log(f"❌ ERROR: Upload stream failed: {e}")
+            self._record('failed', None, error=str(e))
+            # Keep draining so the feeder never blocks on a dead worker
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                self._record('failed', item[2], error=str(e))
+        finally:
+            if sftp is not None:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            self._channel_slots.release()
+
+    def _upload_one(self, sftp, index, file_path, relative):
+        checked = self._check_file(sftp, index, file_path, relative)
+        if checked is None:
+            self._progress_done(file_path)
+            return
+        filename, remote_path, local_stat = checked
+
+        file_size = local_stat.st_size
+        if self.progress:
+            self.progress.start_file(filename, file_size)
+        try:
+            # Transfer the file
+            level = self.compression.level_for(file_path, file_size) if self.compression else None
+            with self.tracer.span("put", file=filename, bytes=file_size) as span:
+                if self.chunk_threshold and file_size >= self.chunk_threshold:
+                    span['method'] = 'chunked' if level is None else 'chunked gzip'
+                    self._put_chunked(sftp, file_path, remote_path, local_stat, self._advance(filename), level)
+                elif level is not None:
+                    span['method'] = 'gzip'
+                    self._put_compressed(file_path, remote_path, file_size, level, self._advance(filename))
+                else:
+                    started = time.perf_counter()
+                    with self._open_local(file_path) as local_file:
+                        if self.throttle:
+                            local_file = CountingReader(local_file, self.throttle.consume)
+                        sftp.putfo(local_file, remote_path, file_size, callback=self._put_callback(filename))
+                    if self.compression:
+                        self.compression.observe(file_size, time.perf_counter() - started)
+                if self.sync:
+                    # Keep the local mtime so the next sync comparison is valid
+                    sftp.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
+            self.log(f"✅ Transferred: {filename} ({file_size:,} bytes)")
+            self._record('transferred', filename, size=file_size)
+
+        except Exception as e:
+            self.log(f"❌ Failed to transfer {filename}: {e}")
+            self._record('failed', filename, error=str(e))
+        finally:
+            if self.progress:
+                self.progress.finish_file(filename)
+
+    def _check_file(self, sftp, index, file_path, relative):
+        """Apply the not-found, sync and overwrite rules to one file
+
+        relative is the path below the target directory ("a.txt" or "folder/sub/a.txt").
+        Returns (filename, remote_path, local_stat) when the file should be sent, otherwise None.
+        """
+        if not os.path.exists(file_path):
+            self.log(f"⚠️ WARNING: File not found: {file_path}")
+            self._record('failed', relative, error="file not found")
+            return None
+
+        filename = relative
+        remote_path = f"{self.target_dir}/{relative}"
+
+        try:
+            local_stat = os.stat(file_path)
+
+            # Check if file already exists and ask for confirmation
+            remote_attr = self._remote_attr(sftp, relative, remote_path)
+            file_exists = remote_attr is not None
+
+            if self.sync and is_unchanged(local_stat, remote_attr):
+                self.log(f"⏸️ Unchanged: {filename}")
+                self._record('unchanged', filename)
+                return None
+
+            self.log(f"📤 Transferring [{index}/{self._total_label()}]: {filename}")
+
+            # In sync mode a changed file is simply replaced
+            if file_exists and not self.sync:
+                action = self.resolutions.get(relative) if self.resolutions is not None else None
+                if action == 'rename':
+                    filename = self._free_name(sftp, relative)
+                    remote_path = f"{self.target_dir}/{filename}"
+                    self.log(f"✏️ Renamed: {relative} → {filename}")
+                elif action == 'skip' or (action is None and not self._should_overwrite(filename)):
+                    if not self.cancelled.is_set():
+                        self.log(f"⏭️ Skipped: {filename}")
+                        self._record('skipped', filename)
+                    return None
+
+            return filename, remote_path, local_stat
+
+        except Exception as e:
+            self.log(f"❌ Failed to transfer {filename}: {e}")
+            self._record('failed', filename, error=str(e))
+            return None
+
+    def _free_name(self, sftp, relative):
+        """First "name (n).ext" that is neither on the Pi nor taken by another renamed file"""
+        with self._decision_lock:
+            for number in itertools.count(1):
+                candidate = renamed(relative, number)
+                if candidate in self._renamed_to:
+                    continue
+                if self._remote_attr(sftp, candidate, f"{self.target_dir}/{candidate}") is None:
+                    self._renamed_to.add(candidate)
+                    return candidate
+
+    def _put_compressed(self, file_path, remote_path, file_size, level, advance):
+        """Send one file gzip-compressed into `gzip -dc` on the Pi; advance(nbytes) counts raw bytes"""
+        channel = self.ssh.get_transport().open_session()
+        try:
+            channel.exec_command(f"gzip -dc > {shlex.quote(remote_path)}")
+            writer = CompressingWriter(ChannelWriter(channel, self.throttle), level)
+            started = time.perf_counter()
+            with self._open_local(file_path) as local_file:
+                for block in iter(lambda: local_file.read(BLOCK_SIZE), b''):
+                    writer.write(block)
+                    advance(len(block))
+            writer.finish()
+            channel.shutdown_write()
+            exit_status = channel.recv_exit_status()
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            error = read_stderr(channel)
+        finally:
+            channel.close()
+
+        if exit_status != 0:
+            raise IOError(f"remote gzip failed (exit {exit_status}): {error}")
+        self.compression.observe(writer.wire_bytes, elapsed)
+        self.log(f"🗜️ {os.path.basename(file_path)}: {file_size:,} → {writer.wire_bytes:,} bytes "
+                 f"({writer.ratio:.1f}x, level {level}), {format_rate(file_size / elapsed)} effective")
+
+    def _put_chunked(self, sftp, file_path, remote_path, local_stat, advance, level=None):
+        """Write one large file as concurrent byte ranges into a resumable .part file
+
+        Every chunk that the Pi acknowledges is recorded in the local checkpoint file. A later
+        attempt re-hashes those chunks on the Pi, sends only what is missing, and the .part
+        file is renamed into place once the whole file is complete. advance(nbytes, sent) is
+        told about every block written and about the chunks a resumed upload can keep.
+
+        The calling worker writes chunks on its own channel and takes on helpers, each with
+        another channel, as long as the uploader's channel budget has room. With a compression
+        level every chunk is gzipped on its own into `gzip -dc | dd` on the Pi, so the upload
+        stays resumable.
+        """
+        file_size = local_stat.st_size
+        filename = os.path.basename(file_path)
+        part_path = remote_path + PART_SUFFIX
+        host = self._host_id()
+        checkpoints = get_checkpoint_store()
+        ranges = [(offset, min(CHUNK_SIZE, file_size - offset))
+                  for offset in range(0, file_size, CHUNK_SIZE)]
+
+        # Pick up a previous attempt if the .part file and checkpoint still agree
+        done = checkpoints.lookup(host, remote_path, file_path, local_stat, CHUNK_SIZE)
+        if done:
+            try:
+                part_size = sftp.stat(part_path).st_size
+            except IOError:
+                part_size = None
+            if part_size == file_size:
+                with self.tracer.span("verify_chunks", file=filename, chunks=len(done)):
+                    done = verify_remote_chunks(self.ssh, part_path, done, CHUNK_SIZE)
+            else:
+                done = {}
+        if done:
+            resumed_bytes = sum(ranges[index][1] for index in done if index < len(ranges))
+            advance(resumed_bytes, sent=False)
+            self.log(f"♻️ Resuming {filename}: {len(done)} of {len(ranges)} chunks "
+                     f"({resumed_bytes:,} bytes) already on the Pi")
+        else:
+            # Create the .part file at its final size so every range can be written in place
+            with sftp.open(part_path, 'wb') as remote_file:
+                remote_file.truncate(file_size)
+        checkpoints.start(host, remote_path, file_path, local_stat, CHUNK_SIZE, done)
+
+        pending = queue.Queue()
+        for index, chunk in enumerate(ranges):
+            if index not in done:
+                pending.put((index, chunk))
+        stream_count = max(1, min(self.streams, pending.qsize()))
+        if pending.qsize() > 1:
+            self.log(f"🧩 Splitting {filename} into {pending.qsize()} chunks over up to {stream_count} streams")
+        if level is not None:
+            self.log(f"🗜️ Compressing the chunks of {filename} (level {level})")
+        errors = []
+        helpers = []
+        wire_sizes = []
+        started = time.perf_counter()
+
+        def read_range(local_file, length, digest):
+            """Yield the blocks of one chunk, hashing and counting each once it has been written"""
+            remaining = length
+            while remaining > 0:
+                data = local_file.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    raise IOError(f"{file_path} shrank during upload")
+                yield data
+                digest.update(data)
+                remaining -= len(data)
+                advance(len(data))
+
+        def write_chunk(chunk_sftp, local_file, index, offset, length):
+            local_file.seek(offset)
+            digest = hashlib.sha256()
+            blocks = read_range(local_file, length, digest)
+            with self.tracer.span("chunk", file=filename, index=index, bytes=length):
+                if level is not None:
+                    wire_sizes.append(self._write_compressed_chunk(blocks, part_path, offset, level))
+                else:
+                    # Closing the handle waits for every pipelined write to be acknowledged
+                    with chunk_sftp.open(part_path, 'r+b') as remote_file:
+                        remote_file.set_pipelined(True)
+                        remote_file.seek(offset)
+                        for data in blocks:
+                            if self.throttle:
+                                self.throttle.consume(len(data))
+                            remote_file.write(data)
+            checkpoints.confirm(host, remote_path, index, digest.hexdigest())
+
+        def write_ranges(chunk_sftp, take_helpers=False):
+            with self._open_local(file_path) as local_file:
+                while not errors and not self.cancelled.is_set():
+                    try:
+                        index, (offset, length) = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    # Channels given back by workers that ran out of files are picked up here
+                    while (take_helpers and len(helpers) < stream_count - 1 and not pending.empty()
+                           and self._channel_slots.acquire(blocking=False)):
+                        helper = threading.Thread(target=helper_ranges, daemon=True)
+                        helper.start()
+                        helpers.append(helper)
+                    write_chunk(chunk_sftp, local_file, index, offset, length)
+
+        def helper_ranges():
+            chunk_sftp = None
+            try:
+                # Compressed chunks go through exec channels, one at a time
+                if level is None:
+                    chunk_sftp = self.ssh.open_sftp()
+                write_ranges(chunk_sftp)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if chunk_sftp is not None:
+                    try:
+                        chunk_sftp.close()
+                    except Exception:
+                        pass
+                self._channel_slots.release()
+
+        try:
+            write_ranges(sftp, take_helpers=True)
+        except Exception as e:
+            errors.append(e)
+        for helper in helpers:
+            helper.join()
+
+        if errors or self.cancelled.is_set():
+            checkpoints.flush()
+            self.log(f"💾 Progress for {filename} saved; send it again to resume")
+            if errors:
+                raise errors[0]
+            raise IOError("transfer cancelled")
+
+        remote_size = sftp.stat(part_path).st_size
+        if remote_size != file_size:
+            raise IOError(f"size mismatch after chunked upload ({remote_size:,} of {file_size:,} bytes)")
+
+        # Only a complete file replaces the target
+        try:
+            sftp.posix_rename(part_path, remote_path)
+        except IOError:
+            # Server without the posix-rename extension: plain rename cannot overwrite
+            try:
+                sftp.remove(remote_path)
+            except IOError:
+                pass
+            sftp.rename(part_path, remote_path)
+        checkpoints.finish(host, remote_path)
+
+        if wire_sizes:
+            sent = sum(ranges[index][1] for index in range(len(ranges)) if index not in done)
+            wire_bytes = sum(wire_sizes)
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            self.log(f"🗜️ {filename}: {sent:,} → {wire_bytes:,} bytes "
+                     f"({sent / max(wire_bytes, 1):.1f}x, level {level}), {format_rate(sent / elapsed)} effective")
+
+    def _write_compressed_chunk(self, blocks, part_path, offset, level):
+        """Send one chunk gzipped into `dd` at its offset in the .part file; returns the bytes on the wire"""
+        # With bs= dd writes every (possibly short) read from the pipe as it comes, so the
+        # chunk lands at exactly `seek` blocks; notrunc keeps the rest of the file
+        command = (f"gzip -dc | dd of={shlex.quote(part_path)} bs={BLOCK_SIZE} "
+                   f"seek={offset // BLOCK_SIZE} conv=notrunc 2>/dev/null")
+        channel = self.ssh.get_transport().open_session()
+        try:
+            channel.exec_command(command)
+            writer = CompressingWriter(ChannelWriter(channel, self.throttle), level)
+            started = time.perf_counter()
+            for data in blocks:
+                writer.write(data)
+            writer.finish()
+            channel.shutdown_write()
+            exit_status = channel.recv_exit_status()
+            elapsed = max(time.perf_counter() - started, 1e-6)
+        finally:
+            channel.close()
+
+        if exit_status != 0:
+            raise IOError(f"remote gzip | dd failed (exit {exit_status})")
+        self.compression.observe(writer.wire_bytes, elapsed)
+        return writer.wire_bytes
+
+    def _host_id(self):
+        """Identify the connected Pi for checkpoint keys"""
+        try:
+            host, port = self.ssh.get_transport().getpeername()[:2]
+            return f"{host}:{port}"
+        except Exception:
+            return "unknown"
+
+    def _should_overwrite(self, filename):
+        """Ask about one existing file; only one worker prompts at a time"""
+        with self._decision_lock:
+            if self.cancelled.is_set():
+                return False
+            # Check overwrite_all setting first
+            if self.overwrite_all is not None:
+                return self.overwrite_all
+            if self.ask_overwrite is None:
+                return True
+
+            user_choice = self.ask_overwrite(filename)
+            if user_choice == "yes":
+                return True
+            elif user_choice == "no":
+                return False
+            elif user_choice == "yes_all":
+                self.overwrite_all = True
+                self.log("🔄 Will overwrite all remaining files without asking")
+                return True
+            elif user_choice == "no_all":
+                self.overwrite_all = False
+                self.log("⏭️ Will skip all remaining files without asking")
+                return False
+            else:  # cancel or None
+                self.cancel()
+                return False
+
+
+class TarStreamUploader(ParallelUploader):
+    """Send a batch as one tar stream piped into `tar -x` on the Pi
+
+    Overwrite and sync decisions are made from the directory listings as the walk reaches
+    each file, and every selected file is written into a single exec channel, so there is no
+    per-file round trip and no temporary archive on either side.
+    """
+
+    def run(self, files):
+        """Stream all selected files and folders and return True unless the transfer was cancelled"""
+        self.total = 0
+        self._walking = True
+
+        control_sftp = self.ssh.open_sftp()
+        try:
+            self.remote_listing = self._list_remote(control_sftp)
+
+            # Folders become directory entries in the stream, so tar creates them without extra commands
+            folders = []
+
+            def make_dirs(relative_dirs):
+                folders.extend(relative_dirs)
+                self._selected.update(relative_dirs)
+            self._count_total(files)
+            items = walk_files(files, make_dirs, self.log)
+            sample = list(itertools.islice(items, SAMPLE_FILES))
+
+            if sample or folders:
+                self._stream(control_sftp, sample, itertools.chain(sample, items), folders)
+            self._walking = False
+
+            if self.mirror and not self.cancelled.is_set():
+                self._remove_extra_files(control_sftp)
+        finally:
+            control_sftp.close()
+
+        return not self.cancelled.is_set()
+
+    def _stream(self, control_sftp, sample, items, folders):
+        """Decide and stream each file in walk order through one `tar -x` channel"""
+        self.log("📦 Streaming files as one tar stream")
+
+        level = self._stream_compression_level([local_path for local_path, _ in sample])
+
+        # -p keeps the file modes recorded in the archive; tar restores mtimes by default
+        command = f"tar -x -p -f - -C {shlex.quote(self.target_dir)}"
+        if level is not None:
+            command = f"tar -x -z -p -f - -C {shlex.quote(self.target_dir)}"
+            self.log(f"🗜️ Compressing tar stream (level {level})")
+        channel = self.ssh.get_transport().open_session()
+        channel.exec_command(command)
+        writer = ChannelWriter(channel, self.throttle)
+        if level is not None:
+            writer = CompressingWriter(writer, level)
+        streamed = []
+        started = time.perf_counter()
+
+        try:
+            with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for index, (file_path, relative) in enumerate(items, 1):
+                    if self.cancelled.is_set():
+                        break
+                    self.total = index
+                    self._selected.add(relative)
+                    self._add_folders(tar, folders)
+                    checked = self._check_file(control_sftp, index, file_path, relative)
+                    if checked is None:
+                        self._progress_done(file_path)
+                        continue
+                    filename, remote_path, local_stat = checked
+
+                    tarinfo = tar.gettarinfo(file_path, arcname=filename)
+                    # Ownership is left to the remote user running tar
+                    tarinfo.uid = tarinfo.gid = 0
+                    tarinfo.uname = tarinfo.gname = ""
+                    if level is not None:
+                        # Already-compressed entries are stored in their own gzip member
+                        writer.set_level(level if is_compressible(file_path) else 0)
+                    wire_before = getattr(writer, 'wire_bytes', 0)
+                    entry_started = time.perf_counter()
+                    if self.progress:
+                        self.progress.start_file(filename, local_stat.st_size)
+                    try:
+                        with self.tracer.span("tar_entry", file=filename, bytes=local_stat.st_size), \
+                                self._open_local(file_path) as local_file:
+                            tar.addfile(tarinfo, CountingReader(local_file, self._advance(filename)))
+                    finally:
+                        if self.progress:
+                            self.progress.finish_file(filename)
+                    streamed.append((filename, local_stat.st_size))
+                    if level is not None:
+                        # Flush at each entry boundary so the per-file ratio is exact
+                        writer.sync()
+                        wire = max(writer.wire_bytes - wire_before, 1)
+                        entry_elapsed = max(time.perf_counter() - entry_started, 1e-6)
+                        self.log(f"📦 Streamed [{index}]: {filename} ({local_stat.st_size:,} bytes, "
+                                 f"{local_stat.st_size / wire:.1f}x, {format_rate(local_stat.st_size / entry_elapsed)})")
+                    else:
+                        self.log(f"📦 Streamed [{index}]: {filename} ({local_stat.st_size:,} bytes)")
+                # Folders found after the last file (empty ones at the end of the walk)
+                if not self.cancelled.is_set():
+                    self._add_folders(tar, folders)
+            if level is not None:
+                writer.finish()
+            # Send EOF so tar can finish
+            channel.shutdown_write()
+        except Exception as e:
+            channel.close()
+            self.log(f"❌ Tar stream failed: {e}")
+            for filename, _ in streamed or [(None, 0)]:
+                self._record('failed', filename, error=str(e))
+            return
+
+        # Time for the Pi to write out what is still buffered in the channel
+        with self.tracer.span("tar_wait"):
+            exit_status = channel.recv_exit_status()
+        error = read_stderr(channel)
+        channel.close()
+        if exit_status != 0:
+            self.log(f"❌ Remote tar failed (exit {exit_status}): {error}")
+            for filename, _ in streamed:
+                self._record('failed', filename, error=f"remote tar exit {exit_status}")
+            return
+
+        # Entries only count once the remote tar has confirmed the whole stream
+        for filename, size in streamed:
+            self._record('transferred', filename, size=size)
+        if streamed:
+            self.log(f"✅ Transferred {len(streamed)} files in one tar stream")
+        if level is not None:
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            self.compression.observe(writer.wire_bytes, elapsed)
+            self.log(f"🗜️ Tar stream: {writer.raw_bytes:,} → {writer.wire_bytes:,} bytes "
+                     f"({writer.ratio:.1f}x), {format_rate(writer.raw_bytes / elapsed)} effective")
+
+    @staticmethod
+    def _add_folders(tar, folders):
+        """Write directory entries for folders the walk has reached"""
+        for relative in folders:
+            tarinfo = tarfile.TarInfo(relative)
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            tarinfo.mtime = int(time.time())
+            tar.addfile(tarinfo)
+        folders.clear()
+
+    def _stream_compression_level(self, sample):
+        """Compress the whole tar stream when most bytes in the sampled files are compressible"""
+        if self.compression is None:
+            return None
+        sizes = [(file_path, os.path.getsize(file_path)) for file_path in sample if os.path.isfile(file_path)]
+        total = sum(size for _, size in sizes)
+        compressible = sum(size for file_path, size in sizes if is_compressible(file_path))
+        if not total or compressible * 2 < total:
+            return None
+        return self.compression.level_for_link()
@@ -0,0 +1,545 @@
+"""
+Fleet transfers for RaspFileSend
+Sends one selection to every Raspberry Pi in a named group at the same time, reading each
+local file once for all of them
+
+Hosts and groups are defined in the configuration file next to [SSH]:
+
+    [HOST pi-kitchen]
+    ip = 10.0.0.21
+    # Any other [SSH] setting (username, port, auth_method, key_path, streams, saved password)
+    # may be set here; what is not set is taken from [SSH]. relay_ip is the address the
+    # other Pis use for it in a relay, if it differs from ip
+
+    [GROUP shop]
+    hosts = pi-kitchen, pi-till, pi-door
+
+    [FLEET]
+    max_hosts = 8
+    max_streams = 32
+    buffer_mb = 64
+    relay = false
+    relay_fanout = 3
+
+With relay on, the client uploads only to the first host of the group, and the Pis forward
+the files to each other in a tree with relay_fanout children per Pi (raspfilesend_relay.py).
+The Pis must be able to log in to each other with SSH keys.
+"""
+
+import collections
+import configparser
+import json
+import os
+import posixpath
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from raspfilesend_backend import open_backend
+from raspfilesend_common import connection_id, get_saved_password
+from raspfilesend_engine import run_transfer
+from raspfilesend_history import expected_rate
+from raspfilesend_trace import start_trace
+from raspfilesend_progress import ProgressTracker, format_size
+from raspfilesend_relay import HELPER_PATH as RELAY_HELPER_PATH
+from raspfilesend_throttle import TokenBucket, get_rate_limits
+from raspfilesend_walk import top_level_names
+
+HOST_PREFIX = "HOST "
+
+# Hosts uploading at the same time, and file uploads running at the same time across all of them
+DEFAULT_MAX_HOSTS = 8
+DEFAULT_MAX_STREAMS = 32
+
+# Blocks read from disk are kept this long for the hosts that have not sent them yet
+DEFAULT_BUFFER_MB = 64
+SHARED_BLOCK_SIZE = 1024 * 1024
+
+# Pis each relaying Pi forwards to at the same time
+DEFAULT_RELAY_FANOUT = 3
+
+
+def host_config(config, host):
+    """Copy of config whose [SSH] section is [HOST host] laid over the shared [SSH] settings"""
+    section = HOST_PREFIX + host
+    if not config.has_section(section):
+        raise ValueError(f"no [{section}] section in the configuration")
+    copy = configparser.ConfigParser()
+    copy.read_dict(config)
+    if not copy.has_section('SSH'):
+        copy.add_section('SSH')
+    for option, value in config.items(section):
+        copy['SSH'][option] = value
+    return copy
+
+
+def _get_int(config, option, default):
+    try:
+        return max(1, int(config.get('FLEET', option, fallback=str(default))))
+    except ValueError:
+        return default
+
+
+def get_fleet_limits(config):
+    """Read (max_hosts, max_streams, buffer bytes) from the [FLEET] section"""
+    return (_get_int(config, 'max_hosts', DEFAULT_MAX_HOSTS),
+            _get_int(config, 'max_streams', DEFAULT_MAX_STREAMS),
+            _get_int(config, 'buffer_mb', DEFAULT_BUFFER_MB) * 1024 * 1024)
+
+
+def get_relay_options(config):
+    """Read (relay, fanout) from the [FLEET] section"""
+    relay = config.get('FLEET', 'relay', fallback='false').lower() == 'true'
+    return relay, _get_int(config, 'relay_fanout', DEFAULT_RELAY_FANOUT)
+
+
+def build_relay_tree(config, hosts, fanout):
+    """Plan the tree below hosts[0]: the Pi at position i forwards to positions i*fanout+1 .. i*fanout+fanout
+
+    Returns the seed's children as relay helper nodes; the depth grows with log(hosts), not hosts.
+    """
+    nodes = []
+    for host in hosts:
+        ssh = host_config(config, host)['SSH']
+        nodes.append({'host': host, 'ip': ssh.get('relay_ip', ssh.get('ip', '')), 'port': int(ssh.get('port', '22')),
+                      'username': ssh.get('username', ''), 'children': []})
+    for position, node in enumerate(nodes):
+        node['children'] = nodes[position * fanout + 1:position * fanout + fanout + 1]
+    return nodes[0]['children'] if nodes else []
+
+
+class SharedReadPool:
+    """Read each local file once for several hosts uploading the same files
+
+    Every host reads through its own reader(). A block stays in memory until every host that
+    is still running has read it, within capacity bytes; a host that falls further behind
+    than that reads the dropped blocks from disk again.
+    """
+
+    def __init__(self, capacity=DEFAULT_BUFFER_MB * 1024 * 1024, block_size=SHARED_BLOCK_SIZE):
+        self.capacity = capacity
+        self.block_size = block_size
+        self._blocks = collections.OrderedDict()  # (path, index) -> bytes, oldest first
+        self._seen = {}                           # (path, index) -> ids of the readers that have had it
+        self._loading = {}                        # (path, index) -> Event set when the disk read is done
+        self._active = set()
+        self._next_id = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.disk_bytes = 0
+        self.served_bytes = 0
+
+    def reader(self):
+        """Register one host; blocks are kept for it until it reads them or closes the reader"""
+        with self._lock:
+            self._next_id += 1
+            self._active.add(self._next_id)
+            return PoolReader(self, self._next_id)
+
+    def read_block(self, reader_id, path, index):
+        key = (path, index)
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is None:
+                data = self._take(key, reader_id)
+                if data is not None:
+                    return data
+                self._loading[key] = threading.Event()
+
+        if loading is not None:
+            # Hosts usually run in step: wait for the read another host has already started
+            loading.wait()
+            with self._lock:
+                data = self._take(key, reader_id)
+            if data is not None:
+                return data
+            return self._read_disk(path, index)  # Dropped again in the meantime
+
+        try:
+            data = self._read_disk(path, index)
+            with self._lock:
+                seen = {reader_id}
+                if data and not self._active <= seen:
+                    self._blocks[key] = data
+                    self._seen[key] = seen
+                    self._size += len(data)
+                    while self._size > self.capacity:
+                        self._drop(next(iter(self._blocks)))
+            return data
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def leave(self, reader_id):
+        """A host has finished or failed; stop keeping blocks for it"""
+        with self._lock:
+            self._active.discard(reader_id)
+            for key in [key for key, seen in self._seen.items() if self._active <= seen]:
+                self._drop(key)
+
+    def _take(self, key, reader_id):
+        """Return a cached block and drop it once every active host has had it (lock held)"""
+        data = self._blocks.get(key)
+        if data is not None:
+            self.served_bytes += len(data)
+            seen = self._seen[key]
+            seen.add(reader_id)
+            if self._active <= seen:
+                self._drop(key)
+        return data
+
+    def _drop(self, key):
+        data = self._blocks.pop(key, None)
+        if data is not None:
+            self._size -= len(data)
+        self._seen.pop(key, None)
+
+    def _read_disk(self, path, index):
+        with open(path, 'rb') as local_file:
+            local_file.seek(index * self.block_size)
+            data = local_file.read(self.block_size)
+        with self._lock:
+            self.disk_bytes += len(data)
+            self.served_bytes += len(data)
+        return data
+
+
+class PoolReader:
+    """One host's view of a SharedReadPool; passed to the engine as its reader_pool"""
+
+    def __init__(self, pool, reader_id):
+        self.pool = pool
+        self.reader_id = reader_id
+
+    def open(self, path):
+        return SharedFile(self, path)
+
+    def read_block(self, path, index):
+        return self.pool.read_block(self.reader_id, path, index)
+
+    def close(self):
+        self.pool.leave(self.reader_id)
+
+
+class SharedFile:
+    """Read-only file object over a PoolReader, accepted wherever the engine opens a local file"""
+
+    def __init__(self, reader, path):
+        self.reader = reader
+        self.path = path
+        self._position = 0
+        self._block_index = None
+        self._block = b''
+
+    def read(self, size=-1):
+        block_size = self.reader.pool.block_size
+        chunks = []
+        while size != 0:
+            index, offset = divmod(self._position, block_size)
+            if index != self._block_index:
+                self._block = self.reader.read_block(self.path, index)
+                self._block_index = index
+            data = self._block[offset:] if size < 0 else self._block[offset:offset + size]
+            if not data:
+                break
+            chunks.append(data)
+            self._position += len(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise ValueError("SharedFile only supports absolute seeks")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._block = b''
+        self._block_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FleetTransfer:
+    """Upload the same files to every host of a group, each over its own SSH connection"""
+
+    def __init__(self, config, hosts, files, target_dir, log=None, password=None, overwrite=False,
+                 sync=False, mirror=False, rate_limit=None, low_priority=None):
+        self.config = config
+        self.hosts = list(hosts)
+        self.files = files
+        self.target_dir = target_dir
+        self.log = log or (lambda message: None)
+        # Used for hosts with password authentication and no saved password
+        self.password = password
+        self.overwrite = overwrite
+        self.sync = sync
+        self.mirror = mirror
+        # One bucket for all hosts together ([TRANSFER] max_rate_mb); [HOST] max_rate_mb limits each
+        self.rate_limit = rate_limit if rate_limit is not None else TokenBucket(get_rate_limits(config)[0])
+        self.low_priority = low_priority
+
+        self.cancelled = threading.Event()
+        # ETAs start from each Pi's earlier transfers until their own speed is measured
+        self.progress = {host: ProgressTracker(initial_rate=expected_rate(config, connection_id(host_config(config, host))[0]))
+                         for host in self.hosts}
+        # host -> "waiting", "connecting", "sending", "relaying", "done", "failed" or "cancelled"
+        self.states = {host: "waiting" for host in self.hosts}
+        # host -> {'transferred', 'skipped', 'unchanged', 'removed', 'failed', 'error'}
+        self.results = {}
+        self._uploaders = {}
+        self._lock = threading.Lock()
+
+    def needs_password(self):
+        """True if some host uses password authentication without a saved password"""
+        for host in self.hosts:
+            config = host_config(self.config, host)
+            if config.get('SSH', 'auth_method', fallback='password') == "password" and not get_saved_password(config):
+                return True
+        return False
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            uploaders = list(self._uploaders.values())
+        for uploader in uploaders:
+            uploader.cancel()
+
+    def run(self):
+        """Send to every host and return results; a failing host does not stop the others"""
+        max_hosts, max_streams, buffer_bytes = get_fleet_limits(self.config)
+        pool = SharedReadPool(buffer_bytes)
+        # Hosts waiting for a free slot are registered too, so the blocks are kept for them
+        readers = {host: pool.reader() for host in self.hosts}
+        stream_slots = threading.BoundedSemaphore(max_streams)
+        self.log(f"🚚 Sending to {len(self.hosts)} hosts, {min(max_hosts, len(self.hosts))} at a time")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_hosts, len(self.hosts)))) as executor:
+            for host in self.hosts:
+                executor.submit(self._run_host, host, readers[host], stream_slots)
+
+        if pool.served_bytes:
+            self.log(f"📖 Read {format_size(pool.disk_bytes)} from disk for "
+                     f"{format_size(pool.served_bytes)} sent to {len(self.hosts)} hosts")
+        return self.results
+
+    def _run_host(self, host, reader, stream_slots):
+        log = lambda message: self.log(f"[{host}] {message}")
+        try:
+            if self.cancelled.is_set():
+                self.states[host] = "cancelled"
+                self.results[host] = {'error': "cancelled"}
+                return
+            config = host_config(self.config, host)
+            self.states[host] = "connecting"
+            tracer = start_trace(config, 'transfer', host=connection_id(config)[0], name=host,
+                                 target_dir=self.target_dir)
+            backend = None
+            try:
+                backend = open_backend(config, self._host_password(host), tracer=tracer)
+                self.states[host] = "sending"
+                completed, uploader = run_transfer(
+                    backend, config, self.files, self.target_dir, log,
+                    ask_overwrite=lambda filename: "yes_all" if self.overwrite else "no_all",
+                    sync=self.sync, mirror=self.mirror, on_start=lambda uploader: self._attach(host, uploader),
+                    progress=self.progress[host], reader_pool=reader, stream_slots=stream_slots,
+                    rate_limit=self.rate_limit, low_priority=self.low_priority, tracer=tracer
+                )
+                if completed and not uploader.failed and not self.cancelled.is_set():
+                    self._after_upload(host, backend)
+            finally:
+                if backend is not None:
+                    backend.close()
+                if tracer.close():
+                    log(f"📊 Timing trace saved to {tracer.path}")
+            self.results[host] = {name: getattr(uploader, name)
+                                  for name in ('transferred', 'skipped', 'unchanged', 'removed', 'failed')}
+            if not completed:
+                self.states[host] = "cancelled"
+            elif uploader.failed:
+                self.states[host] = "failed"
+                self.results[host]['error'] = f"{uploader.failed} file(s) failed"
+            else:
+                self.states[host] = "done"
+        except Exception as e:
+            log(f"❌ ERROR: {e}")
+            self.states[host] = "failed"
+            self.results[host] = {'error': str(e)}
+        finally:
+            if reader is not None:
+                reader.close()
+
+    def _after_upload(self, host, backend):
+        """Hook for work on a host's connection (a Backend) once its files are uploaded"""
+
+    def _host_password(self, host):
+        config = host_config(self.config, host)
+        if config.get('SSH', 'auth_method', fallback='password') == "password":
+            return get_saved_password(config) or self.password
+        return None
+
+    def _attach(self, host, uploader):
+        with self._lock:
+            self._uploaders[host] = uploader
+        if self.cancelled.is_set():
+            uploader.cancel()
+
+    def status(self):
+        """[(host, state, progress snapshot)] in group order"""
+        return [(host, self.states[host], self.progress[host].snapshot()) for host in self.hosts]
+
+    def snapshot(self):
+        """Progress of the whole fleet in the ProgressTracker snapshot format"""
+        snapshots = [self.progress[host].snapshot() for host in self.hosts]
+        running = [s for host, s in zip(self.hosts, snapshots) if self.states[host] in ("waiting", "connecting", "sending", "relaying")]
+        etas = [s['eta'] for s in running]
+        return {
+            'done': sum(s['done'] for s in snapshots),
+            'total': sum(s['total'] for s in snapshots),
+            'sent': sum(s['sent'] for s in snapshots),
+            'elapsed': max(s['elapsed'] for s in snapshots) if snapshots else 0.0,
+            'counting': any(s['counting'] for s in running),
+            'rate': sum(s['rate'] for s in running),
+            'smoothed': sum(s['smoothed'] for s in running),
+            # The fleet is done when its slowest host is
+            'eta': max(etas) if etas and None not in etas else None,
+            'files': [],
+        }
+
+    def summary(self):
+        """One line per host for the final report"""
+        lines = []
+        for host in self.hosts:
+            result = self.results.get(host, {})
+            if self.states[host] == "done":
+                line = f"✅ {host}: {result.get('transferred', 0)} sent"
+                if result.get('skipped') or result.get('unchanged'):
+                    line += f", {result.get('skipped', 0) + result.get('unchanged', 0)} skipped or unchanged"
+            elif self.states[host] == "cancelled":
+                line = f"⏹️ {host}: cancelled"
+            else:
+                line = f"❌ {host}: {result.get('error', 'failed')}"
+            lines.append(line)
+        return lines
+
+
+class RelayTransfer(FleetTransfer):
+    """Upload once to the first host of a group and let the Pis forward the files to the rest
+
+    The first host runs raspfilesend_relay.py, which is copied there for the transfer. Sync and
+    mirror apply to the first host only; the others receive the selection as it is there.
+    Speed limits apply to the upload to the first host, not to the copies between the Pis.
+    """
+
+    def __init__(self, config, hosts, files, target_dir, log=None, password=None, overwrite=False,
+                 sync=False, mirror=False, rate_limit=None, low_priority=None, fanout=DEFAULT_RELAY_FANOUT):
+        super().__init__(config, hosts, files, target_dir, log, password, overwrite, sync, mirror,
+                         rate_limit, low_priority)
+        self.fanout = fanout
+        self._channel = None
+        self._relayed = {}  # host -> bytes reported so far
+
+    def needs_password(self):
+        # The Pis log in to each other with keys; only the first host is reached from here
+        config = host_config(self.config, self.hosts[0])
+        return config.get('SSH', 'auth_method', fallback='password') == "password" and not get_saved_password(config)
+
+    def cancel(self):
+        super().cancel()
+        channel = self._channel
+        if channel is not None:
+            # The helper stops itself and the Pis below it when its input closes
+            channel.shutdown_write()
+
+    def run(self):
+        seed = self.hosts[0]
+        self.log(f"🌳 Uploading to {seed}, which relays to {len(self.hosts) - 1} more Pis, "
+                 f"{self.fanout} at a time per Pi")
+        self._run_host(seed, None, None)
+
+        if self.states[seed] != "done":
+            for host in self.hosts[1:]:
+                self._finish_relayed(host, "failed" if not self.cancelled.is_set() else "cancelled",
+                                     f"not reached, {seed} did not receive the files")
+        return self.results
+
+    def _after_upload(self, host, backend):
+        """Start the relay helper on the first host and follow its events until the tree is done"""
+        log = lambda message: self.log(f"[{host}] {message}")
+        self.states[host] = "relaying"
+        try:
+            helper = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raspfilesend_relay.py")
+            remote_dir = posixpath.dirname(RELAY_HELPER_PATH)
+            backend.mkdir_many([remote_dir])
+            with open(helper, 'rb') as source:
+                backend.put_stream(source, RELAY_HELPER_PATH, os.path.getsize(helper))
+
+            plan = {
+                'target_dir': self.target_dir,
+                'names': sorted(name for _, name in top_level_names(self.files)),
+                'skip_existing': not self.overwrite,
+                'children': build_relay_tree(self.config, self.hosts, self.fanout),
+            }
+            # The helper talks back while it runs, so this needs a channel of the backend's client
+            channel = backend.client.get_transport().open_session()
+            channel.exec_command(f"python3 {shlex.quote(RELAY_HELPER_PATH)}")
+            channel.sendall((json.dumps(plan) + "\n").encode('utf-8'))
+            self._channel = channel
+            if self.cancelled.is_set():
+                channel.shutdown_write()
+            log("🌳 Relaying to the other Pis")
+            for line in channel.makefile('r'):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self._relay_event(event)
+            error = channel.makefile_stderr('r').read().strip()
+            channel.recv_exit_status()
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._channel = None
+
+        # Hosts the helper never reported on (it could not start, or the connection dropped)
+        reason = error.splitlines()[-1] if error else "relay stopped"
+        for relayed in self.hosts[1:]:
+            if relayed not in self.results:
+                self._finish_relayed(relayed, "cancelled" if self.cancelled.is_set() else "failed", reason)
+
+    def _relay_event(self, event):
+        host = event.get('host')
+        if host not in self.progress:
+            return
+        kind = event.get('event')
+        progress = self.progress[host]
+        if kind == 'start':
+            self.states[host] = "sending"
+            progress.add_total(event['total'])
+            progress.start_file("relay", event['total'])
+            self._relayed[host] = 0
+            self.results[host] = {'transferred': event['files']}
+        elif kind == 'progress':
+            progress.advance("relay", event['done'] - self._relayed.get(host, 0))
+            self._relayed[host] = event['done']
+        elif kind == 'done':
+            progress.finish_file("relay")
+            self.states[host] = "done"
+            self.log(f"[{host}] ✅ Received from the relay")
+        elif kind == 'failed':
+            self._finish_relayed(host, "failed", event.get('error', "failed"))
+
+    def _finish_relayed(self, host, state, error):
+        self.progress[host].finish_file("relay")
+        self.states[host] = state
+        self.results[host] = {'error': error if state == "failed" else "cancelled"}
+        if state == "failed":
+            self.log(f"[{host}] ❌ ERROR: {error}")
@@ -0,0 +1,231 @@
+"""
+Transfer history for RaspFileSend
+Keeps every transfer and connection test in a local SQLite database (host, target, files, bytes,
+time per phase, throughput and errors), for the trends view of the configuration tool and the
+first ETA guess of the next transfer to the same Pi
+"""
+
+import atexit
+import queue
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+HISTORY_FILE = Path.home() / ".raspfilesend_history.sqlite3"
+
+# Transfers this small say more about round trips than about the link; the ETA guess skips them
+MIN_ESTIMATE_BYTES = 1024 * 1024
+ESTIMATE_SESSIONS = 10
+
+# Sessions compared for the trend in the history view: the latest ones against the ones before
+TREND_SESSIONS = 5
+
+# Per-file errors kept for one session
+MAX_ERRORS = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    kind TEXT NOT NULL,
+    host TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    target_dir TEXT NOT NULL DEFAULT '',
+    files INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL,
+    upload_seconds REAL NOT NULL DEFAULT 0,
+    throughput REAL,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_by_host ON sessions (host, started);
+CREATE TABLE IF NOT EXISTS phases (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS errors (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    phase TEXT NOT NULL,
+    file TEXT,
+    error TEXT NOT NULL
+);
+"""
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_history_file(config):
+    """Return the database path from the [HISTORY] section, or None when history is turned off"""
+    if config.get('HISTORY', 'enabled', fallback='true').lower() != 'true':
+        return None
+    return Path(config.get('HISTORY', 'file', fallback='') or HISTORY_FILE).expanduser()
+
+
+def open_database(path):
+    db = sqlite3.connect(str(path), timeout=10)
+    db.executescript(SCHEMA)
+    return db
+
+
+def session_record(tracer, duration, fields):
+    """Turn a finished Tracer (see raspfilesend_trace) into a row for the sessions table"""
+    upload = tracer.phases.get('upload', {})
+    nbytes = upload.get('bytes', 0)
+    upload_seconds = upload.get('seconds', 0.0)
+    errors = tracer.errors[:MAX_ERRORS]
+    return {
+        'started': tracer.started_at,
+        'kind': tracer.kind,
+        'host': fields.get('host') or '',
+        'name': fields.get('name') or '',
+        'target_dir': fields.get('target_dir') or '',
+        'files': upload.get('files', 0),
+        'bytes': nbytes,
+        'seconds': duration,
+        'upload_seconds': upload_seconds,
+        # Only uploads that moved real data say anything about the link
+        'throughput': nbytes / upload_seconds if nbytes and upload_seconds > 0 else None,
+        'failed': upload.get('failed', 0),
+        'error': errors[0][2] if errors else None,
+        'phases': [(name, phase['count'], phase['seconds'], phase['bytes']) for name, phase in tracer.phases.items()],
+        'errors': errors,
+    }
+
+
+def _insert(db, session):
+    cursor = db.execute(
+        "INSERT INTO sessions (started, kind, host, name, target_dir, files, bytes, seconds, upload_seconds, "
+        "throughput, failed, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (session['started'], session['kind'], session['host'], session['name'], session['target_dir'],
+         session['files'], session['bytes'], session['seconds'], session['upload_seconds'],
+         session['throughput'], session['failed'], session['error']))
+    session_id = cursor.lastrowid
+    db.executemany("INSERT INTO phases (session_id, name, count, seconds, bytes) VALUES (?, ?, ?, ?, ?)",
+                   [(session_id,) + phase for phase in session['phases']])
+    db.executemany("INSERT INTO errors (session_id, phase, file, error) VALUES (?, ?, ?, ?)",
+                   [(session_id,) + error for error in session['errors']])
+
+
+class HistoryWriter:
+    """Writes finished sessions to the database from a background thread
+
+    Sessions that finish close together (a group transfer has one per Pi) go into one
+    transaction. add() never blocks, so a slow disk cannot hold up the transfer that reports.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, session):
+        self._queue.put(session)
+
+    def close(self, timeout=5):
+        """Write what is queued and stop (called when the process exits)"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        db = None
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = any(session is None for session in batch)
+            sessions = [session for session in batch if session is not None]
+            if not sessions:
+                continue
+            try:
+                if db is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    db = open_database(self.path)
+                with db:
+                    for session in sessions:
+                        _insert(db, session)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Could not write transfer history {self.path}: {e}", file=sys.stderr)
+        if db is not None:
+            db.close()
+
+
+def record_session(path, tracer, duration, fields):
+    """Queue one finished session for writing; the writer for path is started on first use"""
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = HistoryWriter(path)
+            atexit.register(writer.close)
+    writer.add(session_record(tracer, duration, fields))
+
+
+def _query(config, sql, parameters=()):
+    """Run a read-only query; an empty list when there is no history (yet) or it cannot be read"""
+    path = get_history_file(config)
+    if path is None or not path.exists():
+        return []
+    try:
+        db = open_database(path)
+        try:
+            db.row_factory = sqlite3.Row
+            return [dict(row) for row in db.execute(sql, parameters)]
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return []
+
+
+def expected_rate(config, host):
+    """Median throughput (bytes/s) of the last transfers to host, or None without enough history
+
+    The progress tracker starts its ETA from this until the new transfer has measured its own speed.
+    """
+    rows = _query(config, "SELECT throughput FROM sessions WHERE host = ? AND kind = 'transfer' AND bytes >= ? "
+                          "AND throughput IS NOT NULL ORDER BY started DESC LIMIT ?",
+                  (host, MIN_ESTIMATE_BYTES, ESTIMATE_SESSIONS))
+    if not rows:
+        return None
+    return statistics.median(row['throughput'] for row in rows)
+
+
+def host_sessions(config, host, limit=50):
+    """The newest transfers to host: [{'started', 'target_dir', 'files', 'bytes', 'seconds', 'throughput', ...}]"""
+    return _query(config, "SELECT * FROM sessions WHERE host = ? AND kind = 'transfer' ORDER BY started DESC LIMIT ?",
+                  (host, limit))
+
+
+def host_summaries(config):
+    """Per host: [{'host', 'name', 'sessions', 'last', 'bytes', 'recent_rate', 'earlier_rate'}], newest first
+
+    recent_rate is the median throughput of the last TREND_SESSIONS transfers that moved at least
+    MIN_ESTIMATE_BYTES, earlier_rate that of the ones before them (None if there are none).
+    """
+    summaries = _query(config, "SELECT host, MAX(name) AS name, COUNT(*) AS sessions, MAX(started) AS last, "
+                               "SUM(bytes) AS bytes FROM sessions WHERE kind = 'transfer' "
+                               "GROUP BY host ORDER BY last DESC")
+    for summary in summaries:
+        rates = [row['throughput'] for row in _query(
+            config, "SELECT throughput FROM sessions WHERE host = ? AND kind = 'transfer' AND bytes >= ? "
+                    "AND throughput IS NOT NULL ORDER BY started DESC LIMIT ?",
+            (summary['host'], MIN_ESTIMATE_BYTES, TREND_SESSIONS * 2))]
+        recent, earlier = rates[:TREND_SESSIONS], rates[TREND_SESSIONS:]
+        summary['recent_rate'] = statistics.median(recent) if recent else None
+        summary['earlier_rate'] = statistics.median(earlier) if earlier else None
+    return summaries
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
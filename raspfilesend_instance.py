@@ -0,0 +1,101 @@
+"""
+Single-instance coordination for RaspFileSend
+A second Send To launch hands its files to the transfer window that is already open
+"""
+
+import os
+import threading
+import time
+
+from raspfilesend_ipc import acquire_lock, connect, listen
+
+INSTANCE_ENDPOINT = "transfer"
+
+# How long a later launch keeps trying to reach a window that is still starting up
+FORWARD_TIMEOUT = 10
+
+
+class InstanceServer:
+    """Hold the single-instance lock and accept file lists from later launches"""
+
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+        self._listener = None
+        self._handler = None
+        self._closed = False
+        self._mutex = threading.Lock()
+
+    def start(self, handler):
+        """Start delivering forwarded files to handler(files)
+
+        Called once the window is on screen; later launches keep retrying until then.
+        """
+        self._handler = handler
+        try:
+            self._listener = listen(INSTANCE_ENDPOINT)
+        except OSError:
+            return  # Later launches fall back to their own window
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        """Stop accepting files and give up the instance lock"""
+        with self._mutex:
+            self._closed = True
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+        self._lock_file.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                if self._closed:
+                    return
+                continue  # A client that failed authentication or hung up early
+            try:
+                message = conn.recv()
+                if message.get('cmd') == 'add_files' and self._accept(message.get('files') or []):
+                    conn.send({'ok': True})
+            except Exception:
+                pass
+            finally:
+                conn.close()
+
+    def _accept(self, files):
+        with self._mutex:
+            if self._closed:
+                return False  # Let the sender start its own window
+        self._handler(files)
+        return True
+
+
+def claim_instance():
+    """Become the primary transfer window; returns an InstanceServer, or None if one is running"""
+    lock_file = acquire_lock(INSTANCE_ENDPOINT)
+    if lock_file is None:
+        return None
+    return InstanceServer(lock_file)
+
+
+def forward_files(files, timeout=FORWARD_TIMEOUT):
+    """Send files to the running window; returns False if it could not be reached in time"""
+    message = {'cmd': 'add_files', 'files': [os.path.abspath(f) for f in files]}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = connect(INSTANCE_ENDPOINT)
+        if conn is not None:
+            try:
+                conn.send(message)
+                if conn.recv().get('ok'):
+                    return True
+            except (OSError, EOFError):
+                pass
+            finally:
+                conn.close()
+        # The primary may still be starting up, or may have just closed
+        time.sleep(0.2)
+    return False
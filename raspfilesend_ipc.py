@@ -0,0 +1,93 @@
+"""
+Local inter-process communication for RaspFileSend
+Named pipes on Windows and Unix sockets elsewhere, authenticated with a per-user key
+"""
+
+import getpass
+import os
+import secrets
+import sys
+import tempfile
+from pathlib import Path
+
+# multiprocessing.connection is imported inside listen() and connect(): it is slow to load
+# and the transfer window should be on screen before it is needed
+
+AUTHKEY_FILE = Path.home() / ".raspfilesend_ipc.key"
+
+
+def _user_tag():
+    try:
+        return "".join(c for c in getpass.getuser() if c.isalnum()) or "user"
+    except Exception:
+        return "user"
+
+
+def ipc_address(name):
+    """Return (address, family) for a named per-user endpoint"""
+    if sys.platform == "win32":
+        return rf"\\.\pipe\raspfilesend-{_user_tag()}-{name}", "AF_PIPE"
+    return os.path.join(tempfile.gettempdir(), f"raspfilesend-{_user_tag()}-{name}.sock"), "AF_UNIX"
+
+
+def ipc_authkey():
+    """Read the per-user shared secret, creating it on first use"""
+    try:
+        return bytes.fromhex(AUTHKEY_FILE.read_text().strip())
+    except (OSError, ValueError):
+        key = secrets.token_bytes(32)
+        AUTHKEY_FILE.write_text(key.hex())
+        try:
+            os.chmod(AUTHKEY_FILE, 0o600)
+        except OSError:
+            pass
+        return key
+
+
+def acquire_lock(name):
+    """Take a per-user exclusive lock without waiting
+
+    Returns the open lock file (keep it open to hold the lock), or None when another
+    process holds it. The operating system releases the lock when the process exits.
+    """
+    path = os.path.join(tempfile.gettempdir(), f"raspfilesend-{_user_tag()}-{name}.lock")
+    lock_file = open(path, 'a+')
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def listen(name):
+    """Create a listener for the named endpoint (raises OSError if it cannot be bound)"""
+    from multiprocessing.connection import Client, Listener
+
+    address, family = ipc_address(name)
+    if family == "AF_UNIX" and os.path.exists(address):
+        # A stale socket file from a crashed process would make bind() fail
+        try:
+            Client(address, family=family, authkey=ipc_authkey()).close()
+            raise OSError(f"{name} endpoint is already in use")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(address)
+    return Listener(address, family=family, authkey=ipc_authkey())
+
+
+def connect(name):
+    """Connect to a named endpoint; returns None when nobody is listening"""
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Client
+
+    address, family = ipc_address(name)
+    try:
+        return Client(address, family=family, authkey=ipc_authkey())
+    except (OSError, EOFError, AuthenticationError):
+        return None
@@ -0,0 +1,401 @@
+"""
+OpenSSH backend for RaspFileSend
+Runs the system ssh client (part of Windows 10/11, macOS and Linux) as subprocesses instead of
+paramiko's pure-Python transport, so encryption happens in native code. OpenSSHClient offers the
+part of paramiko's SSHClient that the transfer engine uses, so uploads keep the same progress,
+overwrite, resume and tar behaviour. Where the platform has Unix sockets, every command and SFTP
+channel is multiplexed over one ControlMaster connection; elsewhere each one logs in by itself.
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from raspfilesend_common import connection_id
+
+# Environment variable the askpass helper reads the password from
+PASSWORD_ENV = "RASPFILESEND_SSH_PASSWORD"
+
+SERVER_ALIVE_INTERVAL = 15
+
+# Windows' OpenSSH has no ControlMaster support
+MULTIPLEX = sys.platform != "win32"
+
+# Subprocesses of a windowed (pythonw) program would each flash a console window
+CREATION_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+READ_SIZE = 256 * 1024
+
+
+class OpenSSHError(Exception):
+    """The ssh binary could not log in or start a command"""
+
+
+def find_ssh(config=None):
+    """Path of the ssh binary: [SSH] ssh_path, then PATH, then Windows' OpenSSH folder; None if missing"""
+    configured = config.get('SSH', 'ssh_path', fallback='').strip() if config is not None else ''
+    if configured:
+        return shutil.which(configured)
+    found = shutil.which("ssh")
+    if found or sys.platform != "win32":
+        return found
+    root = os.environ.get("SystemRoot", r"C:\Windows")
+    # 32-bit Python sees System32 redirected to SysWOW64, which has no OpenSSH
+    for folder in ("Sysnative", "System32"):
+        candidate = os.path.join(root, folder, "OpenSSH", "ssh.exe")
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def connect_openssh(config, ssh_path, password=None, timeout=15, tracer=None):
+    """Log in with the [SSH] settings through the ssh binary and return an OpenSSHClient
+
+    The saved cipher order is not used: it was measured for paramiko's implementations.
+    """
+    ip, port, username = connection_id(config)
+    auth_method = config.get('SSH', 'auth_method', fallback='password')
+    key_path = config.get('SSH', 'key_path', fallback='') if auth_method != "password" else ''
+    client = OpenSSHClient(ssh_path, ip, port, username, key_path=key_path,
+                           password=password if auth_method == "password" else None, timeout=timeout)
+    with tracer.span("connect", backend="openssh") if tracer is not None else contextlib.nullcontext():
+        client.connect()
+    return client
+
+
+def _askpass_script(directory):
+    """Write the program ssh runs to get the password; it prints PASSWORD_ENV, so the password is
+    never on a command line or on disk"""
+    if sys.platform == "win32":
+        python = sys.executable
+        console_python = os.path.join(os.path.dirname(python), "python.exe")
+        if os.path.basename(python).lower() == "pythonw.exe" and os.path.exists(console_python):
+            python = console_python
+        path = os.path.join(directory, "askpass.cmd")
+        content = f'@"{python}" -c "import os; print(os.environ[\'{PASSWORD_ENV}\'])"\r\n'
+    else:
+        path = os.path.join(directory, "askpass.sh")
+        content = f'#!/bin/sh\nprintf \'%s\\n\' "${PASSWORD_ENV}"\n'
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o700)
+    return path
+
+
+def _last_line(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+class OpenSSHClient:
+    """paramiko.SSHClient look-alike over the ssh binary
+
+    exec_command, open_sftp (paramiko's SFTP client speaking through `ssh -s sftp`) and
+    get_transport().open_session() channels each run one ssh process.
+    """
+
+    backend = "openssh"
+
+    def __init__(self, ssh_path, host, port, username, key_path='', password=None, timeout=15):
+        self.ssh_path = ssh_path
+        self.host = host
+        self.port = port
+        self.username = username
+        self.timeout = timeout
+        # Private folder (mode 700) for the control socket and the askpass helper
+        self._dir = tempfile.mkdtemp(prefix="raspfilesend-ssh-")
+        self.control_path = os.path.join(self._dir, "master") if MULTIPLEX else None
+        self._master = None
+        self._master_errors = []
+        self._connected = False
+        self._closed = False
+        self._transport = OpenSSHTransport(self)
+
+        self._env = dict(os.environ)
+        self._options = ["-p", str(port), "-l", username,
+                         "-o", f"ConnectTimeout={int(timeout)}",
+                         # Same trust-on-first-use as paramiko's AutoAddPolicy, in ~/.ssh/known_hosts
+                         "-o", "StrictHostKeyChecking=accept-new",
+                         "-o", f"ServerAliveInterval={SERVER_ALIVE_INTERVAL}", "-o", "ServerAliveCountMax=3"]
+        if key_path:
+            self._options += ["-i", key_path]
+        if password:
+            self._env.update({'SSH_ASKPASS': _askpass_script(self._dir), 'SSH_ASKPASS_REQUIRE': "force",
+                              PASSWORD_ENV: password})
+            self._options += ["-o", "NumberOfPasswordPrompts=1"]
+        else:
+            # Never stop to prompt for anything
+            self._options += ["-o", "BatchMode=yes"]
+
+    def connect(self):
+        """Log in once: start the master connection, or check the login when there is none"""
+        try:
+            if MULTIPLEX:
+                self._start_master()
+            else:
+                completed = subprocess.run(self._command(["exit 0"]), stdin=subprocess.DEVNULL,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=self._env,
+                                           timeout=self.timeout * 2, creationflags=CREATION_FLAGS)
+                if completed.returncode != 0:
+                    raise self._login_error(completed.stderr.decode(errors='replace'))
+        except subprocess.TimeoutExpired:
+            self.close()
+            raise OpenSSHError(f"Connection timeout - no answer from {self.host}:{self.port}")
+        except BaseException:
+            self.close()
+            raise
+        self._connected = True
+
+    def _start_master(self):
+        command = [self.ssh_path] + self._options + ["-M", "-S", self.control_path, "-o", "ControlPersist=no",
+                                                     "-N", "-e", "none", self.host]
+        self._master = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE, env=self._env, creationflags=CREATION_FLAGS)
+        collector = threading.Thread(target=self._collect_master_errors, daemon=True)
+        collector.start()
+        # The control socket appears once the login succeeded
+        deadline = time.monotonic() + self.timeout * 2
+        while not os.path.exists(self.control_path):
+            if self._master.poll() is not None:
+                collector.join(1)
+                raise self._login_error("".join(self._master_errors))
+            if time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(command, self.timeout * 2)
+            time.sleep(0.01)
+
+    def _collect_master_errors(self):
+        for line in iter(self._master.stderr.readline, b''):
+            self._master_errors.append(line.decode(errors='replace'))
+            del self._master_errors[:-20]
+
+    def _login_error(self, stderr):
+        message = _last_line(stderr) or "ssh exited without logging in"
+        if "Permission denied" in message:
+            return OpenSSHError(f"Authentication failed ({message})")
+        return OpenSSHError(message)
+
+    def _command(self, remote_args, subsystem=False):
+        """Full ssh command line for one remote command (or subsystem), through the master if there is one"""
+        command = [self.ssh_path] + self._options + ["-T", "-e", "none"]
+        if self.control_path:
+            command += ["-S", self.control_path, "-o", "ControlMaster=no"]
+        if subsystem:
+            command.append("-s")
+        return command + [self.host] + remote_args
+
+    def _spawn(self, remote_args, subsystem=False):
+        if self._closed:
+            raise OpenSSHError("connection is closed")
+        return subprocess.Popen(self._command(remote_args, subsystem), stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+                                env=self._env, creationflags=CREATION_FLAGS)
+
+    def is_active(self):
+        if self._closed or not self._connected:
+            return False
+        return self._master is None or self._master.poll() is None
+
+    def get_transport(self):
+        return self._transport
+
+    def exec_command(self, command):
+        """Run command on the Pi; returns (stdin, stdout, stderr) like paramiko, with stdout.channel"""
+        channel = self._transport.open_session()
+        channel.exec_command(command)
+        stdout = channel.makefile('rb')
+        stdout.channel = channel
+        return channel.makefile_stdin('wb'), stdout, channel.makefile_stderr('rb')
+
+    def open_sftp(self):
+        """paramiko SFTPClient over `ssh -s sftp`; the encryption is done by the ssh process"""
+        import paramiko
+
+        channel = self._transport.open_session()
+        channel.invoke_subsystem("sftp")
+        return paramiko.SFTPClient(channel)
+
+    def close(self):
+        self._closed = True
+        if self._master is not None and self._master.poll() is None:
+            # Ends the connection; commands still running on it see their channels close
+            self._master.terminate()
+            try:
+                self._master.wait(5)
+            except subprocess.TimeoutExpired:
+                self._master.kill()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+class OpenSSHTransport:
+    """The paramiko Transport methods the rest of RaspFileSend calls, for an OpenSSHClient"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def open_session(self, timeout=None):
+        return ProcessChannel(self.client)
+
+    def is_active(self):
+        return self.client.is_active()
+
+    def getpeername(self):
+        return self.client.host, self.client.port
+
+    def set_keepalive(self, interval):
+        pass  # ServerAliveInterval is set when the connection is made
+
+    def global_request(self, kind, data=None, wait=True):
+        """One round trip to the Pi (low priority mode's RTT probe), as a `true` through the master
+
+        The constant cost of starting ssh is the same for every probe, so RTT changes still show.
+        """
+        if not MULTIPLEX:
+            raise OpenSSHError("round trips are only measured over a shared master connection")
+        channel = self.open_session()
+        try:
+            channel.exec_command("true")
+            channel.recv_exit_status()
+        finally:
+            channel.close()
+
+
+class ProcessChannel:
+    """paramiko Channel look-alike: one remote command or subsystem run by an ssh process
+
+    stderr is collected by a thread so a chatty command cannot block on a full pipe. A subsystem
+    (SFTP) also reads stdout ahead, which gives paramiko's SFTP client the recv_ready() it
+    needs for pipelined writes.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.process = None
+        self._stderr = bytearray()
+        self._stderr_done = threading.Event()
+        self._stdout = None  # bytearray read ahead, for subsystems
+        self._stdout_eof = False
+        self._stdout_ready = threading.Condition()
+
+    def exec_command(self, command):
+        self._start([command])
+
+    def invoke_subsystem(self, name):
+        self._start([name], subsystem=True)
+        self._stdout = bytearray()
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+
+    def _start(self, remote_args, subsystem=False):
+        self.process = self.client._spawn(remote_args, subsystem)
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_stderr(self):
+        try:
+            for data in iter(lambda: self.process.stderr.read(READ_SIZE), b''):
+                self._stderr += data
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._stderr_done.set()
+
+    def _read_stdout(self):
+        try:
+            for data in iter(lambda: self.process.stdout.read(READ_SIZE), b''):
+                with self._stdout_ready:
+                    self._stdout += data
+                    self._stdout_ready.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._stdout_ready:
+                self._stdout_eof = True
+                self._stdout_ready.notify_all()
+
+    # --- Socket side, as used by paramiko's SFTP client and the engine's stream writers ---
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            written = self.process.stdin.write(view)
+            view = view[written:]
+
+    def recv(self, nbytes):
+        with self._stdout_ready:
+            while not self._stdout and not self._stdout_eof:
+                self._stdout_ready.wait()
+            data = bytes(self._stdout[:nbytes])
+            del self._stdout[:nbytes]
+            return data
+
+    def recv_ready(self):
+        return bool(self._stdout)
+
+    def get_name(self):
+        return f"ssh pid {self.process.pid}" if self.process else "ssh"
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        """Wait for the remote command to finish; 255 means ssh itself failed"""
+        status = self.process.wait()
+        self._stderr_done.wait()
+        return status
+
+    def exit_status_ready(self):
+        return self.process.poll() is not None
+
+    def recv_stderr_ready(self):
+        return bool(self._stderr)
+
+    def recv_stderr(self, nbytes):
+        data = bytes(self._stderr[:nbytes])
+        del self._stderr[:nbytes]
+        return data
+
+    def makefile(self, mode='r'):
+        return self.process.stdout if 'b' in mode else io.TextIOWrapper(self.process.stdout, errors='replace')
+
+    def makefile_stdin(self, mode='wb'):
+        return self.process.stdin
+
+    def makefile_stderr(self, mode='r'):
+        return _StderrFile(self, binary='b' in mode)
+
+    def close(self):
+        """Stop the command (if it still runs) and release the process"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class _StderrFile:
+    """read() returns everything the command wrote to stderr, once it has closed stderr"""
+
+    def __init__(self, channel, binary):
+        self.channel = channel
+        self.binary = binary
+
+    def read(self, size=-1):
+        self.channel._stderr_done.wait()
+        data = bytes(self.channel._stderr)
+        self.channel._stderr.clear()
+        return data if self.binary else data.decode(errors='replace')
@@ -0,0 +1,228 @@
+"""
+SSH connection pool for RaspFileSend
+Keeps authenticated connections (backends, see raspfilesend_backend) open per (host, port, user)
+so a connection test, repeated transfers and retries in the same process (or in the transfer agent)
+share one handshake. Idle connections get keepalives, are closed after a while, and are checked
+before they are reused.
+"""
+
+import contextlib
+import threading
+import time
+
+from raspfilesend_backend import open_backend
+from raspfilesend_common import connection_id, get_backend, get_saved_password
+
+DEFAULT_KEEPALIVE = 15
+DEFAULT_IDLE_MINUTES = 5
+
+# A connection unused for longer than this is probed with a channel open before it is handed out;
+# the probe gives up after PROBE_TIMEOUT and the connection is replaced
+PROBE_AFTER = 10
+PROBE_TIMEOUT = 5
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool_options(config):
+    """Read (keepalive seconds, idle seconds) from the [POOL] section"""
+    try:
+        keepalive = int(config.get('POOL', 'keepalive_seconds', fallback=str(DEFAULT_KEEPALIVE)))
+    except ValueError:
+        keepalive = DEFAULT_KEEPALIVE
+    try:
+        idle_minutes = float(config.get('POOL', 'idle_minutes', fallback=str(DEFAULT_IDLE_MINUTES)))
+    except ValueError:
+        idle_minutes = DEFAULT_IDLE_MINUTES
+    return max(0, keepalive), max(0.0, idle_minutes * 60)
+
+
+def get_pool(config):
+    """The process-wide pool, created with the [POOL] settings on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            keepalive, idle_seconds = get_pool_options(config)
+            _pool = ConnectionPool(keepalive=keepalive, idle_seconds=idle_seconds)
+        return _pool
+
+
+def pool_key(config):
+    """Connections are shared only between identical [SSH] login settings"""
+    return connection_id(config) + (config.get('SSH', 'auth_method', fallback='password'),
+                                    config.get('SSH', 'key_path', fallback=''), get_backend(config))
+
+
+class PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.retired = False  # Replaced by a fresh connection; closed once its last user is done
+
+    def is_active(self):
+        return self.backend.is_active()
+
+
+class ConnectionPool:
+    """Thread-safe cache of connected backends
+
+    acquire() returns a connection and marks it in use; release() hands it back. Several threads
+    may use one connection at the same time, each on its own channels. Connections nobody uses
+    are closed after idle_seconds (0 keeps them until close_all).
+    """
+
+    def __init__(self, keepalive=DEFAULT_KEEPALIVE, idle_seconds=DEFAULT_IDLE_MINUTES * 60, connect=open_backend):
+        self.keepalive = keepalive
+        self.idle_seconds = idle_seconds
+        self._connect = connect
+        self._entries = {}       # pool_key -> PooledConnection
+        self._by_backend = {}    # id(backend) -> (key, PooledConnection), for release()
+        self._key_locks = {}     # One connect at a time per key
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def acquire(self, config, password=None, fresh=False, tracer=None):
+        """Return (backend, reused) for the [SSH] settings in config
+
+        A cached connection is reused unless fresh is set (a connection test must really log in);
+        one that died or does not answer a probe is replaced without the caller noticing.
+        password is only needed when a new connection has to be made; the saved one is used if
+        it is not given.
+        """
+        key = pool_key(config)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if not fresh:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is not None:
+                    with tracer.span("connect.reuse") if tracer is not None else contextlib.nullcontext({}) as span:
+                        alive = span['alive'] = self._check(entry)
+                    if alive:
+                        return self._hand_out(key, entry), True
+                    self._retire(key, entry)
+
+            if config.get('SSH', 'auth_method', fallback='password') == "password":
+                password = password or get_saved_password(config)
+            backend = self._connect(config, password, tracer=tracer)
+            if self.keepalive:
+                backend.set_keepalive(self.keepalive)
+            entry = PooledConnection(backend)
+            with self._lock:
+                old = self._entries.get(key)
+                self._entries[key] = entry
+            if old is not None:
+                self._retire(key, old)
+            self._start_reaper()
+            return self._hand_out(key, entry), False
+
+    def release(self, backend, broken=False):
+        """Give a connection back; broken=True (or a dead transport) closes it instead of keeping it"""
+        with self._lock:
+            key, entry = self._by_backend.get(id(backend), (None, None))
+            if entry is None:
+                return
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            if entry.users == 0:
+                del self._by_backend[id(backend)]
+            if broken or not entry.is_active():
+                entry.retired = True
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            close = entry.users == 0 and entry.retired
+        if close:
+            self._close(entry)
+
+    @contextlib.contextmanager
+    def connection(self, config, password=None, fresh=False, tracer=None):
+        """with pool.connection(config) as (backend, reused): ... released afterwards, even on errors"""
+        backend, reused = self.acquire(config, password, fresh=fresh, tracer=tracer)
+        try:
+            yield backend, reused
+        finally:
+            self.release(backend)
+
+    def exec(self, config, command, input=None, password=None):
+        """Run a command on the pooled connection; returns (status, stdout, stderr), see Backend.exec"""
+        with self.connection(config, password) as (backend, reused):
+            return backend.exec(command, input)
+
+    def is_connected(self, config):
+        """True if a live connection for these settings is cached (no password needed to use it)"""
+        with self._lock:
+            entry = self._entries.get(pool_key(config))
+        return entry is not None and entry.is_active()
+
+    def live_connections(self):
+        """(ip, port, username) of every live cached connection, most recently used first"""
+        with self._lock:
+            entries = sorted(self._entries.items(), key=lambda item: -item[1].last_used)
+        return [key[:3] for key, entry in entries if entry.is_active()]
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def _hand_out(self, key, entry):
+        with self._lock:
+            entry.users += 1
+            entry.last_used = time.monotonic()
+            self._by_backend[id(entry.backend)] = (key, entry)
+        return entry.backend
+
+    def _check(self, entry):
+        """Is a cached connection still usable? Probe it if it has been quiet for a while"""
+        if not entry.is_active():
+            return False
+        if entry.users or time.monotonic() - entry.last_used < PROBE_AFTER:
+            return True
+        # A Pi that was rebooted or dropped off the network leaves a socket that looks fine
+        try:
+            entry.backend.probe(PROBE_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    def _retire(self, key, entry):
+        """Take a connection out of the pool; close it now or when its last user releases it"""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            entry.retired = True
+            close = entry.users == 0
+        if close:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.backend.close()
+        except Exception:
+            pass
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None or not self.idle_seconds:
+                return
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        """Close connections that nobody used for idle_seconds, and dead ones"""
+        while True:
+            time.sleep(min(30, max(1, self.idle_seconds / 4)))
+            now = time.monotonic()
+            with self._lock:
+                expired = [(key, entry) for key, entry in self._entries.items()
+                           if entry.users == 0 and (now - entry.last_used > self.idle_seconds or not entry.is_active())]
+                for key, entry in expired:
+                    del self._entries[key]
+            for key, entry in expired:
+                self._close(entry)
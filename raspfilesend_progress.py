@@ -0,0 +1,228 @@
+"""
+Transfer progress for RaspFileSend
+Counts bytes as the upload threads send them and turns them into throughput and ETA figures
+that the window can poll a few times a second, however fast the link is
+"""
+
+import math
+import os
+import threading
+import time
+
+from raspfilesend_compression import format_rate
+from raspfilesend_walk import walk_files
+
+# Throughput and ETA are recomputed at most this often
+UPDATE_INTERVAL = 0.25
+
+# Time constant of the smoothed throughput: a change in speed shows fully after a few seconds
+SMOOTHING_SECONDS = 3.0
+
+
+def format_size(size):
+    """Format a byte count for progress lines"""
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:,.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+
+
+def format_duration(seconds):
+    """Format an ETA as m:ss or h:mm:ss; "--:--" when it is not known yet"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def describe_finished(snapshot):
+    """Status line once a transfer is over"""
+    line = f"{format_size(snapshot['sent'])} sent in {format_duration(snapshot['elapsed'])}"
+    if snapshot['sent'] and snapshot['elapsed'] > 0:
+        line += f" · {format_rate(snapshot['sent'] / snapshot['elapsed'])} average"
+    return line
+
+
+def describe(snapshot):
+    """Two status lines for a snapshot: the whole batch, then the files being sent"""
+    total = f"{format_size(snapshot['total'])}{'+' if snapshot['counting'] else ''}"
+    batch = f"{format_size(snapshot['done'])} of {total}"
+    if snapshot['rate']:
+        batch += f" · {format_rate(snapshot['rate'])} · ETA {format_duration(snapshot['eta'])}"
+    elif snapshot['eta'] is not None:
+        # Nothing measured yet; the guess comes from earlier transfers to this Pi
+        batch += f" · ETA ~{format_duration(snapshot['eta'])}"
+    files = []
+    for current in snapshot['files']:
+        percent = current['done'] * 100 // current['size'] if current['size'] else 100
+        files.append(f"{current['name']} {percent}% · ETA {format_duration(current['eta'])}")
+    return batch, "   ".join(files)
+
+
+def count_in_background(trackers, paths):
+    """Add the size of every file below paths to each tracker's total, walking the folders once
+
+    Runs on its own thread; a group transfer counts its selection once for every Pi this way.
+    """
+    for tracker in trackers:
+        tracker.begin_count()
+
+    def count():
+        try:
+            for local_path, _ in walk_files(paths):
+                try:
+                    size = os.path.getsize(local_path)
+                except OSError:
+                    continue  # Reported by the uploader
+                for tracker in trackers:
+                    tracker.add_total(size)
+        finally:
+            for tracker in trackers:
+                tracker.end_count()
+    threading.Thread(target=count, daemon=True).start()
+
+
+class ProgressTracker:
+    """Thread-safe byte counter for one transfer, with smoothed throughput and ETA
+
+    Upload threads call start_file / advance / finish_file and skip; the window polls
+    snapshot(), which only recomputes rates every UPDATE_INTERVAL. on_update(snapshot) is
+    called from the uploading thread at the same rate, for callers that push instead of poll.
+    initial_rate (bytes/s, usually raspfilesend_history.expected_rate) gives an ETA before
+    anything has been measured, and is blended out as the transfer's own speed comes in.
+    """
+
+    def __init__(self, on_update=None, interval=UPDATE_INTERVAL, smoothing=SMOOTHING_SECONDS, initial_rate=None):
+        self.on_update = on_update
+        self.interval = interval
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+        self.total = 0        # Bytes in the selection, growing while folders are counted
+        self.done = 0         # Bytes sent, skipped or already on the Pi
+        self.sent = 0         # Bytes actually sent; the only ones that count towards throughput
+        self._counting = 0    # Background counts still running
+        self._files = {}      # name -> {'size', 'done', 'sent', 'rate', 'sampled'}
+        self._started = None  # When the first file started
+
+        self._sampled_at = None
+        self._sampled_sent = 0
+        self.rate = 0.0       # Throughput over the last interval
+        self.smoothed = initial_rate or 0.0  # Exponentially weighted throughput, used for the ETA
+        self._snapshot = None
+
+    def count_in_background(self, paths):
+        """Add the size of every file below paths to the total without delaying the upload"""
+        count_in_background([self], paths)
+
+    def begin_count(self):
+        """Mark the total as still growing (shown with a +, no ETA) until the matching end_count()"""
+        with self._lock:
+            self._counting += 1
+
+    def end_count(self):
+        with self._lock:
+            self._counting -= 1
+
+    def add_total(self, size):
+        with self._lock:
+            self.total += size
+
+    def skip(self, size):
+        """Count bytes that need no sending (unchanged, skipped or failed files) as done"""
+        with self._lock:
+            self.done += size
+
+    def start_file(self, name, size):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            self._files[name] = {'size': size, 'done': 0, 'sent': 0, 'rate': 0.0, 'sampled': 0}
+
+    def advance(self, name, nbytes, sent=True):
+        """Add nbytes to a file; sent=False for bytes that were already on the Pi (a resumed upload)"""
+        with self._lock:
+            current = self._files.get(name)
+            if current is not None:
+                current['done'] += nbytes
+                if sent:
+                    current['sent'] += nbytes
+            self.done += nbytes
+            if sent:
+                self.sent += nbytes
+            due = self.on_update is not None and self._sample_due(time.monotonic())
+        if due:
+            self.on_update(self.snapshot())
+
+    def finish_file(self, name):
+        """Stop tracking a file; bytes it did not send (failure or cancel) no longer count as pending"""
+        with self._lock:
+            current = self._files.pop(name, None)
+            if current is not None and current['done'] < current['size']:
+                self.done += current['size'] - current['done']
+
+    def snapshot(self, force=False):
+        """Return the current figures as a plain dict (safe to pass between processes)
+
+        {'done', 'total', 'sent', 'elapsed', 'counting', 'rate', 'smoothed', 'eta',
+         'files': [{'name', 'done', 'size', 'eta'}]}
+        Between updates the previous snapshot is returned, unless force is set.
+        """
+        with self._lock:
+            now = time.monotonic()
+            due = self._sample_due(now)
+            if force or due:
+                if due:
+                    self._sample(now)
+                files = []
+                for name, current in self._files.items():
+                    remaining = current['size'] - current['done']
+                    files.append({'name': name, 'done': current['done'], 'size': current['size'],
+                                  'eta': remaining / current['rate'] if current['rate'] > 0 else None})
+                counting = self._counting > 0
+                remaining = max(self.total - self.done, 0)
+                self._snapshot = {
+                    'done': self.done,
+                    'total': max(self.total, self.done),
+                    'sent': self.sent,
+                    'elapsed': now - self._started if self._started is not None else 0.0,
+                    'counting': counting,
+                    'rate': self.rate,
+                    'smoothed': self.smoothed,
+                    # Unknown until the folders are counted and some bytes have gone through (or guessed)
+                    'eta': remaining / self.smoothed if self.smoothed > 0 and not counting else None,
+                    'files': files,
+                }
+            return self._snapshot
+
+    def _sample_due(self, now):
+        return self._sampled_at is None or now - self._sampled_at >= self.interval
+
+    def _sample(self, now):
+        """Update the instantaneous and smoothed throughput (lock held)"""
+        if self._sampled_at is None:
+            self._sampled_at = now
+            self._sampled_sent = self.sent
+            return
+        elapsed = now - self._sampled_at
+        if elapsed <= 0:
+            return
+        if not self.sent:
+            # Still connecting or walking: an initial_rate guess stays as it is until bytes flow
+            self._sampled_at = now
+            return
+        # Weight by elapsed time, so the smoothing does not depend on how often we are polled
+        weight = 1 - math.exp(-elapsed / self.smoothing)
+        self.rate = (self.sent - self._sampled_sent) / elapsed
+        self.smoothed = self.rate if not self.smoothed else self.smoothed + weight * (self.rate - self.smoothed)
+        for current in self._files.values():
+            file_rate = (current['sent'] - current['sampled']) / elapsed
+            current['rate'] = file_rate if not current['rate'] else current['rate'] + weight * (file_rate - current['rate'])
+            current['sampled'] = current['sent']
+        self._sampled_at = now
+        self._sampled_sent = self.sent
@@ -0,0 +1,227 @@
+"""
+Relay helper for RaspFileSend
+Runs on a Raspberry Pi with python3 during a relay transfer (see RelayTransfer in
+raspfilesend_fleet.py). It forwards the files this Pi has received to the Pis below it in the
+distribution tree, using the Pi's own ssh client, then copies itself to them and starts them on
+their part of the tree. Only the standard library is used, so nothing needs installing on the Pis.
+
+The plan is one JSON line on stdin:
+    {"target_dir", "names", "skip_existing", "children": [node, ...]}
+    node = {"host", "ip", "port", "username", "children": [node, ...]}
+One JSON event per line goes to stdout, for every Pi below this one:
+    {"event": "start", "host", "total", "files"}   {"event": "progress", "host", "done"}
+    {"event": "done", "host"}                      {"event": "failed", "host", "error"}
+Closing stdin stops the relay here and everywhere below.
+"""
+
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+
+# Where the helper is kept, relative to the home directory on every Pi
+HELPER_PATH = ".raspfilesend/relay.py"
+
+# Progress events per Pi at most this often
+PROGRESS_INTERVAL = 0.25
+
+# Pis reach each other with keys only; a password prompt would hang the relay
+SSH_OPTIONS = ["-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=accept-new", "-o", "ConnectTimeout=15"]
+
+_output_lock = threading.Lock()
+_processes = set()
+_processes_lock = threading.Lock()
+
+
+def emit(**event):
+    write_line(json.dumps(event))
+
+
+def write_line(line):
+    with _output_lock:
+        sys.stdout.write(line.rstrip("\n") + "\n")
+        sys.stdout.flush()
+
+
+def start_ssh(node, command, **kwargs):
+    """Run command on a child Pi; the process is killed if the relay is stopped"""
+    args = ["ssh"] + SSH_OPTIONS + ["-p", str(node['port']), "{}@{}".format(node['username'], node['ip']), command]
+    process = subprocess.Popen(args, **kwargs)
+    with _processes_lock:
+        _processes.add(process)
+    return process
+
+
+def finish_ssh(process, what):
+    """Wait for an ssh process and raise with its last error line if it failed"""
+    error = process.stderr.read().decode('utf-8', 'replace').strip() if process.stderr else ""
+    code = process.wait()
+    with _processes_lock:
+        _processes.discard(process)
+    if code:
+        raise RuntimeError(error.splitlines()[-1] if error else "{} exited with {}".format(what, code))
+
+
+def watch_stdin():
+    """Stop everything once the parent closes our stdin (cancelled, or its connection dropped)"""
+    while sys.stdin.buffer.read(65536):
+        pass
+    with _processes_lock:
+        for process in _processes:
+            process.kill()
+    os._exit(1)
+
+
+def subtree_hosts(node):
+    hosts = [node['host']]
+    for child in node['children']:
+        hosts.extend(subtree_hosts(child))
+    return hosts
+
+
+def list_entries(target_dir, names):
+    """Return [(path, arcname)] for the names and everything below them, folders before their contents"""
+    entries = []
+    for name in names:
+        path = os.path.join(target_dir, name)
+        entries.append((path, name))
+        if os.path.isdir(path) and not os.path.islink(path):
+            for folder, dirs, files in os.walk(path):
+                relative = os.path.relpath(folder, target_dir)
+                for entry in sorted(dirs) + sorted(files):
+                    entries.append((os.path.join(folder, entry), os.path.join(relative, entry)))
+    return entries
+
+
+class CountingFile:
+    """File wrapper that reports bytes read as progress of one child"""
+
+    def __init__(self, local_file, counter):
+        self.local_file = local_file
+        self.counter = counter
+
+    def read(self, size=-1):
+        data = self.local_file.read(size)
+        self.counter.add(len(data))
+        return data
+
+
+class Counter:
+    def __init__(self, host):
+        self.host = host
+        self.done = 0
+        self._reported = 0.0
+
+    def add(self, nbytes):
+        self.done += nbytes
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            emit(event='progress', host=self.host, done=self.done)
+
+
+def send_files(node, plan, entries, total, files):
+    """Stream the files to a child as one tar archive, extracted in place on the other side"""
+    target = shlex.quote(plan['target_dir'])
+    extract = "mkdir -p {0} && tar -C {0} -xf -".format(target)
+    if plan['skip_existing']:
+        extract += " --skip-old-files"
+    emit(event='start', host=node['host'], total=total, files=files)
+    process = start_ssh(node, extract, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    counter = Counter(node['host'])
+    try:
+        with tarfile.open(fileobj=process.stdin, mode='w|') as tar:
+            for path, arcname in entries:
+                info = tar.gettarinfo(path, arcname)
+                if info.isreg():
+                    with open(path, 'rb') as local_file:
+                        tar.addfile(info, CountingFile(local_file, counter))
+                else:
+                    tar.addfile(info)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass  # The error is on ssh's stderr
+    finally:
+        if not process.stdin.closed:
+            process.stdin.close()
+    finish_ssh(process, "tar")
+    emit(event='progress', host=node['host'], done=counter.done)
+
+
+def start_relay(node, plan):
+    """Copy this helper to a child and let it serve its own children, passing its events up"""
+    with open(os.path.abspath(__file__), 'rb') as helper:
+        source = helper.read()
+    install = "mkdir -p .raspfilesend && cat > {}".format(HELPER_PATH)
+    process = start_ssh(node, install, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdin.write(source)
+    process.stdin.close()
+    finish_ssh(process, "install")
+
+    child_plan = dict(plan, children=node['children'])
+    process = start_ssh(node, "python3 {}".format(HELPER_PATH),
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stdin stays open: closing it is how the child learns that we stopped
+    process.stdin.write((json.dumps(child_plan) + "\n").encode('utf-8'))
+    process.stdin.flush()
+    finished = set()
+    for line in process.stdout:
+        line = line.decode('utf-8', 'replace')
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get('event') in ('done', 'failed'):
+            finished.add(event.get('host'))
+        write_line(line)
+    process.stdin.close()
+    try:
+        finish_ssh(process, "relay")
+        error = "relay stopped"
+    except RuntimeError as e:
+        error = str(e)
+    for host in subtree_hosts(node)[1:]:
+        if host not in finished:
+            emit(event='failed', host=host, error="relay from {} stopped: {}".format(node['host'], error))
+
+
+def serve_child(node, plan, entries, total, files):
+    try:
+        send_files(node, plan, entries, total, files)
+    except Exception as e:
+        for host in subtree_hosts(node):
+            error = str(e) if host == node['host'] else "not reached, {} failed".format(node['host'])
+            emit(event='failed', host=host, error=error)
+        return
+    emit(event='done', host=node['host'])
+    if node['children']:
+        try:
+            start_relay(node, plan)
+        except Exception as e:
+            for host in subtree_hosts(node)[1:]:
+                emit(event='failed', host=host, error="relay from {} failed: {}".format(node['host'], e))
+
+
+def main():
+    plan = json.loads(sys.stdin.buffer.readline().decode('utf-8'))
+    threading.Thread(target=watch_stdin, daemon=True).start()
+
+    entries = list_entries(plan['target_dir'], plan['names'])
+    files = [path for path, _ in entries if os.path.isfile(path)]
+    total = sum(os.path.getsize(path) for path in files)
+
+    # Every child gets its own stream, so the time per tree level is what this Pi's uplink allows
+    threads = [threading.Thread(target=serve_child, args=(node, plan, entries, total, len(files)))
+               for node in plan['children']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Resumable upload checkpoints for RaspFileSend
+Remembers which chunks of a large upload reached the Pi so an interrupted transfer can continue
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import threading
+import time
+from pathlib import Path
+
+CHECKPOINT_FILE = Path.home() / ".raspfilesend_checkpoints.json"
+PART_SUFFIX = ".part"
+
+# Checkpoints older than this are dropped the next time the file is loaded
+MAX_CHECKPOINT_AGE = 30 * 24 * 3600
+
+# Confirmed chunks are written to disk at most this often (seconds); start, finish and flush write at once
+FLUSH_INTERVAL = 2.0
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def chunk_digest(data):
+    """Hash of one chunk as stored in the checkpoint"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CheckpointStore:
+    """Thread-safe JSON file of confirmed chunks per (host, remote path)"""
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+        self._saved = 0
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in entries.items()
+                if now - entry.get('updated', 0) < MAX_CHECKPOINT_AGE}
+
+    def _save(self):
+        # Write to a temporary file and swap it in so a crash never leaves half a checkpoint
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+        self._dirty = False
+        self._saved = time.monotonic()
+
+    @staticmethod
+    def key(host, remote_path):
+        return f"{host}:{remote_path}"
+
+    def lookup(self, host, remote_path, local_path, local_stat, chunk_size):
+        """Return {chunk index: digest} for a matching checkpoint, or an empty dict"""
+        with self._lock:
+            entry = self._entries.get(self.key(host, remote_path))
+        if (not entry
+                or entry.get('local_path') != os.path.abspath(local_path)
+                or entry.get('size') != local_stat.st_size
+                or entry.get('mtime') != int(local_stat.st_mtime)
+                or entry.get('chunk_size') != chunk_size):
+            return {}
+        return {int(index): digest for index, digest in entry.get('chunks', {}).items()}
+
+    def start(self, host, remote_path, local_path, local_stat, chunk_size, chunks=None):
+        """Begin (or restart) tracking an upload, keeping any chunks already verified"""
+        with self._lock:
+            self._entries[self.key(host, remote_path)] = {
+                'local_path': os.path.abspath(local_path),
+                'size': local_stat.st_size,
+                'mtime': int(local_stat.st_mtime),
+                'chunk_size': chunk_size,
+                'chunks': {str(index): digest for index, digest in (chunks or {}).items()},
+                'updated': time.time(),
+            }
+            self._save()
+
+    def confirm(self, host, remote_path, index, digest):
+        """Record one chunk as written and acknowledged by the Pi
+
+        The file is rewritten at most every FLUSH_INTERVAL seconds, so a crash can lose the last
+        few confirmations; those chunks are simply sent again.
+        """
+        with self._lock:
+            entry = self._entries.get(self.key(host, remote_path))
+            if entry is None:
+                return
+            entry['chunks'][str(index)] = digest
+            entry['updated'] = time.time()
+            self._dirty = True
+            if time.monotonic() - self._saved >= FLUSH_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """Write any confirmations not saved yet (when an upload fails or is cancelled)"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def finish(self, host, remote_path):
+        """Forget an upload once the final rename is done"""
+        with self._lock:
+            if self._entries.pop(self.key(host, remote_path), None) is not None:
+                self._save()
+
+
+def get_checkpoint_store():
+    """The process-wide CheckpointStore, loaded on first use
+
+    Every uploader (one per host in a group transfer) records into the same store, so their
+    saves never overwrite each other's entries.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+        return _store
+
+
+def verify_remote_chunks(ssh, part_path, chunks, chunk_size):
+    """Re-hash the already uploaded chunks on the Pi and return the ones that still match
+
+    All chunks are hashed by a single remote command, one `dd | sha256sum` per chunk.
+    """
+    if not chunks:
+        return {}
+    indexes = sorted(chunks)
+    script = (f"for i in {' '.join(str(i) for i in indexes)}; do "
+              f"dd if={shlex.quote(part_path)} bs={chunk_size} skip=$i count=1 2>/dev/null | sha256sum; done")
+    stdin, stdout, stderr = ssh.exec_command(script)
+    lines = stdout.read().decode(errors='replace').split("\n")
+    if stdout.channel.recv_exit_status() != 0:
+        return {}
+
+    verified = {}
+    for index, line in zip(indexes, lines):
+        digest = line.split(" ", 1)[0].strip()
+        if digest == chunks[index]:
+            verified[index] = digest
+    return verified
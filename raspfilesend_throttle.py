@@ -0,0 +1,204 @@
+"""
+Bandwidth limits for RaspFileSend
+Token buckets in the upload write path, so large transfers leave room for the rest of the
+network, and a low priority mode that slows down on its own when the Pi's round-trip time rises
+"""
+
+import collections
+import threading
+import time
+
+# A bucket holds at most this much sending time, so an idle pause cannot turn into a long burst
+BURST_SECONDS = 0.25
+
+# Waiting writers re-check at least this often, so a rate changed from the window applies at once
+MAX_WAIT = 0.2
+
+# Low priority mode: how often the round-trip time is probed, how much queueing delay above the
+# quietest RTT seen is tolerated, and how the rate reacts
+PROBE_INTERVAL = 0.5
+RTT_WINDOW = 120          # Probes over which the quietest RTT is taken (a minute)
+TARGET_DELAY = 0.05
+BACKOFF_FACTOR = 0.7
+RECOVERY_FACTOR = 1.1
+MIN_RATE = 64 * 1024
+
+
+def _get_rate(config, section, option):
+    """Read a limit in MB/s and return bytes/s; 0 means unlimited"""
+    try:
+        rate = float(config.get(section, option, fallback='0'))
+    except ValueError:
+        return 0
+    return max(0, int(rate * 1024 * 1024))
+
+
+def get_rate_limits(config):
+    """Read (global bytes/s, per-host bytes/s, low priority) from the configuration
+
+    [TRANSFER] max_rate_mb limits all uploads together, [SSH] max_rate_mb (or the same option in a
+    fleet [HOST] section) each connection; low_priority = true turns on the RTT backoff.
+    """
+    low_priority = config.get('TRANSFER', 'low_priority', fallback='false').lower() == 'true'
+    return _get_rate(config, 'TRANSFER', 'max_rate_mb'), _get_rate(config, 'SSH', 'max_rate_mb'), low_priority
+
+
+class TokenBucket:
+    """Thread-safe token bucket in bytes; consume() blocks until the bytes may be sent
+
+    A rate of 0 means unlimited. A request larger than the bucket is let through at once and
+    paid back by the writers after it, so block size does not matter. set_rate() is safe to
+    call from any thread while uploads wait on the bucket.
+    """
+
+    def __init__(self, rate=0, burst_seconds=BURST_SECONDS):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.consumed = 0  # Bytes let through so far, for callers measuring the actual rate
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(0, rate)
+            # Debt from the old rate would otherwise stall writers after a big increase
+            self._tokens = max(self._tokens, 0.0)
+
+    def consume(self, nbytes):
+        while True:
+            wait = self.reserve(nbytes)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def reserve(self, nbytes):
+        """Let nbytes through and return 0, or return how long to wait before asking again
+
+        The non-blocking form of consume(), for callers on an event loop.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if not self.rate or self._tokens >= 0:
+                self._tokens -= nbytes if self.rate else 0
+                self.consumed += nbytes
+                return 0
+            return min(-self._tokens / self.rate, MAX_WAIT)
+
+    def _refill(self, now):
+        """Add tokens for the time since the last call (lock held)"""
+        if self.rate:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.burst_seconds)
+        self._updated = now
+
+
+class Throttle:
+    """All buckets that apply to one upload; consume(nbytes) waits for each of them"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def consume(self, nbytes):
+        for bucket in self.buckets:
+            bucket.consume(nbytes)
+
+
+class RttBackoff:
+    """Low priority mode: lower a bucket's rate while the RTT to the Pi is above its quiet level
+
+    The RTT is probed with SSH keepalive requests on the transfer's own connection. When uploads
+    fill the queues on the way to the Pi (and so delay everyone else's traffic too), the probe
+    replies come back late; the rate then drops by BACKOFF_FACTOR, and grows again by
+    RECOVERY_FACTOR while the RTT is back near normal, until the limit is no longer needed.
+    """
+
+    def __init__(self, transport, log=None, interval=PROBE_INTERVAL):
+        self.transport = transport
+        self.log = log or (lambda message: None)
+        self.interval = interval
+        self.bucket = TokenBucket()
+        self.rtt = None
+        self._rtts = collections.deque(maxlen=RTT_WINDOW)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def measure(self):
+        """One round trip to the Pi in seconds, or None if the connection did not answer"""
+        started = time.perf_counter()
+        try:
+            # OpenSSH answers this request (with a failure) right away, like its own keepalives
+            self.transport.global_request('keepalive@openssh.com', wait=True)
+        except Exception:
+            return None
+        if not self.transport.is_active():
+            return None
+        return time.perf_counter() - started
+
+    def _run(self):
+        consumed = self.bucket.consumed
+        measured = time.monotonic()
+        slowed = False
+        while not self._stop.wait(self.interval):
+            rtt = self.measure()
+            if rtt is None:
+                continue
+            self.rtt = rtt
+            self._rtts.append(rtt)
+            quiet = min(self._rtts)
+            now = time.monotonic()
+            sending = (self.bucket.consumed - consumed) / max(now - measured, 1e-6)
+            consumed, measured = self.bucket.consumed, now
+
+            if rtt > quiet + TARGET_DELAY and sending:
+                self.bucket.set_rate(max(MIN_RATE, int((self.bucket.rate or sending) * BACKOFF_FACTOR)))
+                if not slowed:
+                    slowed = True
+                    self.log(f"🐢 Network busy (round trip {rtt * 1000:.0f} ms, normally {quiet * 1000:.0f} ms), "
+                             f"slowing down")
+            elif self.bucket.rate:
+                if sending < self.bucket.rate / 2:
+                    # The limit is no longer what holds the upload back
+                    self.bucket.set_rate(0)
+                else:
+                    self.bucket.set_rate(int(self.bucket.rate * RECOVERY_FACTOR) + MIN_RATE)
+                if not self.bucket.rate and slowed:
+                    slowed = False
+                    self.log("🐇 Network quiet again, back to full speed")
+
+
+def create_throttle(config, ssh, rate_limit=None, low_priority=None, log=None):
+    """Build the Throttle for one connection, or (None, None) when nothing limits it
+
+    rate_limit is the caller's global TokenBucket (so a window can change it live); without one,
+    a bucket is made from [TRANSFER] max_rate_mb. low_priority None means the configured setting.
+    Returns (throttle, backoff); call backoff.stop() when the upload is over.
+    """
+    global_rate, host_rate, configured_low_priority = get_rate_limits(config)
+    buckets = []
+    if rate_limit is None and global_rate:
+        rate_limit = TokenBucket(global_rate)
+    if rate_limit is not None:
+        buckets.append(rate_limit)
+    if host_rate:
+        buckets.append(TokenBucket(host_rate))
+    backoff = None
+    if configured_low_priority if low_priority is None else low_priority:
+        backoff = RttBackoff(ssh.get_transport(), log)
+        # One probe up front: a backend that cannot measure round trips would fail every one
+        if backoff.measure() is None:
+            backoff = None
+            if log:
+                log("⚠️ Low priority unavailable with this backend, sending without it")
+        else:
+            buckets.append(backoff.start().bucket)
+    return (Throttle(buckets) if buckets else None), backoff
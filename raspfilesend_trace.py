@@ -0,0 +1,287 @@
+"""
+Phase timing for RaspFileSend
+Records how long each step of a connection test or transfer takes (name lookup, TCP connect, SSH
+handshake, authentication, mkdir, remote listings and stats, uploads) and how many bytes it moved,
+as JSON lines, and turns one session into a Chrome trace to look at as a timeline. The totals per
+step also go to the transfer history (see raspfilesend_history.py), which works without a trace file.
+
+Turn it on with [TRACE] enabled = true or the RASPFILESEND_TRACE environment variable (1, or the
+path of the trace file). Export a session with:
+    python raspfilesend_trace.py                      # last session -> Chrome trace file
+    python raspfilesend_trace.py --summary            # time per phase of the last session
+    python raspfilesend_trace.py --session ID trace.jsonl
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+TRACE_ENV = "RASPFILESEND_TRACE"
+DEFAULT_TRACE_FILE = Path.home() / ".raspfilesend_trace.jsonl"
+
+# Records are written in batches, so per-file spans do not cost a disk write each
+FLUSH_RECORDS = 500
+
+# Failed spans kept per session for the history
+MAX_ERRORS = 100
+
+_session_numbers = itertools.count(1)
+# Sessions in one process (a group transfer has one per Pi) share the file; lines must not mix
+_write_lock = threading.Lock()
+
+
+def get_trace_options(config):
+    """Return (trace file or None when tracing is off, write a Chrome trace per session)"""
+    env = os.environ.get(TRACE_ENV, '').strip()
+    chrome = config.get('TRACE', 'chrome', fallback='false').lower() == 'true'
+    if env and env.lower() not in ('0', 'false', 'no', 'off'):
+        if env.lower() in ('1', 'true', 'yes', 'on'):
+            return Path(config.get('TRACE', 'file', fallback='') or DEFAULT_TRACE_FILE).expanduser(), chrome
+        return Path(env).expanduser(), chrome
+    if config.get('TRACE', 'enabled', fallback='false').lower() == 'true':
+        return Path(config.get('TRACE', 'file', fallback='') or DEFAULT_TRACE_FILE).expanduser(), chrome
+    return None, chrome
+
+
+def start_trace(config, kind, **fields):
+    """Open a Tracer for one session ("transfer", "test_connection", ...)
+
+    fields describe the session (host, name, target_dir). Returns NULL_TRACER when neither the
+    trace file nor the transfer history is on.
+    """
+    from raspfilesend_history import get_history_file, record_session
+
+    path, chrome = get_trace_options(config)
+    history = get_history_file(config)
+    if path is None and history is None:
+        return NULL_TRACER
+    on_close = None
+    if history is not None:
+        on_close = lambda tracer, duration, fields: record_session(history, tracer, duration, fields)
+    return Tracer(path, kind, chrome=chrome, on_close=on_close, **fields)
+
+
+class Tracer:
+    """Collects timed spans for one session and appends them to the trace file
+
+    Every record is one JSON object with the session id, the span name, its wall-clock start,
+    its duration in seconds, the thread, and any fields given (bytes, file, host, error ...).
+    Spans may be recorded from any thread. Without a path nothing is written, and only the
+    totals per span name (phases) and the failed spans (errors) are kept for on_close.
+    """
+
+    def __init__(self, path, kind, chrome=False, on_close=None, **fields):
+        self.path = Path(path) if path is not None else None
+        self.enabled = self.path is not None
+        self.kind = kind
+        self.chrome = chrome and self.enabled
+        self.chrome_path = None
+        # on_close(tracer, duration, fields) once the session is over
+        self.on_close = on_close
+        self.session = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_session_numbers)}"
+        self.fields = fields
+        self.started_at = time.time()
+        # name -> {'count', 'seconds', 'bytes', 'files', 'failed'}, summed over the spans
+        self.phases = {}
+        # [(span name, file or None, error)] for the spans that failed
+        self.errors = []
+        self._started = time.perf_counter()
+        self._records = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        """Time the block; the yielded dict takes fields known only at the end (bytes=...)"""
+        started = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields['error'] = str(e) or type(e).__name__
+            raise
+        finally:
+            self.record(name, started, time.perf_counter() - started, **fields)
+
+    def record(self, name, started, duration, **fields):
+        """Add a span that was timed by the caller (started is a time.perf_counter() value)"""
+        with self._lock:
+            if fields.get('kind') != 'session':
+                phase = self.phases.setdefault(name, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'files': 0, 'failed': 0})
+                phase['count'] += 1
+                phase['seconds'] += duration
+                for key in ('bytes', 'files', 'failed'):
+                    phase[key] += fields.get(key) or 0
+            if 'error' in fields and len(self.errors) < MAX_ERRORS:
+                self.errors.append((name, fields.get('file'), fields['error']))
+            if not self.enabled:
+                return
+            record = {
+                'session': self.session,
+                'name': name,
+                'start': round(self.started_at + started - self._started, 6),
+                'duration': round(duration, 6),
+                'thread': threading.current_thread().name,
+            }
+            record.update(fields)
+            self._records.append(record)
+            if len(self._records) >= FLUSH_RECORDS:
+                self._flush()
+
+    def close(self, **fields):
+        """Record the whole session as one span and write everything out
+
+        Returns the trace file, or None when only the history is kept.
+        """
+        duration = time.perf_counter() - self._started
+        fields = dict(self.fields, **fields)
+        # The session's own name (a fleet host) is kept apart from the span name
+        span_fields = {('label' if key == 'name' else key): value for key, value in fields.items()}
+        self.record(self.kind, self._started, duration, kind='session', **span_fields)
+        if self.on_close:
+            self.on_close(self, duration, fields)
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._flush()
+        if self.chrome:
+            chrome_path = self.path.with_name(f"{self.path.stem}-{self.session}.json")
+            try:
+                self.chrome_path = export_chrome(self.path, self.session, chrome_path)
+            except OSError as e:
+                print(f"Could not write Chrome trace {chrome_path}: {e}", file=sys.stderr)
+        return self.path
+
+    def _flush(self):
+        """Append the buffered records (lock held); tracing never fails the transfer itself"""
+        if not self._records:
+            return
+        records, self._records = self._records, []
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with _write_lock, open(self.path, 'a', encoding='utf-8') as trace_file:
+                trace_file.writelines(json.dumps(record) + "\n" for record in records)
+        except OSError as e:
+            print(f"Could not write trace file {self.path}: {e}", file=sys.stderr)
+
+
+class NullTracer:
+    """Stand-in used while tracing is off, so call sites do not need to check"""
+
+    enabled = False
+    path = None
+    chrome_path = None
+
+    def span(self, name, **fields):
+        return contextlib.nullcontext({})
+
+    def record(self, name, started, duration, **fields):
+        pass
+
+    def close(self, **fields):
+        return None
+
+
+NULL_TRACER = NullTracer()
+
+
+def read_sessions(trace_path):
+    """Return {session id: [records]} from a trace file, in file order"""
+    sessions = {}
+    with open(trace_path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash
+            sessions.setdefault(record.get('session'), []).append(record)
+    return sessions
+
+
+def chrome_events(records):
+    """Convert one session's records to Chrome trace events (complete events, one row per thread)"""
+    if not records:
+        return []
+    origin = min(record['start'] for record in records)
+    threads = {}
+    events = []
+    for record in records:
+        tid = threads.setdefault(record['thread'], len(threads) + 1)
+        args = {key: value for key, value in record.items()
+                if key not in ('session', 'name', 'start', 'duration', 'thread')}
+        events.append({'name': record['name'], 'ph': 'X', 'pid': 1, 'tid': tid,
+                       'ts': round((record['start'] - origin) * 1e6), 'dur': round(record['duration'] * 1e6),
+                       'args': args})
+    for thread, tid in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+    return events
+
+
+def export_chrome(trace_path, session, output):
+    """Write one session of a trace file as a Chrome trace (chrome://tracing, ui.perfetto.dev)"""
+    records = read_sessions(trace_path).get(session, [])
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump({'traceEvents': chrome_events(records), 'displayTimeUnit': 'ms'}, output_file)
+    return output
+
+
+def summarize(records):
+    """Return [(name, count, total seconds, bytes)] per span name, slowest first"""
+    phases = {}
+    for record in records:
+        if record.get('kind') == 'session':
+            continue
+        count, total, nbytes = phases.get(record['name'], (0, 0.0, 0))
+        phases[record['name']] = (count + 1, total + record['duration'], nbytes + (record.get('bytes') or 0))
+    return sorted(((name,) + values for name, values in phases.items()), key=lambda phase: -phase[2])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or summarize a RaspFileSend timing trace")
+    parser.add_argument("trace", nargs="?", default=str(DEFAULT_TRACE_FILE), help="trace file (JSON lines)")
+    parser.add_argument("--session", help="session id (default: the last one in the file)")
+    parser.add_argument("--output", help="Chrome trace file (default: <trace>-<session>.json)")
+    parser.add_argument("--summary", action="store_true", help="print the time per phase instead")
+    parser.add_argument("--list", action="store_true", help="list the sessions in the file")
+    args = parser.parse_args(argv)
+
+    try:
+        sessions = read_sessions(args.trace)
+    except OSError as e:
+        print(f"❌ Cannot read {args.trace}: {e}")
+        return 1
+    if not sessions:
+        print(f"❌ No sessions in {args.trace}")
+        return 1
+
+    if args.list:
+        for session, records in sessions.items():
+            total = [record for record in records if record.get('kind') == 'session']
+            label = f"{total[0]['name']} {total[0]['duration']:.2f} s" if total else "(unfinished)"
+            print(f"{session}  {label}")
+        return 0
+
+    session = args.session or list(sessions)[-1]
+    if session not in sessions:
+        print(f"❌ Session {session} not found in {args.trace}")
+        return 1
+
+    if args.summary:
+        print(f"{'phase':<22}{'count':>8}{'total s':>10}{'MB':>10}")
+        for name, count, total, nbytes in summarize(sessions[session]):
+            print(f"{name:<22}{count:>8}{total:>10.3f}{nbytes / (1024 * 1024):>10.1f}")
+        return 0
+
+    trace_path = Path(args.trace)
+    output = args.output or trace_path.with_name(f"{trace_path.stem}-{session}.json")
+    export_chrome(trace_path, session, output)
+    print(f"📊 Chrome trace written to {output} (open it in chrome://tracing or https://ui.perfetto.dev)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,129 @@
 import sys
 import os
 import tkinter as tk
-from tkinter import messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog
 import configparser
 from pathlib import Path
+import queue
 import threading
-import subprocess
-import base64
-import hashlib
+import time
+
+# Only light modules at import time; the engine, agent client, paramiko and cryptography
+# are loaded after the window is on screen (see preload_in_background)
+from raspfilesend_common import (agent_enabled, connection_id, decrypt_password, get_backend, get_encryption_key,
+                                 get_groups, get_sync_options, preload_in_background)
+from raspfilesend_compression import format_rate
+from raspfilesend_instance import claim_instance, forward_files
+from raspfilesend_progress import ProgressTracker, describe, describe_finished, format_size
+from raspfilesend_throttle import TokenBucket, get_rate_limits
+
+# Worker threads queue their UI changes; the main loop applies them in batches this often
+UI_TICK_MS = 100
+# Events applied per tick at most, so a burst cannot freeze the window
+UI_TICK_EVENTS = 5000
+# The log keeps only the newest lines, so memory stays flat on very large batches
+MAX_LOG_LINES = 2000
+PROGRESS_STEPS = 1000
+
+# Choices offered in the speed limit box (MB/s); any other number can be typed in
+RATE_LIMIT_CHOICES = ("Unlimited", "0.5", "1", "2", "5", "10", "20", "50")
+
+# Conflict dialog: what each action is called in the list
+CONFLICT_ACTIONS = {'overwrite': "Overwrite", 'skip': "Skip", 'rename': "Keep both (rename)"}
 
 class RaspFileSendTransfer:
     def __init__(self, files):
-        self.files = files
+        self.files = list(files)
+        # Files from self.files[:self._handed_off] have been given to a transfer
+        self._handed_off = 0
+        self._active_uploader = None
+        # The running group transfer, which the Cancel button stops
+        self._active_fleet = None
+        self._files_lock = threading.Lock()
+        # Returns the latest progress snapshot while a transfer runs, otherwise None
+        self._progress_source = None
+        # ('log', message), ('status', text) or ('call', function) from any thread
+        self._ui_events = queue.Queue()
         self.config_file = Path.home() / ".raspfilesend_config.ini"
         self.config = configparser.ConfigParser()
         self.load_config()
+        # Limits everything this window sends; the speed box changes it while uploads run
+        global_rate, _, low_priority = get_rate_limits(self.config)
+        self.rate_limit = TokenBucket(global_rate)
+        self._low_priority = low_priority
         
         # Create GUI for target directory selection and transfer progress
         self.root = tk.Tk()
         self.root.title("Send Files to Raspberry Pi")
-        self.root.geometry("700x650")  # Even bigger
+        self.root.geometry("700x760")  # Even bigger
         self.root.resizable(True, True)
         self.root.minsize(650, 600)
         self.setup_ui()
         
+        # Let the transfer agent connect while the user is still looking at the window
+        self.use_agent = agent_enabled(self.config)
+        self.root.after_idle(self._after_window_shown)
+        self.root.after(UI_TICK_MS, self._drain_ui_events)
+        
+    def _after_window_shown(self):
+        """Load what the transfer needs once the window has been drawn"""
+        preload_in_background()
+        if self.use_agent:
+            threading.Thread(target=self._warm_agent, daemon=True).start()
+        
+    def _warm_agent(self):
+        """Start the background agent and let it connect with saved credentials"""
+        try:
+            from raspfilesend_agent import agent_request
+            agent_request({'cmd': 'warm'})
+        except Exception:
+            pass  # The transfer falls back to prompting and connecting on demand
+        
+    def add_files(self, files):
+        """Merge files forwarded by another Send To launch (called from any thread)"""
+        self.ui_call(lambda: self._merge_files(files))
+        
+    def _merge_files(self, files):
+        with self._files_lock:
+            known = set(self.files)
+            new_files = []
+            for file_path in files:
+                if file_path not in known:
+                    known.add(file_path)
+                    new_files.append(file_path)
+            if not new_files:
+                return
+            self.files.extend(new_files)
+            # A running upload takes them straight into its queue; otherwise the next round picks them up
+            uploader = self._active_uploader
+            if uploader is not None and uploader.add_files(self.files[self._handed_off:]):
+                self._handed_off = len(self.files)
+        
+        for file_path in new_files:
+            self.files_listbox.insert(tk.END, os.path.basename(file_path))
+        self.log_message(f"➕ Added {len(new_files)} file(s) from another Send To")
+        self.root.deiconify()
+        self.root.lift()
+        
+    def _attach_uploader(self, uploader):
+        with self._files_lock:
+            self._active_uploader = uploader
+        
+    def _next_batch(self):
+        """Take the files added since the last batch was handed out"""
+        with self._files_lock:
+            self._active_uploader = None
+            batch = self.files[self._handed_off:]
+            self._handed_off = len(self.files)
+            return batch
+        
     def _get_encryption_key(self):
         """Generate a machine-specific encryption key (same as config)"""
-        try:
-            # Use machine-specific information to generate key
-            import platform
-            machine_info = f"{platform.node()}-{platform.machine()}-{platform.processor()}"
-            key = hashlib.sha256(machine_info.encode()).digest()
-            return base64.urlsafe_b64encode(key)
-        except:
-            # Fallback key if platform info fails
-            fallback = "RaspFileSend-Default-Key-2024"
-            key = hashlib.sha256(fallback.encode()).digest()
-            return base64.urlsafe_b64encode(key)
+        return get_encryption_key()
     
     def _decrypt_password(self, encrypted_password):
         """Decrypt password using machine-specific key"""
-        if not encrypted_password:
-            return ""
-        
-        try:
-            from cryptography.fernet import Fernet
-            key = self._get_encryption_key()
-            fernet = Fernet(key)
-            encrypted_bytes = base64.b64decode(encrypted_password.encode())
-            decrypted = fernet.decrypt(encrypted_bytes)
-            return decrypted.decode()
-        except ImportError:
-            # Fallback from base64
-            try:
-                return base64.b64decode(encrypted_password.encode()).decode()
-            except:
-                return ""
-        except Exception:
-            # If decryption fails, return empty (password changed or corrupted)
-            return ""
+        return decrypt_password(encrypted_password)
     
     def load_config(self):
         if not self.config_file.exists():
@@ -137,12 +202,77 @@ class RaspFileSendTransfer:
                               font=("Arial", 10))
         change_btn.pack(side=tk.RIGHT)
         
+        # Sync options
+        options_container = tk.Frame(target_frame)
+        options_container.pack(fill=tk.X, pady=(10, 0))
+        
+        sync, mirror = get_sync_options(self.config)
+        self.sync_var = tk.BooleanVar(value=sync)
+        self.mirror_var = tk.BooleanVar(value=mirror)
+        tk.Checkbutton(options_container, text="Only send changed files", variable=self.sync_var,
+                       font=("Arial", 10)).pack(side=tk.LEFT)
+        tk.Checkbutton(options_container, text="Mirror (delete remote files not selected)", variable=self.mirror_var,
+                       font=("Arial", 10)).pack(side=tk.LEFT, padx=(15, 0))
+        
+        # Bandwidth: a limit for all uploads, and backing off while the network is busy
+        limit_container = tk.Frame(target_frame)
+        limit_container.pack(fill=tk.X, pady=(10, 0))
+        tk.Label(limit_container, text="Speed limit (MB/s):", font=("Arial", 10)).pack(side=tk.LEFT)
+        rate = self.rate_limit.rate
+        self.rate_var = tk.StringVar(value=f"{rate / (1024 * 1024):g}" if rate else RATE_LIMIT_CHOICES[0])
+        rate_box = ttk.Combobox(limit_container, textvariable=self.rate_var, values=RATE_LIMIT_CHOICES, width=10)
+        rate_box.pack(side=tk.LEFT, padx=(5, 0))
+        for sequence in ("<<ComboboxSelected>>", "<Return>", "<FocusOut>"):
+            rate_box.bind(sequence, self.apply_rate_limit)
+        self.low_priority_var = tk.BooleanVar(value=self._low_priority)
+        tk.Checkbutton(limit_container, text="Low priority (slow down when the network is busy)",
+                       variable=self.low_priority_var, font=("Arial", 10)).pack(side=tk.LEFT, padx=(15, 0))
+        
+        # Destination: the configured Pi or one of the groups from the config (see raspfilesend_fleet.py)
+        self.groups = get_groups(self.config)
+        self.destinations = {f"{self.config.get('SSH', 'ip', fallback='')} (configured Pi)": None}
+        for name, hosts in self.groups.items():
+            self.destinations[f"Group: {name} ({len(hosts)} hosts)"] = name
+        self.destination_var = tk.StringVar(value=next(iter(self.destinations)))
+        self.overwrite_var = tk.BooleanVar(value=False)
+        if self.groups:
+            destination_container = tk.Frame(target_frame)
+            destination_container.pack(fill=tk.X, pady=(10, 0))
+            tk.Label(destination_container, text="Send to:", font=("Arial", 10)).pack(side=tk.LEFT)
+            ttk.Combobox(destination_container, textvariable=self.destination_var, values=list(self.destinations),
+                         state='readonly', width=30).pack(side=tk.LEFT, padx=(5, 0))
+            # A group cannot stop for a question per file and host, so the answer is given up front
+            tk.Checkbutton(destination_container, text="Overwrite existing files (groups)", variable=self.overwrite_var,
+                           font=("Arial", 10)).pack(side=tk.LEFT, padx=(15, 0))
+            # Upload once to the first Pi of the group and let the Pis pass the files on
+            relay = self.config.get('FLEET', 'relay', fallback='false').lower() == 'true'
+            self.relay_var = tk.BooleanVar(value=relay)
+            tk.Checkbutton(destination_container, text="Relay through the first Pi", variable=self.relay_var,
+                           font=("Arial", 10)).pack(side=tk.LEFT, padx=(15, 0))
+        
         # Progress frame (fixed height)
         progress_frame = tk.LabelFrame(content_frame, text="📊 Transfer Progress", padx=15, pady=15)
         progress_frame.pack(fill=tk.X, pady=(0, 15))
         
+        self.progress_bar = ttk.Progressbar(progress_frame, maximum=PROGRESS_STEPS, mode='determinate')
+        self.progress_bar.pack(fill=tk.X)
+        
+        self.progress_label = tk.Label(progress_frame, text="", font=("Arial", 9), anchor=tk.W)
+        self.progress_label.pack(fill=tk.X, pady=(5, 0))
+        self.progress_files_label = tk.Label(progress_frame, text="", font=("Arial", 9), anchor=tk.W, fg="#555555")
+        self.progress_files_label.pack(fill=tk.X, pady=(0, 5))
+        
+        # One row per host during a group transfer; packed only then
+        self.hosts_tree = ttk.Treeview(progress_frame, columns=("host", "state", "done", "rate"),
+                                       show="headings", height=4)
+        for column, heading, width in (("host", "Host", 200), ("state", "State", 100), ("done", "Done", 70),
+                                       ("rate", "Speed", 100)):
+            self.hosts_tree.heading(column, text=heading)
+            self.hosts_tree.column(column, width=width, anchor=tk.W)
+        
         progress_container = tk.Frame(progress_frame)
         progress_container.pack(fill=tk.X)
+        self.progress_container = progress_container
         
         self.progress_text = tk.Text(progress_container, height=4, state=tk.DISABLED, font=("Consolas", 9))
         progress_scrollbar = tk.Scrollbar(progress_container, orient=tk.VERTICAL, command=self.progress_text.yview)
@@ -179,7 +309,7 @@ class RaspFileSendTransfer:
         cancel_button = tk.Button(
             button_container,
             text="❌ CANCEL",
-            command=self.root.quit,
+            command=self.cancel,
             font=("Arial", 12, "bold"),
             bg="#F44336",
             fg="white",
@@ -201,12 +331,136 @@ class RaspFileSendTransfer:
         )
         self.status_label.pack(pady=(10, 0))
         
+    def cancel(self):
+        """Stop a running group transfer, otherwise close the window
+        
+        The async engine aborts its uploads and removes their partial files; the threaded one
+        starts no new files and lets the running uploads finish.
+        """
+        fleet = self._active_fleet
+        if fleet is None:
+            self.root.quit()
+            return
+        fleet.cancel()
+        self.log_message("⏹️ Cancelling the transfer...")
+        self.status_label.config(text="⏹️ Cancelling...")
+        
+    def ui_log(self, message):
+        """Queue a log line (safe from any thread)"""
+        self._ui_events.put(('log', message))
+        
+    def ui_status(self, text):
+        """Queue a status label change (safe from any thread)"""
+        self._ui_events.put(('status', text))
+        
+    def ui_call(self, function):
+        """Run function on the main loop after the UI changes queued before it (safe from any thread)"""
+        self._ui_events.put(('call', function))
+        
+    def _drain_ui_events(self):
+        """Apply queued UI changes in one batch, then redraw the progress bar"""
+        # Scheduled first: a call that opens a modal dialog must not stop the updates behind it
+        self.root.after(UI_TICK_MS, self._drain_ui_events)
+        lines = []
+        for _ in range(UI_TICK_EVENTS):
+            try:
+                kind, value = self._ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                lines.append(value)
+                continue
+            # Keep the order: lines queued before a status change or call appear first
+            if lines:
+                self._append_log(lines)
+                lines = []
+            if kind == 'status':
+                self.status_label.config(text=value)
+            else:
+                value()
+        if lines:
+            self._append_log(lines)
+        if self._progress_source is not None:
+            snapshot = self._progress_source()
+            if snapshot:
+                self._show_progress(snapshot)
+        
     def log_message(self, message):
+        self._append_log([message])
+        
+    def _append_log(self, lines):
+        """Add lines to the log in one insert and drop the oldest beyond MAX_LOG_LINES"""
+        lines = lines[-MAX_LOG_LINES:]
         self.progress_text.config(state=tk.NORMAL)
-        self.progress_text.insert(tk.END, message + "\n")
+        self.progress_text.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.progress_text.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+        if excess > 0:
+            self.progress_text.delete('1.0', f'{excess + 1}.0')
         self.progress_text.see(tk.END)
         self.progress_text.config(state=tk.DISABLED)
-        self.root.update()
+        
+    def _start_progress(self, source):
+        """Redraw from source() snapshots on every UI tick until _finish_progress is called"""
+        self._progress_source = source
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text="")
+        self.progress_files_label.config(text="")
+        
+    def _show_progress(self, snapshot):
+        if snapshot['total']:
+            self.progress_bar['value'] = PROGRESS_STEPS * snapshot['done'] / snapshot['total']
+        batch, files = describe(snapshot)
+        self.progress_label.config(text=batch)
+        self.progress_files_label.config(text=files)
+        
+    def _finish_progress(self, snapshot, completed):
+        self._progress_source = None
+        if snapshot:
+            self._show_progress(snapshot)
+            self.progress_label.config(text=describe_finished(snapshot))
+        if completed:
+            self.progress_bar['value'] = PROGRESS_STEPS
+        self.progress_files_label.config(text="")
+        
+    def _show_hosts(self, hosts):
+        """Show an empty row per host above the log, or hide the host list when hosts is None"""
+        self.hosts_tree.delete(*self.hosts_tree.get_children())
+        if hosts is None:
+            self.hosts_tree.pack_forget()
+            return
+        for host in hosts:
+            self.hosts_tree.insert("", tk.END, iid=host, values=(host, "waiting", "", ""))
+        self.hosts_tree.pack(fill=tk.X, pady=(0, 5), before=self.progress_container)
+        
+    def _fleet_progress(self, fleet):
+        """Progress source for a group transfer: refresh the host rows, return the fleet total"""
+        for host, state, snapshot in fleet.status():
+            done = f"{snapshot['done'] * 100 // snapshot['total']}%" if snapshot['total'] else ""
+            rate = format_rate(snapshot['rate']) if state == "sending" and snapshot['rate'] else ""
+            self.hosts_tree.item(host, values=(host, state, done, rate))
+        return fleet.snapshot()
+        
+    def apply_rate_limit(self, event=None):
+        """Apply the speed box to running and later uploads"""
+        text = self.rate_var.get().strip()
+        try:
+            rate = 0 if text in ("", RATE_LIMIT_CHOICES[0]) else max(0, int(float(text) * 1024 * 1024))
+        except ValueError:
+            rate = self.rate_limit.rate
+        self.rate_var.set(f"{rate / (1024 * 1024):g}" if rate else RATE_LIMIT_CHOICES[0])
+        if rate == self.rate_limit.rate:
+            return
+        self.rate_limit.set_rate(rate)
+        self.log_message(f"🚦 Speed limit: {format_rate(rate) if rate else 'none'}")
+        if self.use_agent:
+            # A transfer running in the agent uses the agent's own bucket
+            def tell_agent():
+                try:
+                    from raspfilesend_agent import agent_request
+                    agent_request({'cmd': 'set_rate', 'rate': rate}, start=False)
+                except Exception:
+                    pass  # The next job passes the limit along anyway
+            threading.Thread(target=tell_agent, daemon=True).start()
         
     def change_target_directory(self):
         current_dir = self.target_var.get()
@@ -302,6 +556,132 @@ class RaspFileSendTransfer:
         dialog.wait_window()
         return result[0]
     
+    def show_conflict_dialog(self, conflicts):
+        """Let the user settle every existing file at once; returns {name: action} or None to cancel"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Files Already on the Pi")
+        dialog.geometry("720x460")
+        dialog.minsize(600, 350)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        result = [None]
+        
+        tk.Label(dialog, text=f"⚠️ {len(conflicts)} file(s) already exist in the target directory.",
+                 font=("Arial", 11, "bold")).pack(anchor=tk.W, padx=15, pady=(15, 0))
+        tk.Label(dialog, text="Choose what to do with each one (double-click a row to change it). "
+                              "The buttons apply to the selected rows, or to all rows if none is selected.",
+                 font=("Arial", 9), wraplength=680, justify=tk.LEFT).pack(anchor=tk.W, padx=15, pady=(5, 10))
+        
+        # Conflict list
+        list_frame = tk.Frame(dialog)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=15)
+        columns = ("name", "local", "remote", "action")
+        tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="extended")
+        for column, heading, width in (("name", "File", 260), ("local", "This computer", 150),
+                                       ("remote", "On the Pi", 150), ("action", "Action", 120)):
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, stretch=(column == "name"))
+        tree_scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=tree_scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        def describe_file(size, mtime):
+            return f"{format_size(size)}, {time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}"
+        
+        # Identical copies are skipped unless the user says otherwise
+        actions = {}
+        by_row = {}
+        for conflict in conflicts:
+            identical = (conflict['local_size'] == conflict['remote_size']
+                         and conflict['local_mtime'] == conflict['remote_mtime'])
+            action = 'skip' if identical else 'overwrite'
+            row = tree.insert("", tk.END, values=(
+                conflict['name'],
+                describe_file(conflict['local_size'], conflict['local_mtime']),
+                describe_file(conflict['remote_size'], conflict['remote_mtime']),
+                CONFLICT_ACTIONS[action],
+            ))
+            actions[row] = action
+            by_row[row] = conflict
+        
+        def set_action(rows, choose):
+            for row in rows:
+                action = choose(by_row[row])
+                if action:
+                    actions[row] = action
+                    tree.set(row, "action", CONFLICT_ACTIONS[action])
+        
+        def target_rows():
+            return tree.selection() or tree.get_children()
+        
+        def cycle(event):
+            row = tree.identify_row(event.y)
+            if row:
+                order = list(CONFLICT_ACTIONS)
+                next_action = order[(order.index(actions[row]) + 1) % len(order)]
+                set_action([row], lambda conflict: next_action)
+        tree.bind("<Double-1>", cycle)
+        
+        # Bulk actions
+        bulk_frame = tk.Frame(dialog)
+        bulk_frame.pack(fill=tk.X, padx=15, pady=(10, 0))
+        for text, choose in (
+            ("Overwrite", lambda conflict: 'overwrite'),
+            ("Skip", lambda conflict: 'skip'),
+            ("Keep both", lambda conflict: 'rename'),
+            ("Overwrite newer only", lambda conflict: 'overwrite' if conflict['local_mtime'] > conflict['remote_mtime'] else 'skip'),
+            ("Skip identical", lambda conflict: 'skip' if (conflict['local_size'] == conflict['remote_size']
+                                                            and conflict['local_mtime'] == conflict['remote_mtime']) else None),
+        ):
+            tk.Button(bulk_frame, text=text, command=lambda choose=choose: set_action(target_rows(), choose)
+                      ).pack(side=tk.LEFT, padx=(0, 5))
+        
+        # Confirm or cancel
+        button_frame = tk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=15, pady=15)
+        
+        def finish(confirmed):
+            if confirmed:
+                result[0] = {by_row[row]['name']: action for row, action in actions.items()}
+            dialog.destroy()
+        
+        tk.Button(button_frame, text="Cancel Transfer", width=14, command=lambda: finish(False)).pack(side=tk.RIGHT)
+        start_btn = tk.Button(button_frame, text="Start Transfer", width=14, command=lambda: finish(True))
+        start_btn.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        start_btn.focus_set()
+        dialog.bind('<Return>', lambda e: finish(True))
+        dialog.bind('<Escape>', lambda e: finish(False))
+        dialog.protocol("WM_DELETE_WINDOW", lambda: finish(False))
+        
+        dialog.wait_window()
+        return result[0]
+    
+    def _ask_from_worker(self, ask):
+        """Run ask() on the main thread and block the calling worker until it returns"""
+        answered = threading.Event()
+        response = [None]  # Use list to allow modification in nested function
+        
+        def run():
+            try:
+                response[0] = ask()
+            finally:
+                answered.set()
+        
+        self.ui_call(run)
+        answered.wait()
+        return response[0]
+    
+    def ask_overwrite_from_worker(self, filename):
+        """Show the overwrite dialog on the main thread and wait for the answer"""
+        return self._ask_from_worker(lambda: self.show_overwrite_dialog(filename)) or "cancel"
+    
+    def resolve_conflicts_from_worker(self, conflicts):
+        """Show the conflict dialog on the main thread and wait for the resolutions (None to cancel)"""
+        return self._ask_from_worker(lambda: self.show_conflict_dialog(conflicts))
+    
     def start_transfer(self):
         # Disable button during transfer
         self.send_button.config(state=tk.DISABLED, text="🔄 TRANSFERRING...")
@@ -326,11 +706,43 @@ class RaspFileSendTransfer:
             self.status_label.config(text="❌ Configuration error")
             return
         
+        # Mirror mode deletes files on the Pi, so confirm it first
+        sync = self.sync_var.get() or self.mirror_var.get()
+        mirror = self.mirror_var.get()
+        if mirror and not messagebox.askyesno("Mirror Mode",
+                                              "Mirror mode deletes files in the target directory and inside the selected folders "
+                                              "that are not part of this selection.\n\nContinue?",
+                                              parent=self.root):
+            self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES")
+            self.status_label.config(text="❌ Transfer cancelled")
+            return
+        
+        group = self.destinations.get(self.destination_var.get())
+        if group is not None:
+            self.start_group_transfer(group, sync, mirror)
+            return
+        self._show_hosts(None)
+        
         # Get password if needed (on main thread)
         password = None
         auth_method = self.config.get('SSH', 'auth_method', fallback='password')
         
-        if auth_method == "password":
+        # A warm connection to the same Pi (in the agent, or left open by an earlier send) needs no password
+        connected = False
+        if self.use_agent:
+            try:
+                from raspfilesend_agent import agent_request
+                status = agent_request({'cmd': 'status'}, start=False)
+                if status:
+                    live = status.get('connections') or [status.get('connected_to')]
+                    connected = connection_id(self.config) in [tuple(c) for c in live if c]
+            except Exception:
+                connected = False
+        else:
+            from raspfilesend_pool import get_pool
+            connected = get_pool(self.config).is_connected(self.config)
+        
+        if auth_method == "password" and not connected:
             # Check if password is saved
             save_password = self.config.get('SSH', 'save_password', fallback='false').lower() == 'true'
             encrypted_password = self.config.get('SSH', 'encrypted_password', fallback='')
@@ -358,136 +770,220 @@ class RaspFileSendTransfer:
                 self.status_label.config(text="❌ Transfer cancelled")
                 return
         
+        # Send files that arrived from other launches since the last transfer, otherwise all of them
+        with self._files_lock:
+            if self._handed_off >= len(self.files):
+                self._handed_off = 0
+        
+        # Local uploads feed the tracker directly; the agent sends its snapshots over the pipe.
+        # Until the speed is measured, the ETA comes from earlier transfers to this Pi
+        from raspfilesend_history import expected_rate
+        progress = ProgressTracker(initial_rate=expected_rate(self.config, ip))
+        low_priority = self.low_priority_var.get()
+        agent_snapshot = [None]
+        if self.use_agent:
+            self._start_progress(lambda: agent_snapshot[0])
+        else:
+            self._start_progress(progress.snapshot)
+        
         def transfer():
+            from raspfilesend_agent import run_agent_transfer
+            from raspfilesend_engine import run_transfer, summarize_sync
+            from raspfilesend_pool import get_pool
+            from raspfilesend_trace import start_trace
+            completed = False
+            # Shown last, so the modal box does not hold back the other updates
+            notify = None
             try:
-                self.log_message("🔄 Starting file transfer...")
-                
-                # Import paramiko here to check if it's available
-                try:
-                    import paramiko
-                except ImportError:
-                    self.root.after(0, lambda: self.log_message("❌ ERROR: paramiko library not found. Please install it with: pip install paramiko"))
-                    self.root.after(0, lambda: self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES"))
-                    self.root.after(0, lambda: self.status_label.config(text="❌ Missing dependency"))
-                    return
-                
-                port = int(self.config.get('SSH', 'port', fallback='22'))
-                key_path = self.config.get('SSH', 'key_path', fallback='')
+                self.ui_log("🔄 Starting file transfer...")
                 target_dir = self.target_var.get()
+                log = self.ui_log
+                batch = self._next_batch()
                 
-                # Establish SSH connection
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                
-                self.root.after(0, lambda: self.log_message(f"🔌 Connecting to {username}@{ip}:{port}..."))
-                
-                if auth_method == "password":
-                    ssh.connect(hostname=ip, username=username, password=password, port=port, timeout=15)
+                if self.use_agent:
+                    # Thin client: the resident agent owns the SSH connection
+                    round_mirror = mirror
+                    while batch:
+                        result = run_agent_transfer(
+                            {'files': [os.path.abspath(f) for f in batch], 'target_dir': target_dir,
+                             'password': password, 'sync': sync, 'mirror': round_mirror,
+                             'max_rate': self.rate_limit.rate, 'low_priority': low_priority},
+                            log, self.ask_overwrite_from_worker,
+                            on_progress=lambda snapshot: agent_snapshot.__setitem__(0, snapshot),
+                            resolve_conflicts=self.resolve_conflicts_from_worker
+                        )
+                        if result['event'] == 'error':
+                            raise Exception(result['message'])
+                        completed = result['completed']
+                        if result.get('summary'):
+                            log(result['summary'])
+                        if not completed:
+                            break
+                        # Later rounds must not delete what earlier rounds just mirrored
+                        round_mirror = False
+                        batch = self._next_batch()
+                        if batch:
+                            log(f"➕ Sending {len(batch)} more file(s)")
                 else:
-                    ssh.connect(hostname=ip, username=username, key_filename=key_path, port=port, timeout=15)
-                
-                self.root.after(0, lambda: self.log_message("✅ Connected successfully!"))
-                
-                # Create target directory if it doesn't exist
-                stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {target_dir}")
-                
-                # Start SFTP session
-                sftp = ssh.open_sftp()
-                
-                # Transfer each file
-                overwrite_all = None  # None, True (yes to all), False (no to all)
-                
-                for i, file_path in enumerate(self.files, 1):
-                    if not os.path.exists(file_path):
-                        self.root.after(0, lambda fp=file_path: self.log_message(f"⚠️ WARNING: File not found: {fp}"))
-                        continue
-                        
-                    filename = os.path.basename(file_path)
-                    remote_path = f"{target_dir}/{filename}"
+                    # Import paramiko here to check if it's available (only the local test backend works without it)
+                    try:
+                        if get_backend(self.config) != "local":
+                            import paramiko
+                    except ImportError:
+                        self.ui_log("❌ ERROR: paramiko library not found. Please install it with: pip install paramiko")
+                        self.ui_status("❌ Missing dependency")
+                        return
                     
-                    self.root.after(0, lambda fn=filename, idx=i, total=len(self.files): 
-                                  self.log_message(f"📤 Transferring [{idx}/{total}]: {fn}"))
+                    port = int(self.config.get('SSH', 'port', fallback='22'))
                     
+                    # Establish SSH connection
+                    self.ui_log(f"🔌 Connecting to {username}@{ip}:{port}...")
+                    # Phase timings for the whole session when tracing is on (see raspfilesend_trace.py)
+                    tracer = start_trace(self.config, 'transfer', host=ip, target_dir=target_dir)
+                    # The connection stays open after the transfer, so the next send skips the handshake
+                    pool = get_pool(self.config)
+                    backend = None
                     try:
-                        # Check if file already exists and ask for confirmation
-                        file_exists = False
-                        try:
-                            sftp.stat(remote_path)
-                            file_exists = True
-                        except FileNotFoundError:
-                            pass  # File doesn't exist, continue with transfer
+                        backend, reused = pool.acquire(self.config, password, tracer=tracer)
+                        self.ui_log("♻️ Reusing the open connection" if reused else "✅ Connected successfully!")
                         
-                        if file_exists:
-                            should_overwrite = True
-                            
-                            # Check overwrite_all setting first
-                            if overwrite_all is True:
-                                should_overwrite = True
-                            elif overwrite_all is False:
-                                should_overwrite = False
-                            else:
-                                # Ask user with overwrite all options
-                                response = [None]  # Use list to allow modification in nested function
-                                def ask_overwrite():
-                                    response[0] = self.show_overwrite_dialog(filename)
-                                
-                                self.root.after(0, ask_overwrite)
-                                
-                                # Wait for response
-                                while response[0] is None:
-                                    import time
-                                    time.sleep(0.1)
-                                
-                                user_choice = response[0]
-                                if user_choice == "yes":
-                                    should_overwrite = True
-                                elif user_choice == "no":
-                                    should_overwrite = False
-                                elif user_choice == "yes_all":
-                                    should_overwrite = True
-                                    overwrite_all = True
-                                    self.root.after(0, lambda: self.log_message("🔄 Will overwrite all remaining files without asking"))
-                                elif user_choice == "no_all":
-                                    should_overwrite = False
-                                    overwrite_all = False
-                                    self.root.after(0, lambda: self.log_message("⏭️ Will skip all remaining files without asking"))
-                                else:  # cancel or None
-                                    self.root.after(0, lambda: self.log_message("❌ Transfer cancelled by user"))
-                                    sftp.close()
-                                    ssh.close()
-                                    return
-                            
-                            if not should_overwrite:
-                                self.root.after(0, lambda fn=filename: self.log_message(f"⏭️ Skipped: {fn}"))
-                                continue
-                        
-                        # Transfer the file
-                        sftp.put(file_path, remote_path)
-                        file_size = os.path.getsize(file_path)
-                        self.root.after(0, lambda fn=filename, fs=file_size: 
-                                      self.log_message(f"✅ Transferred: {fn} ({fs:,} bytes)"))
-                        
-                    except Exception as e:
-                        self.root.after(0, lambda fn=filename, err=str(e): 
-                                      self.log_message(f"❌ Failed to transfer {fn}: {err}"))
+                        # Files forwarded during a batch join it; any that arrive too late form another batch
+                        round_mirror = mirror
+                        while batch:
+                            completed, uploader = run_transfer(backend, self.config, batch, target_dir, log,
+                                                               ask_overwrite=self.ask_overwrite_from_worker,
+                                                               resolve_conflicts=self.resolve_conflicts_from_worker,
+                                                               sync=sync, mirror=round_mirror,
+                                                               on_start=self._attach_uploader, progress=progress,
+                                                               rate_limit=self.rate_limit, low_priority=low_priority,
+                                                               tracer=tracer)
+                            if sync:
+                                log(summarize_sync(uploader))
+                            if not completed:
+                                break
+                            # Later rounds must not delete what earlier rounds just mirrored
+                            round_mirror = False
+                            batch = self._next_batch()
+                            if batch:
+                                log(f"➕ Sending {len(batch)} more file(s) over the same connection")
+                    finally:
+                        if backend is not None:
+                            pool.release(backend)
+                        if tracer.close():
+                            log(f"📊 Timing trace saved to {tracer.path}")
                 
-                sftp.close()
-                ssh.close()
+                if not completed:
+                    self.ui_log("❌ Transfer cancelled by user")
+                    return
                 
-                self.root.after(0, lambda: self.log_message(f"\n🎉 Transfer completed! Files sent to: {target_dir}"))
-                self.root.after(0, lambda: self.status_label.config(text="🎉 Transfer completed successfully!"))
-                self.root.after(0, lambda: messagebox.showinfo("Transfer Complete", 
-                                                              f"Files have been successfully sent to {ip}:{target_dir}",
-                                                              parent=self.root))
+                self.ui_log(f"\n🎉 Transfer completed! Files sent to: {target_dir}")
+                self.ui_status("🎉 Transfer completed successfully!")
+                notify = lambda: messagebox.showinfo("Transfer Complete",
+                                                     f"Files have been successfully sent to {ip}:{target_dir}",
+                                                     parent=self.root)
                 
             except Exception as e:
                 error_msg = f"Transfer failed: {str(e)}"
-                self.root.after(0, lambda: self.log_message(f"❌ ERROR: {error_msg}"))
-                self.root.after(0, lambda: self.status_label.config(text="❌ Transfer failed"))
-                self.root.after(0, lambda: messagebox.showerror("Transfer Error", error_msg, parent=self.root))
+                self.ui_log(f"❌ ERROR: {error_msg}")
+                self.ui_status("❌ Transfer failed")
+                notify = lambda: messagebox.showerror("Transfer Error", error_msg, parent=self.root)
             finally:
+                # Files forwarded from now on wait for the next click on Send
+                self._attach_uploader(None)
+                final = agent_snapshot[0] if self.use_agent else progress.snapshot(force=True)
+                self.ui_call(lambda: self._finish_progress(final, completed))
                 # Re-enable button
-                self.root.after(0, lambda: self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES"))
+                self.ui_call(lambda: self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES"))
+                if notify:
+                    self.ui_call(notify)
+        
+        # Run transfer in separate thread to avoid blocking UI
+        threading.Thread(target=transfer, daemon=True).start()
+        
+    def start_group_transfer(self, group, sync, mirror):
+        """Send the whole selection to every host of a group (without the agent)"""
+        from raspfilesend_async import AsyncFleetTransfer, use_async_engine
+        from raspfilesend_fleet import FleetTransfer, RelayTransfer, get_relay_options
+        
+        with self._files_lock:
+            files = [os.path.abspath(f) for f in self.files]
+            self._handed_off = len(self.files)
+        hosts = self.groups[group]
+        relay = self.relay_var.get() and len(hosts) > 1
+        try:
+            # A host of the group without a [HOST] section fails here
+            if use_async_engine(self.config, mirror=mirror, relay=relay, low_priority=self.low_priority_var.get()):
+                fleet = AsyncFleetTransfer(self.config, hosts, files, self.target_var.get(), self.ui_log,
+                                           overwrite=self.overwrite_var.get(), sync=sync, rate_limit=self.rate_limit)
+            elif relay:
+                fleet = RelayTransfer(self.config, hosts, files, self.target_var.get(), self.ui_log,
+                                      overwrite=self.overwrite_var.get(), sync=sync, mirror=mirror,
+                                      rate_limit=self.rate_limit, low_priority=self.low_priority_var.get(),
+                                      fanout=get_relay_options(self.config)[1])
+            else:
+                fleet = FleetTransfer(self.config, hosts, files, self.target_var.get(), self.ui_log,
+                                      overwrite=self.overwrite_var.get(), sync=sync, mirror=mirror,
+                                      rate_limit=self.rate_limit, low_priority=self.low_priority_var.get())
+            needs_password = fleet.needs_password()
+        except ValueError as e:
+            messagebox.showerror("Configuration Error", f"Group {group}: {e}", parent=self.root)
+            self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES")
+            self.status_label.config(text="❌ Configuration error")
+            return
+        if needs_password:
+            # One password for every host of the group that has none saved
+            fleet.password = simpledialog.askstring("Password", f"Enter password for the Pis in group {group}:",
+                                                    show='*', parent=self.root)
+            if not fleet.password:
+                self.log_message("Transfer cancelled - no password provided.")
+                self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES")
+                self.status_label.config(text="❌ Transfer cancelled")
+                return
+        
+        self._show_hosts(hosts)
+        self._start_progress(lambda: self._fleet_progress(fleet))
+        
+        def finished(error=None):
+            """Log the outcome and notify; runs off the main loop, so every UI change goes through the UI queue"""
+            completed = False
+            if error is None:
+                summary = fleet.summary()
+                for line in summary:
+                    self.ui_log(line)
+                completed = all(state == "done" for state in fleet.states.values())
+                if completed:
+                    self.ui_status(f"🎉 Sent to all {len(hosts)} Pis in {group}")
+                    notify = lambda: messagebox.showinfo("Transfer Complete", "\n".join(summary), parent=self.root)
+                else:
+                    self.ui_status(f"⚠️ Some Pis in {group} did not receive the files")
+                    notify = lambda: messagebox.showwarning("Transfer Incomplete", "\n".join(summary), parent=self.root)
+            else:
+                error_msg = f"Transfer failed: {str(error)}"
+                self.ui_log(f"❌ ERROR: {error_msg}")
+                self.ui_status("❌ Transfer failed")
+                notify = lambda: messagebox.showerror("Transfer Error", error_msg, parent=self.root)
+            
+            def finish():
+                self._active_fleet = None
+                self._finish_progress(self._fleet_progress(fleet), completed)
+                self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES")
+            self.ui_call(finish)
+            self.ui_call(notify)
+        
+        self._active_fleet = fleet
+        self.ui_log(f"🔄 Sending {len(files)} item(s) to group {group}...")
+        if isinstance(fleet, AsyncFleetTransfer):
+            # Every Pi and upload runs on the shared event loop thread; the UI tick keeps polling progress
+            fleet.start(on_done=finished)
+            return
+        
+        def transfer():
+            try:
+                fleet.run()
+            except Exception as e:
+                finished(e)
+            else:
+                finished()
         
         # Run transfer in separate thread to avoid blocking UI
         threading.Thread(target=transfer, daemon=True).start()
@@ -500,9 +996,24 @@ def main():
         messagebox.showerror("Error", "No files specified for transfer.")
         return
     
-    files = sys.argv[1:]
-    app = RaspFileSendTransfer(files)
-    app.run()
+    files = [os.path.abspath(f) for f in sys.argv[1:]]
+    
+    # Only one transfer window: later Send To launches hand their files to it and exit
+    instance = claim_instance()
+    if instance is None:
+        if forward_files(files):
+            return
+        instance = claim_instance()  # The other window closed in the meantime
+    
+    try:
+        app = RaspFileSendTransfer(files)
+        if instance:
+            # Listen for later launches once the window is up
+            app.root.after_idle(lambda: instance.start(app.add_files))
+        app.run()
+    finally:
+        if instance:
+            instance.close()
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,8 @@ from pathlib import Path
 import threading
 import subprocess
 
+from raspfilesend_backend import open_backend
+
 class RaspFileSendTransfer:
     def __init__(self, files):
         self.files = files
@@ -225,90 +227,74 @@ class RaspFileSendTransfer:
             try:
                 self.log_message("🔄 Starting file transfer...")
                 
-                # Import paramiko here to check if it's available
+                port = int(self.config.get('SSH', 'port', fallback='22'))
+                target_dir = self.target_var.get()
+                
+                # Establish the connection through the configured backend (see raspfilesend_backend.py)
+                self.root.after(0, lambda: self.log_message(f"🔌 Connecting to {username}@{ip}:{port}..."))
                 try:
-                    import paramiko
+                    backend = open_backend(self.config, password)
                 except ImportError:
                     self.root.after(0, lambda: self.log_message("❌ ERROR: paramiko library not found. Please install it with: pip install paramiko"))
                     self.root.after(0, lambda: self.send_button.config(state=tk.NORMAL, text="🚀 SEND FILES"))
                     self.root.after(0, lambda: self.status_label.config(text="❌ Missing dependency"))
                     return
                 
-                port = int(self.config.get('SSH', 'port', fallback='22'))
-                key_path = self.config.get('SSH', 'key_path', fallback='')
-                target_dir = self.target_var.get()
-                
-                # Establish SSH connection
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                
-                self.root.after(0, lambda: self.log_message(f"🔌 Connecting to {username}@{ip}:{port}..."))
-                
-                if auth_method == "password":
-                    ssh.connect(hostname=ip, username=username, password=password, port=port, timeout=15)
-                else:
-                    ssh.connect(hostname=ip, username=username, key_filename=key_path, port=port, timeout=15)
-                
                 self.root.after(0, lambda: self.log_message("✅ Connected successfully!"))
                 
-                # Create target directory if it doesn't exist
-                stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {target_dir}")
-                
-                # Start SFTP session
-                sftp = ssh.open_sftp()
-                
-                # Transfer each file
-                for i, file_path in enumerate(self.files, 1):
-                    if not os.path.exists(file_path):
-                        self.root.after(0, lambda fp=file_path: self.log_message(f"⚠️ WARNING: File not found: {fp}"))
-                        continue
-                        
-                    filename = os.path.basename(file_path)
-                    remote_path = f"{target_dir}/{filename}"
+                try:
+                    # Create target directory if it doesn't exist
+                    backend.mkdir_many([target_dir])
                     
-                    self.root.after(0, lambda fn=filename, idx=i, total=len(self.files): 
-                                  self.log_message(f"📤 Transferring [{idx}/{total}]: {fn}"))
+                    # One batched lookup tells which files already exist on the Pi
+                    remote_paths = {file_path: f"{target_dir}/{os.path.basename(file_path)}" for file_path in self.files}
+                    existing = backend.stat_many(list(remote_paths.values()))
                     
-                    try:
-                        # Check if file already exists and ask for confirmation
-                        file_exists = False
-                        try:
-                            sftp.stat(remote_path)
-                            file_exists = True
-                        except FileNotFoundError:
-                            pass  # File doesn't exist, continue with transfer
-                        
-                        if file_exists:
-                            # Ask on main thread
-                            response = [None]  # Use list to allow modification in nested function
-                            def ask_overwrite():
-                                response[0] = messagebox.askyesno("File Exists", 
-                                                                f"File '{filename}' already exists on the Raspberry Pi.\n\nOverwrite?",
-                                                                parent=self.root)
+                    # Transfer each file
+                    for i, file_path in enumerate(self.files, 1):
+                        if not os.path.exists(file_path):
+                            self.root.after(0, lambda fp=file_path: self.log_message(f"⚠️ WARNING: File not found: {fp}"))
+                            continue
                             
-                            self.root.after(0, ask_overwrite)
-                            
-                            # Wait for response
-                            while response[0] is None:
-                                import time
-                                time.sleep(0.1)
-                            
-                            if not response[0]:
-                                self.root.after(0, lambda fn=filename: self.log_message(f"⏭️ Skipped: {fn}"))
-                                continue
+                        filename = os.path.basename(file_path)
+                        remote_path = remote_paths[file_path]
                         
-                        # Transfer the file
-                        sftp.put(file_path, remote_path)
-                        file_size = os.path.getsize(file_path)
-                        self.root.after(0, lambda fn=filename, fs=file_size: 
-                                      self.log_message(f"✅ Transferred: {fn} ({fs:,} bytes)"))
+                        self.root.after(0, lambda fn=filename, idx=i, total=len(self.files): 
+                                      self.log_message(f"📤 Transferring [{idx}/{total}]: {fn}"))
                         
-                    except Exception as e:
-                        self.root.after(0, lambda fn=filename, err=str(e): 
-                                      self.log_message(f"❌ Failed to transfer {fn}: {err}"))
-                
-                sftp.close()
-                ssh.close()
+                        try:
+                            # Ask for confirmation if the file already exists
+                            if existing.get(remote_path) is not None:
+                                # Ask on main thread
+                                response = [None]  # Use list to allow modification in nested function
+                                def ask_overwrite():
+                                    response[0] = messagebox.askyesno("File Exists", 
+                                                                    f"File '{filename}' already exists on the Raspberry Pi.\n\nOverwrite?",
+                                                                    parent=self.root)
+                                
+                                self.root.after(0, ask_overwrite)
+                                
+                                # Wait for response
+                                while response[0] is None:
+                                    import time
+                                    time.sleep(0.1)
+                                
+                                if not response[0]:
+                                    self.root.after(0, lambda fn=filename: self.log_message(f"⏭️ Skipped: {fn}"))
+                                    continue
+                            
+                            # Transfer the file
+                            file_size = os.path.getsize(file_path)
+                            with open(file_path, 'rb') as local_file:
+                                backend.put_stream(local_file, remote_path, file_size)
+                            self.root.after(0, lambda fn=filename, fs=file_size: 
+                                          self.log_message(f"✅ Transferred: {fn} ({fs:,} bytes)"))
+                            
+                        except Exception as e:
+                            self.root.after(0, lambda fn=filename, err=str(e): 
+                                          self.log_message(f"❌ Failed to transfer {fn}: {err}"))
+                finally:
+                    backend.close()
                 
                 self.root.after(0, lambda: self.log_message(f"\n🎉 Transfer completed! Files sent to: {target_dir}"))
                 self.root.after(0, lambda: self.status_label.config(text="🎉 Transfer completed successfully!"))
@@ -0,0 +1,119 @@
+"""
+Folder support for RaspFileSend
+Walks selected folders lazily and creates the matching directories on the Pi in batches
+"""
+
+import itertools
+import os
+import posixpath
+import shlex
+from collections import deque
+
+# Keep each remote `mkdir -p` command line well below the shell's argument limit
+MKDIR_BATCH_CHARS = 16 * 1024
+
+
+def walk_files(paths, make_dirs=None, log=None):
+    """Yield (local_path, relative_path) for every file in paths, breadth first
+
+    A plain file is yielded under its own name; a folder keeps its name and structure,
+    e.g. ("C:/photos/2024/a.jpg", "photos/2024/a.jpg"). Folders are scanned one at a time
+    while the caller consumes the files, so a large tree never becomes one big list.
+
+    make_dirs(relative_dirs) is called before the first file inside those folders is
+    yielded. Every folder found so far is passed in one call, which usually means one
+    call per folder depth. Empty folders are included. Selected items that share a name are
+    kept apart, see top_level_names.
+    """
+    pending = deque()  # (local folder, relative folder) still to be scanned
+    unmade = {}        # Relative folders found but not yet passed to make_dirs, in walk order
+
+    for path, relative in top_level_names(paths):
+        if log and relative != os.path.basename(os.path.normpath(path)):
+            log(f"⚠️ WARNING: Another selected item is also named {os.path.basename(os.path.normpath(path))}, "
+                f"sending {path} as {relative}")
+        if os.path.isdir(path):
+            pending.append((path, relative))
+            unmade[relative] = None
+        else:
+            # Missing files are passed on so the uploader can report them
+            yield path, relative
+
+    while pending:
+        local_dir, relative_dir = pending.popleft()
+        if relative_dir in unmade:
+            # Everything found so far (normally the rest of this depth) is created together
+            if make_dirs:
+                make_dirs(list(unmade))
+            unmade = {}
+        try:
+            with os.scandir(local_dir) as entries:
+                for entry in entries:
+                    relative = f"{relative_dir}/{entry.name}"
+                    # Symlinked folders are not followed, so links cannot loop back up the tree
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append((entry.path, relative))
+                        unmade[relative] = None
+                    elif entry.is_file():
+                        yield entry.path, relative
+        except OSError as e:
+            if log:
+                log(f"⚠️ WARNING: Cannot read folder {local_dir}: {e}")
+
+
+def top_level_names(paths):
+    """Return [(path, name on the Pi)] for the selected paths
+
+    Items from different folders may share a name (two "photos" folders); the later ones are
+    numbered like renamed copies, e.g. "photos (2)", instead of being merged into one.
+    """
+    names = []
+    taken = set()
+    for path in paths:
+        name = candidate = os.path.basename(os.path.normpath(path))
+        number = 2
+        while candidate in taken:
+            candidate = renamed(name, number)
+            number += 1
+        taken.add(candidate)
+        names.append((path, candidate))
+    return names
+
+
+def renamed(relative, number):
+    """Name used for the nth renamed copy, e.g. folder/report (2).pdf"""
+    stem, extension = posixpath.splitext(relative)
+    return f"{stem} ({number}){extension}"
+
+
+def sample_files(paths, limit):
+    """Return up to limit local file paths from the start of the walk, without creating anything"""
+    return [local_path for local_path, _ in itertools.islice(walk_files(paths), limit)]
+
+
+def mkdir_commands(paths):
+    """Yield `mkdir -p` command lines that create paths, as few as the line length allows"""
+    batch = []
+    length = 0
+    for path in paths:
+        argument = shlex.quote(path)
+        if batch and length + len(argument) > MKDIR_BATCH_CHARS:
+            yield "mkdir -p -- " + " ".join(batch)
+            batch = []
+            length = 0
+        batch.append(argument)
+        length += len(argument) + 1
+    if batch:
+        yield "mkdir -p -- " + " ".join(batch)
+
+
+def mkdir_many(ssh, paths):
+    """Create remote folders with as few `mkdir -p` commands as the line length allows"""
+    for command in mkdir_commands(paths):
+        _mkdir(ssh, command)
+
+
+def _mkdir(ssh, command):
+    stdin, stdout, stderr = ssh.exec_command(command)
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError(f"could not create remote folders: {stderr.read().decode(errors='replace').strip()}")
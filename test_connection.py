@@ -6,8 +6,12 @@ This helps debug connection issues without the GUI complexity
 
 import sys
 import configparser
+import shlex
 from pathlib import Path
 
+from raspfilesend_backend import open_backend
+from raspfilesend_common import get_backend
+
 def test_ssh_connection():
     # Load configuration
     config_file = Path.home() / ".raspfilesend_config.ini"
@@ -32,77 +36,61 @@ def test_ssh_connection():
         print("❌ IP address or username not configured")
         return False
     
-    try:
-        import paramiko
-        print("✅ paramiko library found")
-    except ImportError:
-        print("❌ paramiko library not found. Install with: pip install paramiko")
-        return False
+    backend_name = get_backend(config)
+    print(f"🔗 Backend: {backend_name}")
+    
+    if backend_name != "local":
+        try:
+            import paramiko
+            print("✅ paramiko library found")
+        except ImportError:
+            print("❌ paramiko library not found. Install with: pip install paramiko")
+            return False
+    
+    password = None
+    if auth_method == "password":
+        import getpass
+        password = getpass.getpass(f"Enter password for {username}@{ip}: ")
+    else:
+        if not key_path:
+            print("❌ SSH key path not specified")
+            return False
+        if not Path(key_path).exists():
+            print(f"❌ SSH key file not found: {key_path}")
+            return False
     
     try:
-        # Create SSH client
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
         print("🔌 Attempting to connect...")
-        
-        if auth_method == "password":
-            import getpass
-            password = getpass.getpass(f"Enter password for {username}@{ip}: ")
-            ssh.connect(
-                hostname=ip,
-                username=username,
-                password=password,
-                port=int(port),
-                timeout=15
-            )
-        else:
-            if not key_path:
-                print("❌ SSH key path not specified")
-                return False
-            if not Path(key_path).exists():
-                print(f"❌ SSH key file not found: {key_path}")
-                return False
-            
-            ssh.connect(
-                hostname=ip,
-                username=username,
-                key_filename=key_path,
-                port=int(port),
-                timeout=15
-            )
-        
+        backend = open_backend(config, password)
         print("✅ SSH connection successful!")
         
-        # Test command execution
-        print("🧪 Testing command execution...")
-        stdin, stdout, stderr = ssh.exec_command("echo 'Hello from RaspFileSend!'")
-        output = stdout.read().decode().strip()
-        print(f"📤 Command output: {output}")
-        
-        # Test target directory
-        target_dir = config.get('TARGET', 'default_directory', fallback='/home/pi/uploads')
-        print(f"📁 Testing target directory: {target_dir}")
-        stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {target_dir} && ls -ld {target_dir}")
-        output = stdout.read().decode().strip()
-        if output:
-            print(f"✅ Target directory accessible: {output}")
-        else:
-            error = stderr.read().decode().strip()
-            print(f"⚠️  Target directory warning: {error}")
+        try:
+            # Test command execution
+            print("🧪 Testing command execution...")
+            status, output, error = backend.exec("echo 'Hello from RaspFileSend!'")
+            print(f"📤 Command output: {output.decode().strip()}")
+            
+            # Test target directory
+            target_dir = config.get('TARGET', 'default_directory', fallback='/home/pi/uploads')
+            print(f"📁 Testing target directory: {target_dir}")
+            status, output, error = backend.exec(f"mkdir -p -- {shlex.quote(target_dir)} && ls -ld -- {shlex.quote(target_dir)}")
+            output = output.decode().strip()
+            if output:
+                print(f"✅ Target directory accessible: {output}")
+            else:
+                print(f"⚠️  Target directory warning: {error.decode().strip()}")
+        finally:
+            backend.close()
         
-        ssh.close()
         print("🎉 All tests passed! Your RaspFileSend should work correctly.")
         return True
         
-    except paramiko.AuthenticationException:
-        print("❌ Authentication failed - check your username/password or SSH key")
-        return False
-    except paramiko.SSHException as e:
-        print(f"❌ SSH connection error: {e}")
-        return False
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
+        # The paramiko and OpenSSH backends both say so when the login was refused
+        if "Authentication failed" in str(e):
+            print("❌ Authentication failed - check your username/password or SSH key")
+        else:
+            print(f"❌ SSH connection error: {e}")
         return False
 
 if __name__ == "__main__":
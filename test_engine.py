@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Tests for the transfer engine, run against the local test Pi from conftest.py (run with pytest)
+"""
+
+import configparser
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+import raspfilesend_engine
+from raspfilesend_backend import LocalBackend
+from raspfilesend_compression import CompressionPolicy
+from raspfilesend_engine import CHUNK_SIZE, ParallelUploader, TarStreamUploader, run_transfer
+from raspfilesend_progress import ProgressTracker
+from raspfilesend_resume import PART_SUFFIX, CheckpointStore, chunk_digest
+
+
+@pytest.fixture(autouse=True)
+def checkpoints(tmp_path, monkeypatch):
+    """Keep chunk checkpoints out of the real home folder"""
+    store = CheckpointStore(tmp_path / 'checkpoints.json')
+    monkeypatch.setattr(raspfilesend_engine, 'get_checkpoint_store', lambda: store)
+    return store
+
+
+def make_config(**transfer):
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'SSH': {'streams': '2'},
+        'TRANSFER': dict({'mode': 'sftp', 'compression': 'off'}, **transfer),
+        'HISTORY': {'enabled': 'false'},
+    })
+    return config
+
+
+def make_tree(root, files):
+    for relative, data in files.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return root
+
+
+def read_tree(root):
+    return {os.path.relpath(os.path.join(folder, name), root).replace(os.sep, '/'):
+            open(os.path.join(folder, name), 'rb').read()
+            for folder, _, names in os.walk(root) for name in names}
+
+
+def test_batch_uses_parallel_streams(tmp_path, ssh, pi):
+    files = {f'file{i}.txt': f'data {i}'.encode() for i in range(10)}
+    source = make_tree(tmp_path / 'src', files)
+    (tmp_path / 'dst').mkdir()
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=3)
+
+    assert uploader.run([str(source / name) for name in files])
+
+    assert (uploader.transferred, uploader.failed) == (10, 0)
+    assert read_tree(tmp_path / 'dst') == files
+    # Three upload streams and the channel that lists the target directory
+    assert pi.opened == 4
+
+
+def test_overwrite_answers_apply_to_all_streams(tmp_path, ssh):
+    files = {f'file{i}.txt': b'new' for i in range(6)}
+    source = make_tree(tmp_path / 'src', files)
+    make_tree(tmp_path / 'dst', {name: b'old' for name in files})
+    asked = []
+
+    def ask_overwrite(filename):
+        asked.append(filename)
+        return "no_all"
+
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=3, ask_overwrite=ask_overwrite)
+    assert uploader.run([str(source / name) for name in files])
+
+    assert len(asked) == 1
+    assert (uploader.transferred, uploader.skipped) == (0, 6)
+    assert set(read_tree(tmp_path / 'dst').values()) == {b'old'}
+
+
+def test_large_file_is_written_in_chunks(tmp_path, ssh, checkpoints):
+    data = os.urandom(2 * CHUNK_SIZE + 1000)
+    source = make_tree(tmp_path / 'src', {'big.bin': data})
+    (tmp_path / 'dst').mkdir()
+    logged = []
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=2, log=logged.append,
+                                chunk_threshold=1024 * 1024)
+
+    assert uploader.run([str(source / 'big.bin')])
+
+    assert uploader.transferred == 1
+    assert any("3 chunks" in line for line in logged)
+    assert read_tree(tmp_path / 'dst') == {'big.bin': data}
+    assert checkpoints._entries == {}
+
+
+def test_chunked_upload_resumes(tmp_path, ssh, pi, checkpoints):
+    data = os.urandom(2 * CHUNK_SIZE + 1000)
+    source = make_tree(tmp_path / 'src', {'big.bin': data})
+    target = tmp_path / 'dst'
+    # An earlier attempt got the first chunk across before it was interrupted
+    make_tree(target, {'big.bin' + PART_SUFFIX: data[:CHUNK_SIZE] + b'\0' * (len(data) - CHUNK_SIZE)})
+    checkpoints.start(f'127.0.0.1:{pi.port}', f"{target}/big.bin", str(source / 'big.bin'),
+                      os.stat(source / 'big.bin'), CHUNK_SIZE, {0: chunk_digest(data[:CHUNK_SIZE])})
+    logged = []
+    uploader = ParallelUploader(ssh, str(target), streams=2, log=logged.append, chunk_threshold=1024 * 1024)
+
+    assert uploader.run([str(source / 'big.bin')])
+
+    assert uploader.transferred == 1
+    assert any(line.startswith("♻️ Resuming big.bin: 1 of 3 chunks") for line in logged)
+    assert read_tree(target) == {'big.bin': data}
+    assert checkpoints._entries == {}
+
+
+def test_chunk_writers_share_the_stream_budget(tmp_path, ssh, pi):
+    files = {'big1.bin': os.urandom(3 * CHUNK_SIZE), 'big2.bin': os.urandom(3 * CHUNK_SIZE), 'small.txt': b's'}
+    source = make_tree(tmp_path / 'src', files)
+    (tmp_path / 'dst').mkdir()
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=2, chunk_threshold=1024 * 1024)
+
+    assert uploader.run([str(source / name) for name in files])
+
+    assert uploader.transferred == 3
+    assert read_tree(tmp_path / 'dst') == files
+    # Two upload streams plus the channel that lists the target directory
+    assert pi.most_sessions <= 3
+
+
+def test_large_file_is_compressed_chunk_by_chunk(tmp_path, ssh):
+    data = b''.join(b'%08d,sensor,21.5\n' % i for i in range(1200000))[:2 * CHUNK_SIZE + 1000]
+    source = make_tree(tmp_path / 'src', {'log.csv': data})
+    (tmp_path / 'dst').mkdir()
+    logged = []
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=2, log=logged.append,
+                                chunk_threshold=1024 * 1024, compression=CompressionPolicy('on'))
+
+    assert uploader.run([str(source / 'log.csv')])
+
+    assert uploader.transferred == 1
+    assert any(line.startswith("🗜️ Compressing the chunks of log.csv") for line in logged)
+    assert read_tree(tmp_path / 'dst') == {'log.csv': data}
+
+
+def test_tar_stream(tmp_path, ssh):
+    files = {f'file{i:03d}.txt': f'line {i}\n'.encode() for i in range(40)}
+    source = make_tree(tmp_path / 'src', files)
+    (tmp_path / 'dst').mkdir()
+    logged = []
+    uploader = TarStreamUploader(ssh, str(tmp_path / 'dst'), log=logged.append)
+
+    assert uploader.run([str(source / name) for name in files])
+
+    assert uploader.transferred == 40
+    assert any("tar stream" in line for line in logged)
+    assert read_tree(tmp_path / 'dst') == files
+
+
+def test_sync_sends_only_changed_files(tmp_path, ssh):
+    source = make_tree(tmp_path / 'src', {'a.txt': b'a', 'b.txt': b'b'})
+    files = [str(source / 'a.txt'), str(source / 'b.txt')]
+    (tmp_path / 'dst').mkdir()
+    ParallelUploader(ssh, str(tmp_path / 'dst'), sync=True).run(files)
+
+    (source / 'b.txt').write_bytes(b'b, changed')
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), sync=True)
+    assert uploader.run(files)
+
+    assert (uploader.transferred, uploader.unchanged) == (1, 1)
+    assert (tmp_path / 'dst' / 'b.txt').read_bytes() == b'b, changed'
+
+
+def test_mirror_removes_extra_files(tmp_path, ssh):
+    source = make_tree(tmp_path / 'src', {'a.txt': b'a', 'b.txt': b'b'})
+    target = make_tree(tmp_path / 'dst', {'a.txt': b'old', 'b.txt': b'b', 'stale.txt': b'x', 'keep/x.txt': b'x'})
+    os.utime(target / 'b.txt', (os.stat(source / 'b.txt').st_atime, os.stat(source / 'b.txt').st_mtime))
+    uploader = ParallelUploader(ssh, str(target), mirror=True)
+
+    assert uploader.run([str(source / 'a.txt'), str(source / 'b.txt')])
+
+    assert (uploader.transferred, uploader.unchanged, uploader.removed) == (1, 1, 1)
+    # Folders that were not selected are left alone
+    assert read_tree(target) == {'a.txt': b'a', 'b.txt': b'b', 'keep/x.txt': b'x'}
+
+
+def test_target_with_spaces_is_created(tmp_path, ssh, monkeypatch):
+    source = make_tree(tmp_path / 'src', {'a.txt': b'a', 'b.txt': b'b'})
+    monkeypatch.chdir(tmp_path)
+
+    completed, uploader = run_transfer(ssh, make_config(), [str(source / 'a.txt'), str(source / 'b.txt')],
+                                       str(tmp_path / 'dst 2'), lambda message: None)
+
+    assert completed and uploader.transferred == 2
+    assert read_tree(tmp_path / 'dst 2') == {'a.txt': b'a', 'b.txt': b'b'}
+    # Nothing created from the halves of the quoted name
+    assert sorted(os.listdir(tmp_path)) == ['dst 2', 'src']
+
+
+def test_files_added_during_a_run_are_sent(tmp_path, ssh):
+    files = {f'file{i:02d}.txt': f'data {i}'.encode() for i in range(24)}
+    source = make_tree(tmp_path / 'src', files)
+    paths = [str(source / name) for name in files]
+    (tmp_path / 'dst').mkdir()
+    added = []
+    # One stream keeps the queue short, so the first file is done long before the last is queued
+    uploader = ParallelUploader(ssh, str(tmp_path / 'dst'), streams=1)
+
+    def log(message):
+        # A second Send To launch forwards its files while the first ones are being sent
+        if message.startswith("✅") and not added:
+            added.append(uploader.add_files(paths[20:]))
+
+    uploader.log = log
+    assert uploader.run(paths[:20])
+
+    assert added == [True]
+    assert (uploader.transferred, uploader.total) == (24, 24)
+    assert read_tree(tmp_path / 'dst') == files
+    assert not uploader.add_files(paths)
+
+
+@pytest.mark.parametrize('uploader_class', [ParallelUploader, TarStreamUploader])
+def test_mirror_reaches_into_selected_folders(tmp_path, ssh, uploader_class):
+    source = make_tree(tmp_path / 'src', {'site/index.html': b'i', 'site/css/a.css': b'a'})
+    target = make_tree(tmp_path / 'dst', {'site/old.html': b'x', 'site/css/old.css': b'x',
+                                         'site/gone/page.html': b'x', 'other/x.txt': b'x'})
+    logged = []
+    uploader = uploader_class(ssh, str(target), log=logged.append, mirror=True)
+
+    assert uploader.run([str(source / 'site')])
+
+    assert uploader.removed == 3
+    assert read_tree(target) == {'site/index.html': b'i', 'site/css/a.css': b'a', 'other/x.txt': b'x'}
+    assert not (target / 'site' / 'gone').exists()
+    assert "🗑️ Removed: site/gone/" in logged
+
+
+def test_progress_counts_every_byte(tmp_path, ssh):
+    files = {'big.bin': os.urandom(2 * CHUNK_SIZE + 1000), 'small.txt': b'small', 'same.txt': b'same'}
+    source = make_tree(tmp_path / 'src', files)
+    target = make_tree(tmp_path / 'dst', {'same.txt': b'same'})
+    os.utime(target / 'same.txt', (os.stat(source / 'same.txt').st_atime, os.stat(source / 'same.txt').st_mtime))
+    progress = ProgressTracker()
+    uploader = ParallelUploader(ssh, str(target), streams=2, chunk_threshold=1024 * 1024, sync=True,
+                                progress=progress)
+
+    assert uploader.run([str(source / name) for name in files])
+
+    snapshot = progress.snapshot(force=True)
+    total = sum(len(data) for data in files.values())
+    assert (snapshot['done'], snapshot['total'], snapshot['files']) == (total, total, [])
+    # The unchanged file counts as done without being sent
+    assert snapshot['sent'] == total - len(b'same')
+
+
+def test_conflict_rename_keeps_both(tmp_path, ssh):
+    source = make_tree(tmp_path / 'src', {'report.pdf': b'new', 'notes.txt': b'notes'})
+    target = make_tree(tmp_path / 'dst', {'report.pdf': b'old', 'notes.txt': b'old notes'})
+    seen = []
+
+    def resolve_conflicts(conflicts):
+        seen.extend(conflict['name'] for conflict in conflicts)
+        return {'report.pdf': 'rename', 'notes.txt': 'skip'}
+
+    completed, uploader = run_transfer(ssh, make_config(), [str(source / 'report.pdf'), str(source / 'notes.txt')],
+                                       str(target), lambda message: None, resolve_conflicts=resolve_conflicts)
+
+    assert completed and sorted(seen) == ['notes.txt', 'report.pdf']
+    assert (uploader.transferred, uploader.skipped) == (1, 1)
+    assert read_tree(target) == {'report.pdf': b'old', 'report (1).pdf': b'new', 'notes.txt': b'old notes'}
+
+
+@pytest.mark.parametrize('mode', ['sftp', 'tar'])
+def test_local_backend_needs_no_ssh(tmp_path, mode):
+    source = make_tree(tmp_path / 'src', {'site/index.html': b'<html>', 'site/img/logo.png': b'png'})
+    config = make_config(mode=mode)
+    backend = LocalBackend().connect(config)
+    try:
+        completed, uploader = run_transfer(backend, config, [str(source / 'site')], str(tmp_path / 'dst 2'),
+                                           lambda message: None)
+    finally:
+        backend.close()
+
+    assert completed and uploader.transferred == 2
+    assert read_tree(tmp_path / 'dst 2') == {'site/index.html': b'<html>', 'site/img/logo.png': b'png'}
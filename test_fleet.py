@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared file reads and the async engine of group transfers (run with pytest)
+"""
+
+import configparser
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_async import AsyncFleetTransfer
+from raspfilesend_fleet import SharedReadPool
+
+BLOCK = 1024
+
+
+def read_all(reader, path, size=-1):
+    with reader.open(path) as shared:
+        return shared.read(size) if size < 0 else b"".join(iter(lambda: shared.read(size), b''))
+
+
+def test_hosts_share_one_disk_read(tmp_path):
+    path = tmp_path / 'data.bin'
+    data = os.urandom(10 * BLOCK + 100)
+    path.write_bytes(data)
+    pool = SharedReadPool(capacity=64 * BLOCK, block_size=BLOCK)
+    readers = [pool.reader() for _ in range(3)]
+
+    results = [None] * len(readers)
+
+    def host(number):
+        results[number] = read_all(readers[number], str(path), 700)
+        readers[number].close()
+    threads = [threading.Thread(target=host, args=(number,)) for number in range(len(readers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [data] * 3
+    assert pool.disk_bytes == len(data)
+    assert pool.served_bytes == 3 * len(data)
+    # Every host has had every block, so nothing is kept
+    assert pool._size == 0
+
+
+def test_host_far_behind_reads_from_disk_again(tmp_path):
+    path = tmp_path / 'data.bin'
+    data = os.urandom(8 * BLOCK)
+    path.write_bytes(data)
+    pool = SharedReadPool(capacity=2 * BLOCK, block_size=BLOCK)
+    fast, slow = pool.reader(), pool.reader()
+
+    assert read_all(fast, str(path)) == data
+    assert pool._size <= 2 * BLOCK
+    assert read_all(slow, str(path)) == data
+    # Only the last blocks were still kept, and the slow host's own reads pushed them out
+    assert pool.disk_bytes == 2 * len(data)
+    assert pool._size <= 2 * BLOCK
+
+
+def test_closed_reader_releases_its_blocks(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(os.urandom(4 * BLOCK))
+    pool = SharedReadPool(capacity=64 * BLOCK, block_size=BLOCK)
+    reader, failed = pool.reader(), pool.reader()
+
+    read_all(reader, str(path))
+    assert pool._size == 4 * BLOCK
+    failed.close()
+    assert pool._size == 0
+
+
+def test_async_engine_sends_on_worker_threads(tmp_path):
+    source = tmp_path / 'src'
+    (source / 'img').mkdir(parents=True)
+    (source / 'index.html').write_bytes(b'<html>')
+    (source / 'img' / 'logo.png').write_bytes(os.urandom(3 * BLOCK))
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'SSH': {'ip': '127.0.0.1', 'username': 'pi', 'backend': 'local'},
+        'TRANSFER': {'engine': 'async'},
+        'HISTORY': {'enabled': 'false'},
+        'HOST pi1': {},
+    })
+    reported = []
+
+    fleet = AsyncFleetTransfer(config, ['pi1'], [str(source)], str(tmp_path / 'dst'), overwrite=True,
+                               report=lambda outcome, name, **details: reported.append((outcome, details['host'])))
+    results = fleet.run()
+
+    assert fleet.states == {'pi1': 'done'}
+    assert results['pi1']['transferred'] == 2
+    assert len(reported) == 2 and all(host == 'pi1' for _, host in reported)
+    assert (tmp_path / 'dst' / 'src' / 'img' / 'logo.png').read_bytes() == (source / 'img' / 'logo.png').read_bytes()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared SSH connection pool, run against the local test Pi from conftest.py (run with pytest)
+"""
+
+import configparser
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_backend import ParamikoBackend
+from raspfilesend_pool import ConnectionPool
+
+
+def make_config():
+    config = configparser.ConfigParser()
+    config.read_dict({'SSH': {'ip': '127.0.0.1', 'username': 'pi', 'auth_method': 'key'}})
+    return config
+
+
+def make_pool(pi, logins):
+    def connect(config, password, tracer=None):
+        logins.append(password)
+        return ParamikoBackend(pi.connect())
+    return ConnectionPool(keepalive=0, idle_seconds=0, connect=connect)
+
+
+def test_connection_is_reused(pi):
+    logins = []
+    pool = make_pool(pi, logins)
+    try:
+        with pool.connection(make_config()) as (first, reused):
+            assert not reused
+        with pool.connection(make_config()) as (second, reused):
+            assert reused and second is first
+        assert len(logins) == 1
+    finally:
+        pool.close_all()
+
+
+def test_fresh_login_replaces_the_cached_connection(pi):
+    logins = []
+    pool = make_pool(pi, logins)
+    try:
+        with pool.connection(make_config()) as (first, _):
+            pass
+        with pool.connection(make_config(), fresh=True) as (tested, reused):
+            assert not reused and tested is not first
+        # The old connection was retired, and the next transfer gets the tested one
+        assert not first.is_active()
+        with pool.connection(make_config()) as (backend, reused):
+            assert reused and backend is tested
+        assert len(logins) == 2
+    finally:
+        pool.close_all()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for transfer progress, throughput and ETA (run with pytest)
+"""
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_progress import ProgressTracker, count_in_background, describe
+
+
+def wait_for_count(tracker, timeout=5):
+    deadline = time.monotonic() + timeout
+    while tracker.snapshot(force=True)['counting'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_snapshot_counts_bytes():
+    tracker = ProgressTracker()
+    tracker.add_total(1000)
+    tracker.start_file('a.txt', 600)
+    tracker.advance('a.txt', 200)
+    tracker.advance('a.txt', 100, sent=False)  # Already on the Pi (resumed)
+    tracker.skip(400)
+
+    snapshot = tracker.snapshot(force=True)
+    assert (snapshot['done'], snapshot['total'], snapshot['sent']) == (700, 1000, 200)
+    assert snapshot['files'] == [{'name': 'a.txt', 'done': 300, 'size': 600, 'eta': None}]
+    assert not snapshot['counting']
+
+
+def test_unfinished_file_counts_as_done():
+    tracker = ProgressTracker()
+    tracker.add_total(500)
+    tracker.start_file('a.txt', 500)
+    tracker.advance('a.txt', 100)
+    tracker.finish_file('a.txt')  # Failed or cancelled halfway
+
+    snapshot = tracker.snapshot(force=True)
+    assert snapshot['done'] == 500
+    assert snapshot['files'] == []
+
+
+def test_snapshot_is_cached_between_updates():
+    tracker = ProgressTracker(interval=60)
+    first = tracker.snapshot()
+    tracker.add_total(100)
+    assert tracker.snapshot() is first
+    assert tracker.snapshot(force=True)['total'] == 100
+
+
+def test_initial_rate_gives_an_eta_until_counted():
+    tracker = ProgressTracker(initial_rate=100)
+    tracker.add_total(1000)
+    tracker.begin_count()
+    assert tracker.snapshot(force=True)['eta'] is None
+    assert describe(tracker.snapshot(force=True))[0].startswith("0 bytes of 1,000 bytes+")
+
+    tracker.end_count()
+    snapshot = tracker.snapshot(force=True)
+    assert snapshot['eta'] == 10
+    assert "ETA ~0:10" in describe(snapshot)[0]
+
+
+def test_count_in_background_walks_once_for_every_tracker(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a.bin').write_bytes(b'x' * 300)
+    (tmp_path / 'b.bin').write_bytes(b'y' * 200)
+    trackers = [ProgressTracker(), ProgressTracker()]
+
+    count_in_background(trackers, [str(tmp_path / 'sub'), str(tmp_path / 'b.bin'), str(tmp_path / 'gone')])
+    for tracker in trackers:
+        wait_for_count(tracker)
+
+    assert [tracker.snapshot(force=True)['total'] for tracker in trackers] == [500, 500]
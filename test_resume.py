@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the resumable upload checkpoints (run with pytest)
+"""
+
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import raspfilesend_resume
+from raspfilesend_resume import MAX_CHECKPOINT_AGE, CheckpointStore, chunk_digest, verify_remote_chunks
+
+CHUNK = 1024
+
+
+def local_file(tmp_path, size=3 * CHUNK):
+    path = tmp_path / 'big.bin'
+    path.write_bytes(os.urandom(size))
+    return str(path), os.stat(path)
+
+
+def test_confirmed_chunks_survive_a_restart(tmp_path):
+    path, stat = local_file(tmp_path)
+    store = CheckpointStore(tmp_path / 'checkpoints.json')
+    store.start('pi:22', '/home/pi/big.bin', path, stat, CHUNK)
+    store.confirm('pi:22', '/home/pi/big.bin', 0, 'aa')
+    store.confirm('pi:22', '/home/pi/big.bin', 2, 'cc')
+    store.flush()
+
+    reloaded = CheckpointStore(tmp_path / 'checkpoints.json')
+    assert reloaded.lookup('pi:22', '/home/pi/big.bin', path, stat, CHUNK) == {0: 'aa', 2: 'cc'}
+    assert reloaded.lookup('other:22', '/home/pi/big.bin', path, stat, CHUNK) == {}
+
+    reloaded.finish('pi:22', '/home/pi/big.bin')
+    assert CheckpointStore(tmp_path / 'checkpoints.json').lookup('pi:22', '/home/pi/big.bin', path, stat, CHUNK) == {}
+
+
+def test_confirmations_are_saved_in_batches(tmp_path, monkeypatch):
+    path, stat = local_file(tmp_path)
+    store = CheckpointStore(tmp_path / 'checkpoints.json')
+    store.start('pi:22', '/r/big.bin', path, stat, CHUNK)
+    saves = []
+    monkeypatch.setattr(store, '_save', lambda: saves.append(dict(store._entries)))
+    monkeypatch.setattr(raspfilesend_resume, 'FLUSH_INTERVAL', 3600)
+
+    for index in range(3):
+        store.confirm('pi:22', '/r/big.bin', index, 'ab')
+    assert saves == []
+    store.flush()
+    assert len(saves) == 1
+
+
+def test_changed_file_or_chunk_size_starts_over(tmp_path):
+    path, stat = local_file(tmp_path)
+    store = CheckpointStore(tmp_path / 'checkpoints.json')
+    store.start('pi:22', '/r/big.bin', path, stat, CHUNK, {0: 'aa'})
+
+    assert store.lookup('pi:22', '/r/big.bin', path, stat, CHUNK * 2) == {}
+    with open(path, 'ab') as f:
+        f.write(b'more')
+    assert store.lookup('pi:22', '/r/big.bin', path, os.stat(path), CHUNK) == {}
+
+
+def test_old_checkpoints_are_dropped(tmp_path):
+    checkpoint_path = tmp_path / 'checkpoints.json'
+    checkpoint_path.write_text(json.dumps({
+        'pi:22:/old': {'updated': time.time() - MAX_CHECKPOINT_AGE - 1, 'chunks': {}},
+        'pi:22:/new': {'updated': time.time(), 'chunks': {}},
+    }))
+    assert list(CheckpointStore(checkpoint_path)._entries) == ['pi:22:/new']
+
+
+def test_verify_remote_chunks_keeps_matching_chunks(tmp_path, ssh):
+    path, _ = local_file(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    part_path = tmp_path / 'big bin.part'
+    part_path.write_bytes(data[:CHUNK] + b'\0' * CHUNK + data[2 * CHUNK:])
+    chunks = {index: chunk_digest(data[index * CHUNK:(index + 1) * CHUNK]) for index in range(3)}
+
+    verified = verify_remote_chunks(ssh, str(part_path), chunks, CHUNK)
+    assert verified == {0: chunks[0], 2: chunks[2]}
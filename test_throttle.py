@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for the upload speed limits (run with pytest)
+"""
+
+import configparser
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_throttle import MAX_WAIT, TokenBucket, create_throttle
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket()
+    assert bucket.reserve(10 * 1024 * 1024) == 0
+    assert bucket.reserve(10 * 1024 * 1024) == 0
+    assert bucket.consumed == 20 * 1024 * 1024
+
+
+def test_reserve_lets_one_large_block_through_then_waits():
+    bucket = TokenBucket(1024 * 1024)
+    # Larger than the bucket: let through at once and paid back by the writers after it
+    assert bucket.reserve(4 * 1024 * 1024) == 0
+    wait = bucket.reserve(1024)
+    assert 0 < wait <= MAX_WAIT
+    assert bucket.consumed == 4 * 1024 * 1024
+
+
+def test_consume_holds_the_rate():
+    rate = 1024 * 1024
+    bucket = TokenBucket(rate)
+    started = time.monotonic()
+    for _ in range(10):
+        bucket.consume(64 * 1024)
+    elapsed = time.monotonic() - started
+    # The first block goes at once, the other 576 KB at 1 MB/s
+    assert 0.4 < elapsed < 1.5
+
+
+def test_set_rate_releases_waiting_writers():
+    bucket = TokenBucket(16 * 1024)
+    bucket.consume(1024 * 1024)  # About a minute of debt at this rate
+    finished = threading.Event()
+    writer = threading.Thread(target=lambda: (bucket.consume(1024), finished.set()), daemon=True)
+    writer.start()
+    time.sleep(0.1)
+    assert not finished.is_set()
+
+    bucket.set_rate(0)
+    assert finished.wait(2 * MAX_WAIT + 1)
+
+
+def test_low_priority_probes_the_connection(ssh):
+    config = configparser.ConfigParser()
+
+    throttle, backoff = create_throttle(config, ssh, low_priority=True)
+    try:
+        assert throttle.buckets == [backoff.bucket]
+    finally:
+        backoff.stop()
+
+
+class NoProbeTransport:
+    """A connection that cannot answer keepalive requests"""
+
+    def global_request(self, kind, data=None, wait=True):
+        raise IOError("round trips are only measured over a shared master connection")
+
+    def is_active(self):
+        return True
+
+
+class NoProbeClient:
+    def get_transport(self):
+        return NoProbeTransport()
+
+
+def test_low_priority_is_skipped_when_round_trips_cannot_be_measured():
+    config = configparser.ConfigParser()
+    logged = []
+
+    throttle, backoff = create_throttle(config, NoProbeClient(), low_priority=True, log=logged.append)
+
+    assert (throttle, backoff) == (None, None)
+    assert logged == ["⚠️ Low priority unavailable with this backend, sending without it"]
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the phase timing tracer (run with pytest)
+"""
+
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_trace import Tracer, read_sessions, summarize
+
+
+def test_spans_are_written_with_the_session(tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    tracer = Tracer(trace_path, 'transfer', host='10.0.0.21')
+    with tracer.span('upload', files=1) as span:
+        span['bytes'] = 1000
+    try:
+        with tracer.span('stat', file='a.txt'):
+            raise IOError("no such file")
+    except IOError:
+        pass
+
+    assert tracer.close() == trace_path
+    records = read_sessions(trace_path)[tracer.session]
+    assert [record['name'] for record in records] == ['upload', 'stat', 'transfer']
+    assert records[0]['bytes'] == 1000
+    assert records[1]['error'] == "no such file"
+    assert (records[-1]['kind'], records[-1]['host']) == ('session', '10.0.0.21')
+    # The session span is not a phase of its own
+    assert sorted((name, count, nbytes) for name, count, _, nbytes in summarize(records)) == \
+        [('stat', 1, 0), ('upload', 1, 1000)]
+
+
+def test_chrome_trace_is_exported(tmp_path):
+    tracer = Tracer(tmp_path / "trace.jsonl", 'transfer', chrome=True)
+    with tracer.span('mkdir'):
+        pass
+    tracer.close()
+
+    with open(tracer.chrome_path, encoding='utf-8') as chrome_file:
+        events = json.load(chrome_file)['traceEvents']
+    assert {event['name'] for event in events if event['ph'] == 'X'} == {'mkdir', 'transfer'}
+
+
+def test_close_with_session_name(tmp_path):
+    """A group transfer names its session after the host; that must not clash with the span name"""
+    closed = []
+    trace_path = tmp_path / "trace.jsonl"
+    tracer = Tracer(trace_path, 'transfer', on_close=lambda tracer, duration, fields: closed.append(fields),
+                    host='10.0.0.21', name='pi-kitchen')
+    with tracer.span('upload', bytes=1000, files=1):
+        pass
+
+    assert tracer.close() == trace_path
+    session = read_sessions(trace_path)[tracer.session][-1]
+    assert session['name'] == 'transfer'
+    assert session['kind'] == 'session'
+    assert session['label'] == 'pi-kitchen'
+    # The history still gets the fields as they were given
+    assert closed[0]['name'] == 'pi-kitchen'
+    assert tracer.phases['upload']['bytes'] == 1000
+
+
+def test_close_without_trace_file():
+    """With only the history on, close() records the phases and writes nothing"""
+    closed = []
+    tracer = Tracer(None, 'transfer', on_close=lambda tracer, duration, fields: closed.append(fields), name='pi-till')
+    try:
+        with tracer.span('stat', file='a.txt'):
+            raise IOError("no such file")
+    except IOError:
+        pass
+
+    assert tracer.close() is None
+    assert closed == [{'name': 'pi-till'}]
+    assert tracer.errors == [('stat', 'a.txt', "no such file")]
+    assert tracer.phases['stat']['count'] == 1
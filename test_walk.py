@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the folder walker and the batched remote mkdir commands (run with pytest)
+"""
+
+import os
+import shlex
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from raspfilesend_walk import MKDIR_BATCH_CHARS, mkdir_commands, mkdir_many, top_level_names, walk_files
+
+
+def make_tree(root, files):
+    for relative, data in files.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def test_walk_keeps_folder_structure(tmp_path):
+    make_tree(tmp_path, {'photos/a.jpg': b'a', 'photos/2024/b.jpg': b'b', 'notes.txt': b'n'})
+    (tmp_path / 'photos' / 'empty').mkdir()
+    made = []
+
+    files = list(walk_files([str(tmp_path / 'photos'), str(tmp_path / 'notes.txt')], made.append))
+
+    assert sorted(relative for _, relative in files) == ['notes.txt', 'photos/2024/b.jpg', 'photos/a.jpg']
+    assert all(os.path.isfile(local) for local, _ in files)
+    # The top folder first, then everything one level down in a single call; empty folders too
+    assert [sorted(folders) for folders in made] == [['photos'], ['photos/2024', 'photos/empty']]
+
+
+def test_walk_passes_missing_files_on(tmp_path):
+    missing = str(tmp_path / 'gone.txt')
+    assert list(walk_files([missing])) == [(missing, 'gone.txt')]
+
+
+def test_walk_keeps_same_named_folders_apart(tmp_path):
+    make_tree(tmp_path, {'a/photos/p.jpg': b'1', 'b/photos/p.jpg': b'22', 'c/photos': b'file'})
+    logged = []
+
+    files = dict((relative, local) for local, relative in
+                 walk_files([str(tmp_path / d / 'photos') for d in 'abc'], log=logged.append))
+
+    assert sorted(files) == ['photos (2)/p.jpg', 'photos (3)', 'photos/p.jpg']
+    assert files['photos (2)/p.jpg'] == str(tmp_path / 'b' / 'photos' / 'p.jpg')
+    assert len(logged) == 2
+
+
+def test_top_level_names_skips_taken_numbers():
+    names = top_level_names(['/x/report.pdf', '/y/report (2).pdf', '/z/report.pdf'])
+    assert [name for _, name in names] == ['report.pdf', 'report (2).pdf', 'report (3).pdf']
+
+
+def test_mkdir_many_quotes_names(tmp_path, ssh):
+    target = str(tmp_path / 'dst 2')
+    mkdir_many(ssh, [target] + [f"{target}/{name}" for name in ['a b', "it's", '-rf', 'a b/c']])
+
+    assert sorted(os.listdir(tmp_path)) == ['dst 2']
+    assert sorted(os.listdir(tmp_path / 'dst 2')) == ['-rf', 'a b', "it's"]
+    assert os.listdir(tmp_path / 'dst 2' / 'a b') == ['c']
+
+
+def test_mkdir_commands_quote_paths():
+    commands = list(mkdir_commands(['/home/pi/dst 2', "it's", '-rf']))
+    assert commands == ["mkdir -p -- '/home/pi/dst 2' 'it'\"'\"'s' -rf"]
+    assert shlex.split(commands[0])[3:] == ['/home/pi/dst 2', "it's", '-rf']
+
+
+def test_mkdir_commands_split_long_batches():
+    paths = [f"/home/pi/uploads/folder{i:05d}" for i in range(2000)]
+    commands = list(mkdir_commands(paths))
+
+    assert len(commands) > 1
+    assert all(len(command) < MKDIR_BATCH_CHARS + 100 for command in commands)
+    assert [path for command in commands for path in shlex.split(command)[3:]] == paths